@@ -6,48 +6,162 @@ and storage services. It handles file uploads and database record management
 for the SafeStreet road damage detection system.
 
 Key Features:
-    - Direct HTTP-based file upload to Appwrite Storage (bypasses SDK issues)
-    - Database record creation and updates with automatic data cleaning
+    - Direct HTTP-based file upload to Appwrite Storage from in-memory bytes
+      (bypasses SDK issues), using Appwrite's chunked upload protocol for
+      files larger than one chunk
+    - Database record upserts via the Appwrite REST API: partial updates,
+      deterministic document IDs and a local imageId -> documentId index
+    - One long-lived, pooled async HTTP client (HTTP/2, keep-alive) shared by
+      all storage and database calls
+    - Bulk record writes: the document IDs of many imageIds are resolved
+      with one query per page, then the records are patched concurrently
+    - Bucket listing (cursor pagination) and file downloads for bulk
+      re-processing
     - Handles Appwrite metadata fields automatically
+    - Request latency histogram and request counter by operation and status
+      code (see observability.py)
     - Async/await support for non-blocking operations
 
+Configuration (environment variables):
+    APPWRITE_HTTP2: Use HTTP/2 when the endpoint supports it (default: true)
+    APPWRITE_MAX_CONNECTIONS: Maximum open connections (default: 20)
+    APPWRITE_MAX_KEEPALIVE: Maximum idle keep-alive connections (default: 10)
+    APPWRITE_KEEPALIVE_EXPIRY: Seconds an idle connection is kept (default: 30)
+    APPWRITE_TIMEOUT_SECONDS: Per-request timeout (default: 30)
+    APPWRITE_RECORD_LOOKUP: Look up records created elsewhere before creating
+        one (default: true; disable if only this backend creates records)
+    APPWRITE_RECORD_INDEX_SIZE: Entries in the imageId -> documentId index (default: 10000)
+
 Author: SafeStreet Team
 """
 
 # Standard library imports
+import asyncio
+import logging
 import os
-import io
+import hashlib
+import time
+from collections import OrderedDict
 
 # Third-party imports
 import httpx
-from appwrite.client import Client
-from appwrite.services.databases import Databases
-from appwrite.services.storage import Storage
 from appwrite.query import Query
 from appwrite.id import ID
 from dotenv import load_dotenv
 import mimetypes
 
+# Local imports
+from observability import counter, histogram
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
 
 load_dotenv()
 
-# Initialize Appwrite Client
-client = Client()
-client.set_endpoint(os.getenv("APPWRITE_ENDPOINT"))
-client.set_project(os.getenv("APPWRITE_PROJECT_ID"))
-client.set_key(os.getenv("APPWRITE_API_KEY"))
+logger = logging.getLogger(__name__)
+
+APPWRITE_SECONDS = histogram("safestreet_appwrite_request_seconds", "Appwrite request latency.", ("operation",))
+APPWRITE_REQUESTS = counter(
+    "safestreet_appwrite_requests_total", "Appwrite requests by HTTP status (\"error\": no response).",
+    ("operation", "status")
+)
+
+# Shared async HTTP client, created by init_http_client() at app startup
+_http_client = None
+
+# Query Appwrite for records created outside this backend (e.g. by the mobile
+# app) before creating one under a deterministic ID
+RECORD_LOOKUP_ENABLED = os.getenv("APPWRITE_RECORD_LOOKUP", "true").lower() == "true"
+
+# Bounded imageId -> documentId index, filled lazily as records are written
+RECORD_INDEX_SIZE = int(os.getenv("APPWRITE_RECORD_INDEX_SIZE", "10000"))
+_document_index = OrderedDict()
+
+# Appwrite accepts single-request uploads up to this size; larger files are
+# sent in chunks of this size with Content-Range headers
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+# Maximum documents or files returned by one Appwrite list request
+LIST_PAGE_SIZE = 100
+
+# ============================================================================
+# HTTP CLIENT LIFECYCLE
+# ============================================================================
+
+def init_http_client():
+    """
+    Create the shared, pooled HTTP client for the Appwrite endpoint.
+
+    The client keeps connections alive between requests (and multiplexes them
+    over HTTP/2 when available), so uploads and database calls do not pay for
+    TCP and TLS setup every time.
+
+    Returns:
+        httpx.AsyncClient: The shared client
+    """
+    global _http_client
+    if _http_client is not None:
+        return _http_client
+
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("APPWRITE_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("APPWRITE_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("APPWRITE_KEEPALIVE_EXPIRY", "30"))
+    )
+    _http_client = httpx.AsyncClient(
+        base_url=os.getenv("APPWRITE_ENDPOINT"),
+        headers={
+            "X-Appwrite-Project": os.getenv("APPWRITE_PROJECT_ID"),
+            "X-Appwrite-Key": os.getenv("APPWRITE_API_KEY"),
+        },
+        http2=os.getenv("APPWRITE_HTTP2", "true").lower() == "true",
+        limits=limits,
+        timeout=float(os.getenv("APPWRITE_TIMEOUT_SECONDS", "30"))
+    )
+    logger.info("Appwrite HTTP client initialized.")
+    return _http_client
+
+
+async def close_http_client():
+    """
+    Close the shared HTTP client and its pooled connections.
+    """
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Appwrite HTTP client closed.")
 
-# Initialize Appwrite services
-db = Databases(client)
-storage = Storage(client)
+
+def get_http_client():
+    """
+    Return the shared HTTP client, creating it on first use.
+
+    Returns:
+        httpx.AsyncClient: The shared client
+    """
+    return _http_client or init_http_client()
 
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
+async def _request(operation: str, method: str, path: str, **kwargs):
+    """
+    Send a request with the shared client, recording its latency and status.
+    """
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = await get_http_client().request(method, path, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        APPWRITE_SECONDS.observe(time.perf_counter() - started, (operation,))
+        APPWRITE_REQUESTS.inc((operation, status))
+
+
 def _clean_appwrite_data(data: dict) -> dict:
     """
     Removes Appwrite's internal metadata fields from a dictionary
@@ -63,19 +177,83 @@ def _clean_appwrite_data(data: dict) -> dict:
         cleaned_data.pop(key, None) # Use pop with None default to avoid KeyError if key doesn't exist
     return cleaned_data
 
+
+def document_id_for(image_id: str) -> str:
+    """
+    Derive a deterministic Appwrite document ID (max 36 chars) from an imageId.
+    """
+    return "dmg_" + hashlib.sha256(image_id.encode("utf-8")).hexdigest()[:32]
+
+
+def _remember_document(image_id: str, document_id: str):
+    """
+    Record the document ID of an imageId in the bounded local index.
+    """
+    _document_index[image_id] = document_id
+    _document_index.move_to_end(image_id)
+    while len(_document_index) > RECORD_INDEX_SIZE:
+        _document_index.popitem(last=False)
+
+
+def _documents_path(database_id: str, collection_id: str) -> str:
+    """
+    Build the REST path of a collection's documents.
+    """
+    return f"/databases/{database_id}/collections/{collection_id}/documents"
+
+
+async def _list_documents(database_id: str, collection_id: str, queries: list) -> dict:
+    """
+    List documents matching the given queries via the REST API.
+    """
+    response = await _request(
+        "list_documents", "GET", _documents_path(database_id, collection_id),
+        params={"queries[]": queries}
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def _create_document(database_id: str, collection_id: str, document_id: str, data: dict) -> dict:
+    """
+    Create a document via the REST API.
+    """
+    response = await _request(
+        "create_document", "POST", _documents_path(database_id, collection_id),
+        json={"documentId": document_id, "data": data}
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def _update_document(database_id: str, collection_id: str, document_id: str, data: dict) -> dict:
+    """
+    Update fields of an existing document via the REST API.
+    """
+    response = await _request(
+        "update_document", "PATCH", f"{_documents_path(database_id, collection_id)}/{document_id}",
+        json={"data": data}
+    )
+    response.raise_for_status()
+    return response.json()
+
 # ============================================================================
 # PUBLIC FUNCTIONS
 # ============================================================================
 
-async def upload_to_storage(file_path: str, bucket_id: str):
+async def upload_to_storage(file_content: bytes, file_name: str, bucket_id: str):
     """
-    Upload a file to Appwrite Storage using direct HTTP requests.
+    Upload in-memory file content to Appwrite Storage using direct HTTP requests.
     
     This function bypasses the Appwrite SDK's file upload method and uses
     direct HTTP requests via httpx to avoid SDK-related file handling issues.
+    The content is sent straight from memory; nothing is read from disk.
+    Files larger than UPLOAD_CHUNK_SIZE are uploaded chunk by chunk, so at
+    most one chunk is copied into a request body at a time.
     
     Args:
-        file_path: Absolute path to the file to upload
+        file_content: Raw bytes (or any bytes-like buffer) of the file to upload
+        file_name: File name to store in Appwrite (also used to guess the MIME type)
         bucket_id: Appwrite storage bucket ID
     
     Returns:
@@ -85,137 +263,256 @@ async def upload_to_storage(file_path: str, bucket_id: str):
         httpx.HTTPStatusError: If the HTTP request fails
     """
     try:
-        file_name = os.path.basename(file_path)
         # Determine MIME type from file extension
-        mime_type, _ = mimetypes.guess_type(file_path)
+        mime_type, _ = mimetypes.guess_type(file_name)
         if not mime_type:
             mime_type = "application/octet-stream"
 
-        # Read the entire file content into memory as bytes
-        with open(file_path, "rb") as f:
-            file_content = f.read()
-
         # Generate a unique file ID
         appwrite_file_id = ID.unique()
 
-        # Get Appwrite configuration from environment
-        appwrite_endpoint = os.getenv("APPWRITE_ENDPOINT")
-        project_id = os.getenv("APPWRITE_PROJECT_ID")
-        api_key = os.getenv("APPWRITE_API_KEY")
-
-        # Construct upload URL
-        upload_url = f"{appwrite_endpoint}/storage/buckets/{bucket_id}/files"
-
-        # Prepare request headers
-        headers = {
-            "X-Appwrite-Project": project_id,
-            "X-Appwrite-Key": api_key,
-            # Content-Type will be set automatically by httpx for multipart/form-data
-        }
-
-        # Prepare multipart form data
-        files = {
-            'file': (file_name, file_content, mime_type)
-        }
-        
         # Set file permissions
         data = {
             'fileId': appwrite_file_id,
             'permissions[]': ['read("any")', 'write("any")']
         }
 
-        # Upload file using async HTTP client
-        print(f"DEBUG: Attempting direct HTTPX upload of '{file_name}' to bucket '{bucket_id}'...")
-        async with httpx.AsyncClient() as http_client:
-            response = await http_client.post(upload_url, headers=headers, files=files, data=data)
-        
-        response.raise_for_status()
+        # Upload file using the shared async HTTP client
+        # (Content-Type is set automatically by httpx for multipart/form-data)
+        logger.debug(f"Attempting direct HTTPX upload of '{file_name}' to bucket '{bucket_id}'...")
+        view = memoryview(file_content)
+        size = len(view)
+        if size <= UPLOAD_CHUNK_SIZE:
+            response = await _request(
+                "upload_file", "POST", f"/storage/buckets/{bucket_id}/files",
+                files={'file': (file_name, file_content, mime_type)},
+                data=data
+            )
+            response.raise_for_status()
+        else:
+            # Chunked upload: every chunk carries its byte range; chunks after
+            # the first also name the file being assembled
+            headers = {}
+            for offset in range(0, size, UPLOAD_CHUNK_SIZE):
+                end = min(offset + UPLOAD_CHUNK_SIZE, size) - 1
+                headers["Content-Range"] = f"bytes {offset}-{end}/{size}"
+                response = await _request(
+                    "upload_file", "POST", f"/storage/buckets/{bucket_id}/files",
+                    files={'file': (file_name, view[offset:end + 1].tobytes(), mime_type)},
+                    data=data,
+                    headers=headers
+                )
+                response.raise_for_status()
+                headers["x-appwrite-id"] = response.json()["$id"]
+            logger.info(f"Uploaded '{file_name}' in {(size + UPLOAD_CHUNK_SIZE - 1) // UPLOAD_CHUNK_SIZE} chunks.")
 
         result = response.json()
-        print(f"✅ Uploaded file via HTTPX. File ID: {result['$id']}")
+        logger.info(f"✅ Uploaded file via HTTPX. File ID: {result['$id']}")
         return result["$id"]
 
     except httpx.HTTPStatusError as e:
-        print(f"❌ HTTPX Upload failed with status {e.response.status_code}: {e.response.text}")
+        logger.error(f"❌ HTTPX Upload failed with status {e.response.status_code}: {e.response.text}")
         return None
     except Exception as e:
-        print(f"❌ Upload failed: {e}")
+        logger.error(f"❌ Upload failed: {e}")
         return None
 
 
-async def update_damage_record(original_image_id: str, data: dict):
+async def update_damage_record(original_image_id: str, data: dict, lookup: bool = True, create: bool = True):
     """
-    Update or create a damage record in Appwrite database.
+    Upsert a damage record in Appwrite database, sending only the given fields.
+    
+    The record for an imageId is resolved in as few round trips as possible:
+    
+    1. If the document ID is already in the local imageId index, the fields
+       are patched directly (one request).
+    2. Otherwise, unless APPWRITE_RECORD_LOOKUP is disabled, a slim query
+       finds a record created elsewhere (e.g. by the mobile app) and patches it.
+    3. If no record exists, one is created under a deterministic document ID
+       derived from the imageId. If another worker created it first, the
+       conflict (409) falls back to a partial update of that document. With
+       create=False the document under that ID is only patched if it exists.
     
-    This function searches for an existing record with the given imageId.
-    If found, it updates the record with new data. If not found, it creates
-    a new record. All Appwrite internal metadata fields are automatically
-    cleaned before sending data.
+    Only the fields in `data` are sent; existing fields are never read back
+    and rewritten, so concurrent writers cannot overwrite each other's fields.
     
     Args:
         original_image_id: Unique identifier for the image
-        data: Dictionary containing damage record data
+        data: Dictionary containing the damage record fields to set
+        lookup: Allow the lookup query of step 2 (False when the caller
+            already knows no record exists for an unindexed imageId)
+        create: Create the record if none exists (False for updates that
+            only make sense on an existing record, e.g. a status change)
     
     Returns:
         dict: Appwrite document response if successful, None otherwise
+            (including when create is False and no record exists)
     """
     database_id = os.getenv("APPWRITE_DATABASE_ID")
     collection_id = os.getenv("APPWRITE_COLLECTION_ID")
+    changes = _clean_appwrite_data(data)
 
     try:
-        # Query for existing document with matching imageId
-        # This checks if a record for this image already exists in the database.
-        query_result = db.list_documents(
-            database_id=database_id,
-            collection_id=collection_id,
-            queries=[Query.equal("imageId", original_image_id)]
-        )
-
-        # Check if document exists
-        if query_result.get('total', 0) > 0:
-            document_id = query_result['documents'][0]['$id']
-            existing_document_data = query_result['documents'][0]
-
-            # Merge new data with existing document data
-            # This ensures that fields not present in 'data' but existing
-            # in the document are preserved, and new/updated fields from
-            # 'data' overwrite old ones.
-            merged_data = existing_document_data.copy()
-            merged_data.update(data)
-
-            # Remove Appwrite metadata fields
-            data_to_send = _clean_appwrite_data(merged_data)
-
-            # Update the existing document
-
-            updated_document = db.update_document(
+        # 1. Known document: patch it directly
+        document_id = _document_index.get(original_image_id)
+        if document_id:
+            try:
+                updated_document = await _update_document(database_id, collection_id, document_id, changes)
+                logger.info(f"✅ Document {document_id} updated successfully.")
+                return updated_document
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    raise
+                # Document was deleted since it was indexed
+                _document_index.pop(original_image_id, None)
+
+        # 2. Look up a record created outside this backend
+        if RECORD_LOOKUP_ENABLED and lookup:
+            query_result = await _list_documents(
                 database_id=database_id,
                 collection_id=collection_id,
-                document_id=document_id,
-                data=data_to_send
+                queries=[
+                    Query.equal("imageId", original_image_id),
+                    Query.select(["imageId"]),
+                    Query.limit(1)
+                ]
             )
-            print(f"✅ Document {document_id} updated successfully.")
+            if query_result.get('documents'):
+                document_id = query_result['documents'][0]['$id']
+                _remember_document(original_image_id, document_id)
+                updated_document = await _update_document(database_id, collection_id, document_id, changes)
+                logger.info(f"✅ Document {document_id} updated successfully.")
+                return updated_document
+
+        # 3. Create under a deterministic ID; on conflict, patch that document
+        document_id = document_id_for(original_image_id)
+        if not create:
+            try:
+                updated_document = await _update_document(database_id, collection_id, document_id, changes)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    raise
+                logger.info(f"No record for imageId {original_image_id}; nothing updated.")
+                return None
+            _remember_document(original_image_id, document_id)
+            logger.info(f"✅ Document {document_id} updated successfully.")
             return updated_document
-        else:
-            # Create new document if none exists
-            data["imageId"] = original_image_id
-            data_to_send = _clean_appwrite_data(data)
-
-            new_document = db.create_document(
-                database_id=database_id,
-                collection_id=collection_id,
-                document_id=ID.unique(),
-                data=data_to_send
+        try:
+            new_document = await _create_document(
+                database_id,
+                collection_id,
+                document_id,
+                {**changes, "imageId": original_image_id}
             )
-            print(f"✅ New document created for imageId: {original_image_id}. Document ID: {new_document['$id']}")
-            return new_document
+            logger.info(f"✅ New document created for imageId: {original_image_id}. Document ID: {new_document['$id']}")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 409:
+                raise
+            new_document = await _update_document(database_id, collection_id, document_id, changes)
+            logger.info(f"✅ Document {document_id} updated successfully.")
+        _remember_document(original_image_id, document_id)
+        return new_document
 
+    except httpx.HTTPStatusError as e:
+        logger.error(f"❌ Failed to update/create document in Appwrite (status {e.response.status_code}): {e.response.text}")
+        return None
     except Exception as e:
-        print(f"❌ Failed to update/create document in Appwrite: {e}")
+        logger.error(f"❌ Failed to update/create document in Appwrite: {e}")
         return None
 
 
+async def update_damage_records(records: list, concurrency: int = 8):
+    """
+    Upsert many damage records with as few round trips as possible.
+
+    ImageIds missing from the local index are resolved with one query per
+    LIST_PAGE_SIZE imageIds (unless APPWRITE_RECORD_LOOKUP is disabled), so
+    every record then costs a single patch or create request. The writes run
+    concurrently over the pooled client.
+
+    Args:
+        records: List of (original_image_id, data) tuples
+        concurrency: Maximum number of write requests in flight
+
+    Returns:
+        list: Appwrite document response (or None on failure) per record, in order
+    """
+    database_id = os.getenv("APPWRITE_DATABASE_ID")
+    collection_id = os.getenv("APPWRITE_COLLECTION_ID")
+
+    resolved = True
+    if RECORD_LOOKUP_ENABLED:
+        unknown = list(dict.fromkeys(image_id for image_id, _ in records if image_id not in _document_index))
+        for start in range(0, len(unknown), LIST_PAGE_SIZE):
+            page = unknown[start:start + LIST_PAGE_SIZE]
+            try:
+                query_result = await _list_documents(
+                    database_id=database_id,
+                    collection_id=collection_id,
+                    queries=[
+                        Query.equal("imageId", page),
+                        Query.select(["imageId"]),
+                        Query.limit(LIST_PAGE_SIZE)
+                    ]
+                )
+            except Exception as e:
+                # Fall back to one lookup per record
+                logger.error(f"❌ Bulk record lookup failed: {e}")
+                resolved = False
+                continue
+            for document in query_result.get("documents", []):
+                _remember_document(document["imageId"], document["$id"])
+
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def write(original_image_id, data):
+        async with slots:
+            return await update_damage_record(original_image_id, data, lookup=not resolved)
+
+    return await asyncio.gather(*(write(image_id, data) for image_id, data in records))
+
+
+async def list_files(bucket_id: str, cursor: str = None):
+    """
+    List one page of files in an Appwrite Storage bucket.
 
+    Args:
+        bucket_id: Appwrite storage bucket ID
+        cursor: ID of the last file of the previous page (None for the first page)
 
+    Returns:
+        list: File objects ($id, name, mimeType, sizeOriginal, ...); fewer
+        than LIST_PAGE_SIZE files means this is the last page
+
+    Raises:
+        httpx.HTTPStatusError: If the HTTP request fails
+    """
+    queries = [Query.limit(LIST_PAGE_SIZE)]
+    if cursor:
+        queries.append(Query.cursor_after(cursor))
+    response = await _request("list_files", "GET", f"/storage/buckets/{bucket_id}/files", params={"queries[]": queries})
+    response.raise_for_status()
+    return response.json().get("files", [])
 
 
+async def download_file(bucket_id: str, file_id: str):
+    """
+    Download a file from Appwrite Storage into memory.
+
+    Args:
+        bucket_id: Appwrite storage bucket ID
+        file_id: Appwrite file ID
+
+    Returns:
+        bytes: File content if successful, None otherwise
+    """
+    try:
+        response = await _request("download_file", "GET", f"/storage/buckets/{bucket_id}/files/{file_id}/download")
+        response.raise_for_status()
+        return response.content
+    except httpx.HTTPStatusError as e:
+        logger.error(f"❌ Download of {file_id} failed with status {e.response.status_code}: {e.response.text}")
+        return None
+    except Exception as e:
+        logger.error(f"❌ Download of {file_id} failed: {e}")
+        return None
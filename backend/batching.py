@@ -0,0 +1,184 @@
+"""
+Micro-Batching Inference Scheduler
+
+This module provides the BatchScheduler class, which collects decoded images
+from concurrent requests and runs them through the YOLO model as a single
+batch. Each caller awaits its own future and receives the Results object for
+its own image, so endpoints can treat the scheduler like a per-image model call.
+
+Features:
+    - Dynamic batching bounded by a maximum batch size and a maximum wait time
+    - One future per submitted image, resolved with that image's Results
+    - Inference is delegated to an async predict function (typically backed by
+      the inference executor) so the event loop is never blocked
+    - Several batches can be in flight at once to keep multiple workers busy
+    - Images whose caller has gone away are dropped before inference
+    - Works for any batched async call (e.g. bulk database writes), not only
+      YOLO; `name` labels its log lines and metrics (batch size and batch
+      run time histograms, see observability.py)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import asyncio
+import logging
+import time
+
+# Local imports
+from observability import histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = histogram(
+    "safestreet_batch_size", "Items per dispatched batch.", ("name",), buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+BATCH_SECONDS = histogram("safestreet_batch_seconds", "Run time of one batch.", ("name",))
+
+
+class BatchScheduler:
+    """
+    Queue images from concurrent callers and run them through YOLO in batches.
+
+    A batch is dispatched as soon as either `max_batch_size` images are waiting
+    or the oldest waiting image has been queued for `max_wait_ms` milliseconds.
+    While a batch is running, newly submitted images accumulate for the next one.
+
+    Attributes:
+        predict: Coroutine function mapping a list of images to a list of Results
+        max_batch_size: Maximum number of images per model call
+        max_wait: Maximum time (seconds) the oldest image waits for a batch to fill
+        max_concurrent_batches: Maximum number of batches running at once
+        name: Label of the batched call in log lines and metrics
+    """
+
+    def __init__(self, predict, max_batch_size=8, max_wait_ms=20.0, max_concurrent_batches=1,
+                 name="YOLO inference"):
+        """
+        Initialize the scheduler.
+
+        Args:
+            predict: Coroutine function taking a list of images and returning
+                one Results object per image, in order
+            max_batch_size: Maximum number of images per batch
+            max_wait_ms: Maximum time in milliseconds to wait for a batch to fill
+            max_concurrent_batches: Maximum number of batches running at once
+                (usually the number of inference workers)
+            name: Label of the batched call in log lines and metrics
+        """
+        self.predict = predict
+        self.name = name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_concurrent_batches = max(1, int(max_concurrent_batches))
+
+        # Waiting items are (image, future, enqueue_time) tuples
+        self._pending = []
+        self._wakeup = None
+        self._worker = None
+        self._slots = None
+        self._running = set()
+
+    async def submit(self, image):
+        """
+        Queue a decoded image and wait for its detection results.
+
+        Args:
+            image: Decoded image as a BGR NumPy array
+
+        Returns:
+            ultralytics.engine.results.Results: Detection results for this image
+
+        Raises:
+            Exception: Any error raised by the model for the batch containing the image
+        """
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._worker = loop.create_task(self._run())
+
+        future = loop.create_future()
+        self._pending.append((image, future, loop.time()))
+        self._wakeup.set()
+        return await future
+
+    async def _run(self):
+        """
+        Background loop that forms batches and dispatches them to the model.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            # Wait for a free slot first so images keep accumulating meanwhile
+            await self._slots.acquire()
+
+            # Wait until the batch is full or the oldest image has waited long enough
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+
+            # Run the batch in the background so the next one can start forming
+            task = loop.create_task(self._execute(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, batch):
+        """
+        Run one batch through the model and resolve the callers' futures.
+
+        Args:
+            batch: List of (image, future, enqueue_time) tuples
+        """
+        try:
+            # Skip images whose caller was cancelled (e.g. client disconnected)
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                return
+
+            images = [item[0] for item in batch]
+            started = time.perf_counter()
+            results = await self.predict(images)
+        except Exception as e:
+            logger.error(f"❌ Error during batched {self.name}: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        elapsed = time.perf_counter() - started
+        BATCH_SIZE.observe(len(images), (self.name,))
+        BATCH_SECONDS.observe(elapsed, (self.name,))
+        logger.info(f"Batched {self.name}: {len(images)} image(s) in {elapsed * 1000:.1f} ms")
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        """
+        Return the current state of the scheduler.
+
+        Returns:
+            dict: Number of images waiting for a batch and batches running
+        """
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "pending_images": len(self._pending),
+            "running_batches": len(self._running)
+        }
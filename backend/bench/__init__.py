@@ -0,0 +1,13 @@
+"""
+SafeStreet Benchmark Suite
+
+Offline benchmarks of the processing pipeline: a synthetic road image
+corpus (corpus.py), fake Gemini and Appwrite servers with latency and error
+injection (fake_services.py), and the runner with stage microbenchmarks,
+load tests and baseline comparison (run.py).
+
+Usage (from the backend directory):
+    python -m bench.run --output results.json
+
+Author: SafeStreet Team
+"""
@@ -0,0 +1,82 @@
+"""
+Benchmark Corpus - Synthetic Road Images
+
+This module builds the image corpus used by the benchmark suite. Images are
+generated from a seed, so every run (and every machine) measures the same
+bytes; a directory of real photos can be used instead.
+
+Key Features:
+    - Road scenes (image_utils.synthetic_road_image: asphalt, lane markings,
+      potholes, cracks, manhole covers) at phone, dashcam and webcam sizes
+    - Deterministic: the same seed and sizes give byte-identical JPEGs
+    - Every image is distinct, so result caching cannot skew a load test
+    - Directory loader for a bundled or real corpus (JPEG/PNG/WebP)
+
+Usage:
+    images = synthetic_corpus(count=12, seed=7)
+    images = load_corpus("corpus/")
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import os
+
+# Third-party imports
+import cv2
+import numpy as np
+
+# Local imports
+from image_utils import encode_image, synthetic_road_image
+
+# (width, height) of the generated images: phone photo, dashcam, webcam
+DEFAULT_SIZES = ((4032, 3024), (1920, 1080), (1280, 720))
+
+# File extensions picked up by load_corpus()
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def synthetic_corpus(count=12, seed=7, sizes=DEFAULT_SIZES, quality=90):
+    """
+    Generate a deterministic corpus of JPEG road images.
+
+    Args:
+        count: Number of images
+        seed: Random seed
+        sizes: (width, height) tuples, cycled through
+        quality: JPEG quality
+
+    Returns:
+        list: (name, jpeg_bytes) tuples
+    """
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        image = synthetic_road_image(width, height, rng)
+        corpus.append((f"synthetic_{i:03d}_{width}x{height}.jpg",
+                       encode_image(image, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, int(quality)])))
+    return corpus
+
+
+def load_corpus(path):
+    """
+    Read every image file of a directory (sorted by name).
+
+    Args:
+        path: Directory with images
+
+    Returns:
+        list: (name, bytes) tuples
+
+    Raises:
+        ValueError: If the directory contains no images
+    """
+    corpus = []
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(path, name), "rb") as f:
+                corpus.append((name, f.read()))
+    if not corpus:
+        raise ValueError(f"No images found in {path}.")
+    return corpus
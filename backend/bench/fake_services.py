@@ -0,0 +1,389 @@
+"""
+Fake Services - Local Gemini and Appwrite Servers for Benchmarks
+
+This module provides HTTP stand-ins for the two external services the
+backend talks to, so the pipeline can be load-tested offline and without
+quota. Both answer with the formats the real services use, after a
+configurable latency, and fail a configurable fraction of requests.
+
+Key Features:
+    - Fake Gemini: generateContent on any model path (REST transport, see
+      GEMINI_API_ENDPOINT in gemini_client.py); replies follow the prompt's
+      requested format (fake_reply_text)
+    - FakeGeminiModel: in-process stand-in for genai.GenerativeModel with
+      the same replies, passed to the Predictor or GeminiClient directly
+    - Fake Appwrite: storage uploads (single and chunked), file listing and
+      downloads, document list/create/update, all in memory
+    - Latency: fixed mean plus optional jitter; errors: 503 responses (Gemini
+      and Appwrite both treat them as retryable)
+    - Runs in a background thread of the benchmark process, or standalone
+
+Usage:
+    with FakeService(create_gemini_app(latency_ms=300), 8601) as gemini:
+        os.environ["GEMINI_API_ENDPOINT"] = gemini.url
+
+    predictor = Predictor("best.pt", None, gemini_model=FakeGeminiModel(latency=0.2))
+
+    python -m bench.fake_services --gemini-port 8601 --appwrite-port 8602 --error-rate 0.05
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+# Third-party imports
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from google.api_core import exceptions as google_exceptions
+
+
+class FaultInjector:
+    """
+    Delay and fail requests of a fake service.
+
+    Attributes:
+        latency: Mean delay per request in seconds
+        jitter: Maximum deviation from the mean in seconds
+        error_rate: Fraction of requests answered with 503
+        requests: Number of requests seen
+        errors: Number of injected errors
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        """
+        Initialize the injector.
+        """
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+
+    async def __call__(self):
+        """
+        Wait for the request's latency; return a 503 response or None.
+        """
+        self.requests += 1
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        if delay:
+            await asyncio.sleep(delay)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return JSONResponse(status_code=503, content={"message": "Injected failure", "code": 503})
+        return None
+
+    def stats(self):
+        """
+        Return request and injected error counts.
+        """
+        return {"requests": self.requests, "errors": self.errors}
+
+# ============================================================================
+# FAKE GEMINI
+# ============================================================================
+
+def fake_reply_text(prompt):
+    """
+    Return a reply in the format the prompt asks for.
+
+    Args:
+        prompt: Text part of the request
+
+    Returns:
+        str: A fenced JSON report, a JSON array with one entry per listed
+        crop, or the sectioned per-crop analysis
+    """
+    if "JSON array" in prompt:
+        count = len(re.findall(r"^- Image \d+:", prompt, flags=re.MULTILINE))
+        return json.dumps([
+            {"index": i, "severity": "moderate", "severity_analysis": "Fake analysis.",
+             "location": "Center of the crop.", "repair": "Patch the surface."}
+            for i in range(count)
+        ])
+    if "JSON format" in prompt:
+        types = sorted(set(re.findall(r"- Type: ([^,]+),", prompt))) or ["None"]
+        return "```json\n" + json.dumps({
+            "summary": f"Fake report: {', '.join(types)}.",
+            "damage_types": types,
+            "overall_severity": 2 if types != ["None"] else 1
+        }) + "\n```"
+    return (
+        "**1. Severity Analysis:** Moderate damage (fake analysis).\n"
+        "**2. Location Description:** Center of the crop.\n"
+        "**3. Repair Recommendations:** Patch the surface."
+    )
+
+
+class _FakeResponse:
+    """Minimal stand-in for GenerateContentResponse."""
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+
+class FakeGeminiModel:
+    """
+    Offline stand-in for genai.GenerativeModel with configurable latency and
+    failure rate. Replies follow the format each prompt asks for: a JSON
+    report, a JSON array per crop, or the sectioned per-crop analysis.
+
+    Attributes:
+        latency: Seconds each call takes
+        error_rate: Fraction of calls failing with 503 Service Unavailable
+    """
+
+    def __init__(self, latency=0.2, error_rate=0.0):
+        """
+        Initialize the fake model.
+
+        Args:
+            latency: Seconds each call takes
+            error_rate: Fraction of calls failing with 503
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+
+    async def generate_content_async(self, contents, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._reply(contents)
+
+    def generate_content(self, contents, **kwargs):
+        time.sleep(self.latency)
+        return self._reply(contents)
+
+    def _reply(self, contents):
+        if random.random() < self.error_rate:
+            raise google_exceptions.ServiceUnavailable("Fake Gemini outage")
+        prompt = contents[0] if contents and isinstance(contents[0], str) else ""
+        return _FakeResponse(fake_reply_text(prompt))
+
+
+def create_gemini_app(latency_ms=300.0, jitter_ms=0.0, error_rate=0.0):
+    """
+    Create the fake Gemini API.
+
+    Args:
+        latency_ms: Mean response time in milliseconds
+        jitter_ms: Maximum deviation from the mean in milliseconds
+        error_rate: Fraction of requests failing with 503
+
+    Returns:
+        fastapi.FastAPI: App with app.state.faults (FaultInjector)
+    """
+    app = FastAPI()
+    app.state.faults = FaultInjector(latency_ms, jitter_ms, error_rate)
+
+    @app.post("/{path:path}")
+    async def generate_content(path: str, request: Request):
+        body = await request.json()
+        failure = await app.state.faults()
+        if failure:
+            return failure
+        if not path.endswith(":generateContent"):
+            return JSONResponse(status_code=404, content={"error": {"code": 404, "message": f"Unknown path {path}"}})
+        parts = body.get("contents", [{}])[0].get("parts", [])
+        prompt = next((part["text"] for part in parts if "text" in part), "")
+        return {
+            "candidates": [{
+                "content": {"parts": [{"text": fake_reply_text(prompt)}], "role": "model"},
+                "finishReason": "STOP",
+                "index": 0
+            }]
+        }
+
+    return app
+
+# ============================================================================
+# FAKE APPWRITE
+# ============================================================================
+
+def create_appwrite_app(latency_ms=30.0, jitter_ms=0.0, error_rate=0.0):
+    """
+    Create the fake Appwrite REST API (mounted under /v1).
+
+    Args:
+        latency_ms: Mean response time in milliseconds
+        jitter_ms: Maximum deviation from the mean in milliseconds
+        error_rate: Fraction of requests failing with 503
+
+    Returns:
+        fastapi.FastAPI: App with app.state.faults, app.state.files and
+        app.state.documents
+    """
+    app = FastAPI()
+    app.state.faults = FaultInjector(latency_ms, jitter_ms, error_rate)
+    app.state.files = {}
+    app.state.documents = {}
+
+    def queries(request):
+        return [json.loads(query) for query in request.query_params.getlist("queries[]")]
+
+    @app.middleware("http")
+    async def inject_faults(request, call_next):
+        failure = await app.state.faults()
+        return failure or await call_next(request)
+
+    @app.post("/v1/storage/buckets/{bucket_id}/files")
+    async def upload_file(bucket_id: str, request: Request):
+        form = await request.form()
+        upload = form["file"]
+        data = await upload.read()
+        file_id = request.headers.get("x-appwrite-id") or form.get("fileId")
+        if not file_id or file_id == "unique()":
+            file_id = uuid.uuid4().hex[:20]
+        entry = app.state.files.setdefault(
+            file_id, {"$id": file_id, "bucketId": bucket_id, "name": upload.filename,
+                      "mimeType": upload.content_type, "data": b""}
+        )
+        entry["data"] += data
+        entry["sizeOriginal"] = len(entry["data"])
+        return {key: value for key, value in entry.items() if key != "data"}
+
+    @app.get("/v1/storage/buckets/{bucket_id}/files")
+    async def list_files(bucket_id: str, request: Request):
+        ids, limit = sorted(app.state.files), 25
+        for query in queries(request):
+            if query["method"] == "limit":
+                limit = query["values"][0]
+            elif query["method"] == "cursorAfter":
+                ids = [i for i in ids if i > query["values"][0]]
+        files = [{key: value for key, value in app.state.files[i].items() if key != "data"} for i in ids[:limit]]
+        return {"total": len(app.state.files), "files": files}
+
+    @app.get("/v1/storage/buckets/{bucket_id}/files/{file_id}/download")
+    async def download_file(bucket_id: str, file_id: str):
+        entry = app.state.files.get(file_id)
+        if entry is None:
+            return JSONResponse(status_code=404, content={"message": "File not found", "code": 404})
+        return Response(entry["data"], media_type=entry["mimeType"])
+
+    @app.get("/v1/databases/{database_id}/collections/{collection_id}/documents")
+    async def list_documents(database_id: str, collection_id: str, request: Request):
+        documents = list(app.state.documents.values())
+        for query in queries(request):
+            if query["method"] == "equal":
+                documents = [d for d in documents if d.get(query["attribute"]) in query["values"]]
+        return {"total": len(documents), "documents": documents}
+
+    @app.post("/v1/databases/{database_id}/collections/{collection_id}/documents")
+    async def create_document(database_id: str, collection_id: str, request: Request):
+        body = await request.json()
+        document_id = body["documentId"]
+        if document_id == "unique()":
+            document_id = uuid.uuid4().hex[:20]
+        if document_id in app.state.documents:
+            return JSONResponse(status_code=409, content={
+                "message": "Document already exists", "code": 409, "type": "document_already_exists"
+            })
+        app.state.documents[document_id] = {"$id": document_id, **body["data"]}
+        return app.state.documents[document_id]
+
+    @app.patch("/v1/databases/{database_id}/collections/{collection_id}/documents/{document_id}")
+    async def update_document(database_id: str, collection_id: str, document_id: str, request: Request):
+        body = await request.json()
+        document = app.state.documents.get(document_id)
+        if document is None:
+            return JSONResponse(status_code=404, content={"message": "Document not found", "code": 404})
+        document.update(body.get("data", {}))
+        return document
+
+    return app
+
+# ============================================================================
+# SERVER
+# ============================================================================
+
+class FakeService:
+    """
+    Serve an app with uvicorn on a background thread (a context manager).
+
+    Attributes:
+        app: ASGI app
+        port: Local port
+        url: Base URL of the server
+    """
+
+    def __init__(self, app, port, host="127.0.0.1"):
+        """
+        Initialize the service.
+        """
+        self.app = app
+        self.port = port
+        self.url = f"http://{host}:{port}"
+        self._server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self._thread = None
+
+    def start(self, timeout=10.0):
+        """
+        Start serving; returns once the server accepts connections.
+
+        Raises:
+            RuntimeError: If the server does not start in time
+        """
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"Fake service on port {self.port} did not start.")
+            time.sleep(0.05)
+        return self
+
+    def stop(self):
+        """
+        Stop serving and wait for the thread to end.
+        """
+        self._server.should_exit = True
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+def main():
+    """
+    Run both fake services until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Run the fake Gemini and Appwrite servers.")
+    parser.add_argument("--gemini-port", type=int, default=8601)
+    parser.add_argument("--appwrite-port", type=int, default=8602)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300.0)
+    parser.add_argument("--appwrite-latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Maximum latency deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503")
+    args = parser.parse_args()
+
+    gemini = FakeService(create_gemini_app(args.gemini_latency_ms, args.jitter_ms, args.error_rate), args.gemini_port)
+    appwrite = FakeService(
+        create_appwrite_app(args.appwrite_latency_ms, args.jitter_ms, args.error_rate), args.appwrite_port
+    )
+    with gemini, appwrite:
+        print(f"GEMINI_API_ENDPOINT={gemini.url}")
+        print(f"APPWRITE_ENDPOINT={appwrite.url}/v1")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,520 @@
+"""
+Benchmark Runner - Stage Microbenchmarks, Load Tests and Baseline Comparison
+
+This module measures the processing pipeline offline: the CPU stages one
+by one on a fixed corpus, then end-to-end load at several concurrency
+levels against local fake Gemini and Appwrite servers. Results are written
+as JSON and can be compared with a stored baseline, so a performance change
+is checked instead of guessed.
+
+Key Features:
+    - Microbenchmarks of the stages the API runs per image: decode
+      (prepare_image), inference (YOLO, single image and one full batch),
+      post-process and encode (render_annotated)
+    - Load test of the API: the real app runs under uvicorn in a child
+      process; closed-loop clients post images to /process-image/ at each
+      concurrency level
+    - Load test of Predictor.predict_and_report_async in-process, at the
+      same concurrency levels
+    - Throughput, mean, p50/p95/p99 latency, error rate and peak RSS per
+      benchmark; the API's per-stage pipeline timings from GET /stats
+    - Baseline comparison: every latency, throughput, error and memory
+      figure is checked against a stored results file with a relative
+      tolerance; the exit code is 1 when something regressed
+
+Usage (from the backend directory, with best.pt present):
+    python -m bench.run --output results.json
+    python -m bench.run --suite load --concurrency 1,8,32 --gemini-latency-ms 800 --error-rate 0.05
+    python -m bench.run --baseline bench/baseline.json --tolerance 0.15
+    python -m bench.run --save-baseline bench/baseline.json
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# Third-party imports
+import httpx
+import numpy as np
+
+# Local imports
+from bench.corpus import load_corpus, synthetic_corpus
+from bench.fake_services import FakeService, create_appwrite_app, create_gemini_app
+from cache import file_sha256
+from image_utils import prepare_image, render_annotated
+from observability import configure_logging
+from pipeline import DAMAGE_TYPE_MAPPING, shared_model
+from postprocess import postprocess
+
+logger = logging.getLogger(__name__)
+
+# Settings for the benchmarked code and the API child process; the caller's
+# environment takes precedence. The Gemini quota is lifted so the load test
+# measures the pipeline rather than the rate limiter.
+BENCH_ENVIRONMENT = {
+    "GEMINI_API_KEY": "bench",
+    "GEMINI_RPM": "100000",
+    "GEMINI_BURST": "1000",
+    "APPWRITE_PROJECT_ID": "bench",
+    "APPWRITE_API_KEY": "bench",
+    "APPWRITE_BUCKET_ID": "bench",
+    "APPWRITE_DATABASE_ID": "bench",
+    "APPWRITE_COLLECTION_ID": "bench",
+    "APPWRITE_HTTP2": "false",
+    "RESULT_CACHE_BACKEND": "none",
+    "DUPLICATE_SUPPRESSION": "false",
+    "PROCESS_IMAGE_MODE": "sync",
+    "LOG_LEVEL": "WARNING"
+}
+
+# Backend directory (the API child process runs here and loads ./best.pt)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Environment variables recorded with the results, as they change what is measured
+RECORDED_PREFIXES = (
+    "INFERENCE_", "YOLO_", "TILE", "SEVERITY_", "GEMINI_", "ENRICHMENT_", "ANNOTATED_", "BATCH_", "APPWRITE_HTTP2"
+)
+
+# Metrics compared with a baseline: name suffix -> True if higher is better
+COMPARED_METRICS = {
+    "throughput_per_s": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "error_rate": False,
+    "peak_rss_mb": False
+}
+
+# ============================================================================
+# MEASUREMENT HELPERS
+# ============================================================================
+
+def summarize(samples, wall_seconds=None, errors=0):
+    """
+    Summarize latency samples.
+
+    Args:
+        samples: Latencies in seconds (successful operations)
+        wall_seconds: Elapsed time of the whole run (default: sum of samples)
+        errors: Number of failed operations
+
+    Returns:
+        dict: count, errors, error_rate, throughput_per_s and mean/p50/p95/p99/max in ms
+    """
+    total = len(samples) + errors
+    result = {"count": len(samples), "errors": errors, "error_rate": round(errors / total, 4) if total else 0.0}
+    if not samples:
+        return result
+    values = np.asarray(samples) * 1000
+    wall = wall_seconds if wall_seconds is not None else float(np.sum(samples))
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    result.update({
+        "throughput_per_s": round(len(samples) / wall, 3) if wall > 0 else None,
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3)
+    })
+    return result
+
+
+def peak_rss_mb(pid=None):
+    """
+    Peak resident memory in MB of a running process (Linux) or of this one.
+
+    Returns:
+        float: Peak RSS, or None if it cannot be determined
+    """
+    if pid is not None:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            return None
+        return None
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def timed(function, *args, **kwargs):
+    """Call a function; return (result, elapsed seconds)."""
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+# ============================================================================
+# MICROBENCHMARKS
+# ============================================================================
+
+def run_micro(corpus, model_path, iterations, batch_size):
+    """
+    Time decode, inference, post-process and encode on every corpus image.
+
+    Args:
+        corpus: (name, bytes) tuples
+        model_path: YOLO weights
+        iterations: Passes over the corpus
+        batch_size: Images per call of the batched inference benchmark
+
+    Returns:
+        dict: Stage name -> summarize() result, plus peak_rss_mb
+    """
+    model, _, backend = shared_model(model_path)
+    options = {
+        "model_size": int(os.getenv("INFERENCE_IMGSZ", "640")),
+        "gemini_max_side": int(os.getenv("GEMINI_IMAGE_MAX_SIDE", "1024")),
+        "annotated_max_side": int(os.getenv("ANNOTATED_MAX_SIDE", "1920"))
+    }
+    prepared = [prepare_image(data, **options) for _, data in corpus]
+    model.predict([p.model_image for p in prepared[:batch_size]], verbose=False)  # warm-up
+    logger.info(f"Microbenchmarks: {len(corpus)} image(s) x {iterations} pass(es), {backend} backend")
+
+    samples = {"decode": [], "inference": [], "inference_batch": [], "postprocess": [], "encode": []}
+    batch_wall = 0.0
+    for _ in range(iterations):
+        for _, data in corpus:
+            # Each pass draws on a freshly decoded view
+            view, elapsed = timed(prepare_image, data, **options)
+            samples["decode"].append(elapsed)
+            (results,), elapsed = timed(model.predict, [view.model_image], verbose=False)
+            samples["inference"].append(elapsed)
+            found, elapsed = timed(
+                postprocess, results.boxes.data, model.names, DAMAGE_TYPE_MAPPING, view.scale, view.original_size
+            )
+            samples["postprocess"].append(elapsed)
+            _, elapsed = timed(render_annotated, view, found, ".jpg", 85)
+            samples["encode"].append(elapsed)
+        for start in range(0, len(prepared), batch_size):
+            batch = [p.model_image for p in prepared[start:start + batch_size]]
+            _, elapsed = timed(model.predict, batch, verbose=False)
+            # Per-image latency within the batch; throughput counts images
+            samples["inference_batch"] += [elapsed / len(batch)] * len(batch)
+            batch_wall += elapsed
+
+    result = {stage: summarize(values) for stage, values in samples.items()}
+    result["inference_batch"] = summarize(samples["inference_batch"], batch_wall)
+    result["inference_batch"]["batch_size"] = batch_size
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+# ============================================================================
+# LOAD TESTS
+# ============================================================================
+
+async def _closed_loop(concurrency, requests, send):
+    """
+    Run `requests` calls of `send(index)` with `concurrency` clients.
+
+    Returns:
+        tuple: (latencies of successful calls, error count, wall seconds)
+    """
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def client():
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            try:
+                ok = await send(index)
+            except Exception as e:
+                logger.warning(f"Request {index} failed: {e}")
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run_api_load(corpus, levels, requests, environment, startup_timeout=300.0):
+    """
+    Load-test POST /process-image/ on a uvicorn child process.
+
+    Args:
+        corpus: (name, bytes) tuples, cycled through
+        levels: Concurrency levels
+        requests: Requests per level
+        environment: Environment of the child process
+        startup_timeout: Seconds to wait for GET /ready
+
+    Returns:
+        dict: "levels" (one summarize() result per level, with concurrency
+        and peak_rss_mb) and "stages" (the server's pipeline timings)
+    """
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=environment
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=300.0, limits=httpx.Limits(max_connections=None)) as client:
+            deadline = time.monotonic() + startup_timeout
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"API server exited with code {server.returncode}.")
+                try:
+                    if (await client.get("/ready")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("API server did not become ready.")
+                await asyncio.sleep(0.5)
+
+            async def send(level, index):
+                name, data = corpus[index % len(corpus)]
+                response = await client.post(
+                    "/process-image/",
+                    files={"file": (name, data, "image/jpeg")},
+                    data={"original_image_id": f"bench-c{level}-{index}"}
+                )
+                return response.status_code == 200
+
+            results = []
+            for level in levels:
+                logger.info(f"API load: concurrency {level}, {requests} request(s)")
+                latencies, errors, wall = await _closed_loop(level, requests, lambda i: send(level, i))
+                results.append({"concurrency": level, **summarize(latencies, wall, errors),
+                                "peak_rss_mb": peak_rss_mb(server.pid)})
+            stats = (await client.get("/stats")).json()
+        return {"levels": results, "stages": stats.get("pipeline")}
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+async def run_predictor_load(corpus, model_path, levels, requests):
+    """
+    Load-test Predictor.predict_and_report_async in this process.
+
+    Args:
+        corpus: (name, bytes) tuples, cycled through
+        model_path: YOLO weights
+        levels: Concurrency levels
+        requests: Predictions per level
+
+    Returns:
+        dict: "levels" (one summarize() result per level) and "stages"
+        (the Predictor's pipeline timings)
+    """
+    from inference import Predictor
+
+    predictor = Predictor(model_path, os.environ["GEMINI_API_KEY"])
+    with tempfile.TemporaryDirectory(prefix="safestreet-bench-") as workdir:
+        paths = []
+        for name, data in corpus:
+            paths.append(os.path.join(workdir, name))
+            with open(paths[-1], "wb") as f:
+                f.write(data)
+
+        async def send(index):
+            save_path = os.path.join(workdir, f"out_{index}.jpg")
+            await predictor.predict_and_report_async(paths[index % len(paths)], save_path)
+            return True
+
+        results = []
+        for level in levels:
+            logger.info(f"Predictor load: concurrency {level}, {requests} prediction(s)")
+            latencies, errors, wall = await _closed_loop(level, requests, send)
+            results.append({"concurrency": level, **summarize(latencies, wall, errors), "peak_rss_mb": peak_rss_mb()})
+    return {"levels": results, "stages": predictor.stats()}
+
+# ============================================================================
+# BASELINE COMPARISON
+# ============================================================================
+
+def flatten_metrics(results):
+    """
+    Flatten results into {"micro.decode.p95_ms": value, "load.api.c8.p99_ms": value, ...}.
+    """
+    metrics = {}
+    for stage, values in (results.get("micro") or {}).items():
+        if isinstance(values, dict):
+            metrics.update({f"micro.{stage}.{key}": value for key, value in values.items()})
+        else:
+            metrics[f"micro.{stage}"] = values
+    for target, load in (results.get("load") or {}).items():
+        for level in load["levels"]:
+            prefix = f"load.{target}.c{level['concurrency']}"
+            metrics.update({f"{prefix}.{key}": value for key, value in level.items()})
+    return {
+        name: value for name, value in metrics.items()
+        if name.rsplit(".", 1)[-1] in COMPARED_METRICS and isinstance(value, (int, float))
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline.
+
+    Args:
+        results: Results of this run
+        baseline: Results of the baseline run
+        tolerance: Allowed relative change in the worse direction (e.g. 0.1)
+
+    Returns:
+        list: Rows (metric, baseline, current, relative change, regressed)
+        for every metric present in both
+    """
+    current, previous = flatten_metrics(results), flatten_metrics(baseline)
+    rows = []
+    for name in sorted(set(current) & set(previous)):
+        old, new = previous[name], current[name]
+        higher_is_better = COMPARED_METRICS[name.rsplit(".", 1)[-1]]
+        if old == 0:
+            change = 0.0 if new == 0 else float("inf")
+            worse = new < old if higher_is_better else new > old
+            # An error rate rising from zero is only a regression beyond the tolerance
+            regressed = worse and (new > tolerance if name.endswith("error_rate") else True)
+        else:
+            change = (new - old) / abs(old)
+            regressed = (-change if higher_is_better else change) > tolerance
+        rows.append((name, old, new, change, regressed))
+    return rows
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+def _metadata(args, corpus):
+    """Describe the machine, code, model and settings of a run."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "model": {"path": args.model, "sha256": file_sha256(args.model)[:16]},
+        "corpus": {
+            "source": args.corpus or f"synthetic (seed {args.seed})",
+            "images": len(corpus),
+            "bytes": sum(len(data) for _, data in corpus)
+        },
+        "options": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "save_baseline")},
+        "environment": {key: value for key, value in sorted(os.environ.items())
+                        if key.startswith(RECORDED_PREFIXES) and "KEY" not in key}
+    }
+
+
+async def _run(args, corpus):
+    """
+    Run the selected suites against the fake services.
+    """
+    results = {"meta": _metadata(args, corpus)}
+    if args.suite in ("micro", "all"):
+        results["micro"] = await asyncio.to_thread(run_micro, corpus, args.model, args.iterations, args.batch_size)
+    if args.suite in ("load", "all"):
+        gemini_app = create_gemini_app(args.gemini_latency_ms, args.jitter_ms, args.error_rate)
+        appwrite_app = create_appwrite_app(args.appwrite_latency_ms, args.jitter_ms, args.error_rate)
+        with FakeService(gemini_app, free_port()) as gemini, FakeService(appwrite_app, free_port()) as appwrite:
+            os.environ["GEMINI_API_ENDPOINT"] = gemini.url
+            os.environ["APPWRITE_ENDPOINT"] = f"{appwrite.url}/v1"
+            results["load"] = {}
+            if args.target in ("api", "both"):
+                results["load"]["api"] = await run_api_load(corpus, args.concurrency, args.requests, dict(os.environ))
+            if args.target in ("predictor", "both"):
+                results["load"]["predictor"] = await run_predictor_load(
+                    corpus, args.model, args.concurrency, args.requests
+                )
+            results["fake_services"] = {"gemini": gemini_app.state.faults.stats(),
+                                        "appwrite": appwrite_app.state.faults.stats()}
+    return results
+
+
+def main():
+    """
+    Parse arguments, run the benchmarks, write and compare the results.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the SafeStreet processing pipeline offline.")
+    parser.add_argument("--suite", choices=("micro", "load", "all"), default="all")
+    parser.add_argument("--target", choices=("api", "predictor", "both"), default="both", help="Load test target")
+    parser.add_argument("--model", default="best.pt", help="YOLO weights (the API always loads ./best.pt)")
+    parser.add_argument("--corpus", help="Directory of images (default: synthetic corpus)")
+    parser.add_argument("--images", type=int, default=12, help="Synthetic corpus size")
+    parser.add_argument("--seed", type=int, default=7, help="Synthetic corpus seed")
+    parser.add_argument("--iterations", type=int, default=3, help="Microbenchmark passes over the corpus")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per batched inference call")
+    parser.add_argument("--concurrency", type=lambda v: [int(c) for c in v.split(",")], default=[1, 4, 16],
+                        help="Comma-separated load test concurrency levels")
+    parser.add_argument("--requests", type=int, default=48, help="Requests per concurrency level")
+    parser.add_argument("--gemini-latency-ms", type=float, default=300.0)
+    parser.add_argument("--appwrite-latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Maximum fake service latency deviation")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of fake service requests failing")
+    parser.add_argument("--output", help="Write results to this JSON file (default: stdout)")
+    parser.add_argument("--baseline", help="Compare with this results file; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file")
+    args = parser.parse_args()
+
+    for key, value in BENCH_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    configure_logging()
+    logger.setLevel(logging.INFO)
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.images, args.seed)
+    results = asyncio.run(_run(args, corpus))
+
+    text = json.dumps(results, indent=2)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+    if not args.output:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            rows = compare(results, json.load(f), args.tolerance)
+        for name, old, new, change, regressed in rows:
+            print(f"{'REGRESSED' if regressed else 'ok':9}  {name:45} {old:>12.3f} -> {new:>12.3f}  ({change:+.1%})",
+                  file=sys.stderr)
+        regressions = sum(row[4] for row in rows)
+        print(f"{regressions} regression(s) in {len(rows)} compared metric(s), tolerance {args.tolerance:.0%}.",
+              file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Bulk Re-Processing - Resumable, Parallel Pipeline Runs over an Image Archive
+
+This module re-runs the image pipeline over many stored images, e.g. the
+whole Appwrite archive after a new best.pt is shipped. Images come from a
+directory, a manifest or an Appwrite Storage bucket listing; each one goes
+through the same stages as an API upload (see main.build_image_pipeline),
+preceded by a fetch stage and followed by a checkpoint entry.
+
+Key Features:
+    - Sources: a directory (imageId = file name without extension), a JSONL
+      or CSV manifest (image_id, path or file_id, optional latitude and
+      longitude) or an Appwrite bucket (imageId = file ID, annotated output
+      files skipped)
+    - Downloads run concurrently with detection, bounded by --prefetch
+    - Detection goes through the shared micro-batching scheduler; with
+      --workers N the inference executor runs N worker processes
+    - Record writes are batched: document IDs are resolved with one query
+      per page and the records are patched concurrently
+      (appwrite_utils.update_damage_records)
+    - Append-only JSONL checkpoint of finished images; an interrupted run
+      resumes after the last finished image (failed images are retried)
+    - Severity from the local model only (default), so a large archive does
+      not wait for the Gemini rate limit (such reports are not written to
+      the result cache); --severity auto uses the API's Gemini settings
+    - Every image is analyzed: duplicate suppression is skipped and the
+      results are not added to the live duplicate index
+
+Usage:
+    python bulk.py --list-bucket --bucket archive_bucket --checkpoint rescore.jsonl --workers 4
+    python bulk.py --directory ./archive --checkpoint rescore.jsonl
+    python bulk.py --manifest images.csv --checkpoint rescore.jsonl --severity auto
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import mimetypes
+import os
+import time
+
+# Local imports
+import appwrite_utils
+from batching import BatchScheduler
+from geo import valid_location
+from observability import request_id
+from pipeline import Pipeline, Stage
+
+logger = logging.getLogger(__name__)
+
+# Files written by the pipeline itself (annotated outputs) are not re-processed
+ANNOTATED_PREFIX = "annotated_"
+
+# ============================================================================
+# SOURCES
+# ============================================================================
+
+async def iter_directory(path):
+    """
+    Yield the images of a directory tree, sorted by path.
+
+    Yields:
+        dict: {"image_id", "path"} with the file name (without extension)
+        as imageId
+    """
+    paths = []
+    for root, _, files in os.walk(path):
+        for name in files:
+            mime_type = mimetypes.guess_type(name)[0]
+            if mime_type and mime_type.startswith("image/") and not name.startswith(ANNOTATED_PREFIX):
+                paths.append(os.path.join(root, name))
+    for file_path in sorted(paths):
+        yield {"image_id": os.path.splitext(os.path.basename(file_path))[0], "path": file_path}
+
+
+async def iter_manifest(path):
+    """
+    Yield the images listed in a JSONL or CSV manifest.
+
+    Each entry needs "image_id" and either "path" (local file) or "file_id"
+    (Appwrite file); "latitude" and "longitude" are optional.
+
+    Yields:
+        dict: {"image_id", "path" or "file_id", "location"}
+
+    Raises:
+        ValueError: If an entry has no image_id or no image reference
+    """
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            entries = csv.DictReader(f)
+        else:
+            entries = (json.loads(line) for line in f if line.strip())
+        for number, entry in enumerate(entries, 1):
+            if not entry.get("image_id") or not (entry.get("path") or entry.get("file_id")):
+                raise ValueError(f"{path}:{number}: an entry needs image_id and path or file_id.")
+            item = {"image_id": str(entry["image_id"]), "location": None}
+            if entry.get("path"):
+                item["path"] = entry["path"]
+            else:
+                item["file_id"] = entry["file_id"]
+            if entry.get("latitude") not in (None, "") and entry.get("longitude") not in (None, ""):
+                location = (float(entry["latitude"]), float(entry["longitude"]))
+                item["location"] = location if valid_location(*location) else None
+            yield item
+
+
+async def iter_bucket(bucket_id):
+    """
+    Yield the images of an Appwrite Storage bucket, page by page.
+
+    Yields:
+        dict: {"image_id", "file_id", "mime_type"} with the file ID as imageId
+    """
+    cursor = None
+    while True:
+        files = await appwrite_utils.list_files(bucket_id, cursor)
+        for file in files:
+            if file.get("mimeType", "").startswith("image/") and not file.get("name", "").startswith(ANNOTATED_PREFIX):
+                yield {"image_id": file["$id"], "file_id": file["$id"], "mime_type": file["mimeType"]}
+        if len(files) < appwrite_utils.LIST_PAGE_SIZE:
+            return
+        cursor = files[-1]["$id"]
+
+
+def _read_file(path):
+    """Read a local image file (runs in a thread)."""
+    with open(path, "rb") as f:
+        return f.read()
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+class Checkpoint:
+    """
+    Append-only JSON-lines log of finished images.
+
+    Every processed image gets one line with its result; imageIds with a
+    successful line are skipped when the run is restarted.
+
+    Attributes:
+        path: Checkpoint file path
+        done: imageIds finished successfully (in this or an earlier run)
+    """
+
+    def __init__(self, path):
+        """
+        Load the imageIds already finished and open the file for appending.
+        """
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line of an interrupted run
+                        continue
+                    if entry.get("status") == "success":
+                        self.done.add(entry["original_image_id"])
+        self._file = open(path, "a")
+
+    def record(self, result):
+        """
+        Append the result of one image.
+        """
+        self._file.write(json.dumps(result) + "\n")
+        self._file.flush()
+        if result.get("status") == "success":
+            self.done.add(result["original_image_id"])
+
+    def close(self):
+        """
+        Close the checkpoint file.
+        """
+        self._file.close()
+
+# ============================================================================
+# BULK RUN
+# ============================================================================
+
+class BulkRunner:
+    """
+    Run the image pipeline over a stream of stored images.
+
+    Attributes:
+        main: The API module (components loaded by main.initialize())
+        checkpoint: Checkpoint of finished images
+        bucket_id: Bucket the "file_id" images are downloaded from
+        concurrency: Maximum number of images in flight
+        pipeline: fetch -> image pipeline (with batched record writes)
+        counts: Processed, failed and skipped image counts
+    """
+
+    def __init__(self, main, checkpoint, bucket_id, concurrency=32, prefetch=16, write_batch=50,
+                 local_severity=True):
+        """
+        Initialize the runner.
+
+        Args:
+            main: The API module, already initialized
+            checkpoint: Checkpoint of finished images
+            bucket_id: Bucket the "file_id" images are downloaded from
+            concurrency: Maximum number of images in flight
+            prefetch: Maximum number of concurrent downloads/reads
+            write_batch: Maximum records per batched database write
+            local_severity: Use the local severity model only (no Gemini)
+        """
+        self.main = main
+        self.checkpoint = checkpoint
+        self.bucket_id = bucket_id
+        self.concurrency = max(1, int(concurrency))
+        self.counts = {"success": 0, "error": 0, "skipped": 0}
+
+        workers = main.inference_executor.workers
+        self._slots = {
+            "fetch_slots": asyncio.Semaphore(max(1, int(prefetch))),
+            "detect_slots": asyncio.Semaphore(2 * main.batch_scheduler.max_batch_size * workers),
+            "enrich_slots": asyncio.Semaphore(self.concurrency)
+        }
+        self._writer = BatchScheduler(
+            appwrite_utils.update_damage_records, max_batch_size=write_batch, max_wait_ms=500,
+            max_concurrent_batches=2, name="record write"
+        )
+        image_pipeline = main.build_image_pipeline(
+            enrich=self._local_enrich_stage if local_severity else main.enrich_stage,
+            persist=self._persist_stage,
+            dedupe=False,
+            store_results=not local_severity
+        )
+        self.pipeline = Pipeline("bulk", [
+            Stage("fetch", self._fetch_stage, limit="fetch_slots"),
+            Stage("image", image_pipeline)
+        ])
+
+    async def _fetch_stage(self, ctx):
+        """
+        Read or download the image bytes.
+
+        Raises:
+            ValueError: If the image cannot be read or downloaded
+        """
+        item = ctx["source"]
+        if "path" in item:
+            ctx["image_bytes"] = await asyncio.to_thread(_read_file, item["path"])
+            ctx["mime_type"] = mimetypes.guess_type(item["path"])[0] or "image/jpeg"
+        else:
+            ctx["image_bytes"] = await appwrite_utils.download_file(self.bucket_id, item["file_id"])
+            if ctx["image_bytes"] is None:
+                raise ValueError(f"Could not download file {item['file_id']}.")
+            ctx["mime_type"] = item.get("mime_type", "image/jpeg")
+
+    async def _local_enrich_stage(self, ctx):
+        """
+        Report the local severity estimate as final (no Gemini call).
+        """
+        prepared = ctx.pop("prepared")
+        detections = ctx["detections"]
+        estimate = self.main.severity_model.estimate(detections, prepared.original_size)
+        ctx["report"] = self.main.detection_report(detections, estimate=estimate, pending=False)
+
+    async def _persist_stage(self, ctx):
+        """
+        Queue the record for the next batched database write and wait for it.
+
+        Raises:
+            RuntimeError: If the database write fails
+        """
+        response = await self._writer.submit((ctx["original_image_id"], self.main.record_data(ctx)))
+        if not response:
+            raise RuntimeError("Failed to update Appwrite database.")
+        ctx["appwrite_response"] = response
+
+    async def _process(self, item):
+        """
+        Run one image through the pipeline and record its result.
+        """
+        # Deferred enrichment waits for a quiet period after the last image
+        self.main.last_pipeline_started = time.time()
+        ctx = {
+            "source": item,
+            "original_image_id": item["image_id"],
+            "location": item.get("location"),
+            **self._slots
+        }
+        # Log lines of this image carry its imageId as the request ID
+        token = request_id.set(item["image_id"])
+        try:
+            await self.pipeline.run(ctx)
+            result = self.main.pipeline_result(ctx)
+            result["severity"] = ctx["report"].get("overall_severity")
+            self.counts["success"] += 1
+        except Exception as e:
+            logger.error(f"❌ Bulk processing of {item['image_id']} failed: {e}")
+            detail = getattr(e, "detail", None) or str(e)
+            result = {"status": "error", "original_image_id": item["image_id"], "detail": detail}
+            self.counts["error"] += 1
+        finally:
+            request_id.reset(token)
+        self.checkpoint.record(result)
+
+    async def run(self, items):
+        """
+        Process every item not yet in the checkpoint.
+
+        Args:
+            items: Async iterator of source items
+
+        Returns:
+            dict: Counts of processed, failed and skipped images and the rate
+        """
+        started = time.perf_counter()
+        queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                await self._process(item)
+                finished = self.counts["success"] + self.counts["error"]
+                if finished % 100 == 0:
+                    logger.info(f"✅ {finished} image(s) processed ({finished / (time.perf_counter() - started):.1f}/s).")
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            async for item in items:
+                if item["image_id"] in self.checkpoint.done:
+                    self.counts["skipped"] += 1
+                    continue
+                await queue.put(item)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started
+        processed = self.counts["success"] + self.counts["error"]
+        return {**self.counts, "seconds": round(elapsed, 1), "images_per_second": round(processed / elapsed, 2) if elapsed else 0.0}
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+async def _main(args):
+    """
+    Start the API components in-process and re-process the selected images.
+    """
+    import main
+
+    await main.initialize()
+    if main.startup_state["status"] != "ready":
+        raise SystemExit(f"Startup failed: {main.startup_state['error']}")
+    checkpoint = Checkpoint(args.checkpoint)
+    logger.info(f"Checkpoint {args.checkpoint}: {len(checkpoint.done)} image(s) already done.")
+    try:
+        if args.directory:
+            items = iter_directory(args.directory)
+        elif args.manifest:
+            items = iter_manifest(args.manifest)
+        else:
+            items = iter_bucket(args.bucket)
+        runner = BulkRunner(
+            main, checkpoint, args.bucket, args.concurrency, args.prefetch,
+            args.write_batch, args.severity == "local"
+        )
+        summary = await runner.run(items)
+        # Deferred mode: let the Gemini reports of the saved records finish
+        await main.enrichment_queue.join()
+        print(json.dumps({"status": "complete", **summary, "stages": runner.pipeline.stats()}))
+    finally:
+        checkpoint.close()
+        await main.job_queue.stop()
+        await main.enrichment_queue.stop()
+        await main.appwrite_utils.close_http_client()
+        main.inference_executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-process stored road images through the detection pipeline.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--directory", help="Directory of images (imageId = file name without extension)")
+    source.add_argument("--manifest", help="JSONL or CSV manifest with image_id and path or file_id")
+    source.add_argument("--list-bucket", action="store_true", help="Process every image in the bucket")
+    parser.add_argument("--bucket", default=os.getenv("APPWRITE_BUCKET_ID"),
+                        help="Appwrite bucket images are listed in and downloaded from (default: APPWRITE_BUCKET_ID)")
+    parser.add_argument("--checkpoint", required=True, help="JSONL file of finished images (resumes if it exists)")
+    parser.add_argument("--workers", type=int, default=0, help="Inference worker processes (default: INFERENCE_* settings)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Images in flight")
+    parser.add_argument("--prefetch", type=int, default=16, help="Concurrent image downloads/reads")
+    parser.add_argument("--write-batch", type=int, default=50, help="Records per batched database write")
+    parser.add_argument("--severity", choices=("local", "auto"), default="local",
+                        help="local: local severity model only; auto: ask Gemini like the API does")
+    arguments = parser.parse_args()
+
+    # Read by the inference executor when main.initialize() configures it
+    if arguments.workers:
+        os.environ["INFERENCE_EXECUTOR"] = "process"
+        os.environ["INFERENCE_WORKERS"] = str(arguments.workers)
+
+    appwrite_utils.init_http_client()
+    asyncio.run(_main(arguments))
@@ -0,0 +1,318 @@
+"""
+Result Cache - Content-Addressed Cache for Processed Images
+
+This module provides a bounded cache for the outcome of the image processing
+pipeline, keyed by a hash of the uploaded image bytes together with the YOLO
+weights hash, the Gemini prompt version and the severity configuration. Re-uploads and client retries of
+the same photo can then reuse the stored detections, report and processed
+image instead of paying again for inference, Gemini and storage.
+
+Key Features:
+    - SHA-256 content addressing (image bytes + model hash + prompt version
+      + severity configuration)
+    - In-process backend with LRU and TTL eviction
+    - On-disk SQLite backend with the same eviction rules, shared by workers
+    - Blocking backends run on the shared executor's I/O threads
+
+Configuration (environment variables):
+    RESULT_CACHE_BACKEND: "memory" (default), "sqlite" or "none"
+    RESULT_CACHE_MAX_ENTRIES: Maximum number of cached results (default: 1024)
+    RESULT_CACHE_TTL_SECONDS: Time-to-live of a cached result (default: 86400)
+    RESULT_CACHE_PATH: SQLite database file (default: result_cache.sqlite3)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Local imports
+from executor import get_executor
+
+# ============================================================================
+# HELPER FUNCTIONS
+# ============================================================================
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    Compute the SHA-256 hex digest of a file, reading it in chunks.
+
+    Args:
+        path: Path to the file
+        chunk_size: Number of bytes read per chunk
+
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class MemoryCacheBackend:
+    """
+    In-process cache with LRU and TTL eviction.
+
+    Attributes:
+        max_entries: Maximum number of entries kept
+        ttl: Time-to-live of an entry in seconds
+        blocking: False, operations are cheap enough to run on the event loop
+    """
+
+    blocking = False
+
+    def __init__(self, max_entries=1024, ttl=86400):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_entries: Maximum number of entries kept
+            ttl: Time-to-live of an entry in seconds
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Store value under key, evicting the least recently used entries.
+        """
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCacheBackend:
+    """
+    On-disk cache stored in a SQLite database, with LRU and TTL eviction.
+
+    Values are stored as JSON. The database file can be shared by several
+    uvicorn workers on the same host.
+
+    Attributes:
+        path: Path to the SQLite database file
+        max_entries: Maximum number of entries kept
+        ttl: Time-to-live of an entry in seconds
+        blocking: True, operations run on the executor's I/O threads
+    """
+
+    blocking = True
+
+    def __init__(self, path="result_cache.sqlite3", max_entries=1024, ttl=86400):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: Path to the SQLite database file
+            max_entries: Maximum number of entries kept
+            ttl: Time-to-live of an entry in seconds
+        """
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Store value under key, evicting expired and least recently used entries.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._conn.execute("DELETE FROM results WHERE stored_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+class ResultCache:
+    """
+    Content-addressed cache of pipeline results.
+
+    The cache key combines the SHA-256 of the image bytes with a namespace
+    made of the model weights hash, the prompt version and the severity
+    configuration, so results are invalidated automatically when any of them
+    changes.
+
+    Attributes:
+        backend: Storage backend (MemoryCacheBackend or SQLiteCacheBackend)
+        namespace: Model hash, prompt version and severity configuration
+            prefix for all keys
+    """
+
+    def __init__(self, backend, model_hash, prompt_version, severity_config=""):
+        """
+        Initialize the cache.
+
+        Args:
+            backend: Storage backend instance
+            model_hash: Hash of the YOLO weights in use
+            prompt_version: Version string of the Gemini prompt in use
+            severity_config: Fingerprint of the severity settings in use
+                (SeverityModel.fingerprint())
+        """
+        self.backend = backend
+        self.namespace = f"{model_hash}:{prompt_version}:{severity_config}"
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, model_hash, prompt_version, severity_config=""):
+        """
+        Create a cache configured from environment variables.
+
+        Args:
+            model_hash: Hash of the YOLO weights in use
+            prompt_version: Version string of the Gemini prompt in use
+            severity_config: Fingerprint of the severity settings in use
+
+        Returns:
+            ResultCache: Configured cache, or None if caching is disabled
+
+        Raises:
+            ValueError: If RESULT_CACHE_BACKEND is not a known backend
+        """
+        backend_name = os.getenv("RESULT_CACHE_BACKEND", "memory").lower()
+        max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+        ttl = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "86400"))
+
+        if backend_name == "none":
+            return None
+        if backend_name == "memory":
+            backend = MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+        elif backend_name == "sqlite":
+            backend = SQLiteCacheBackend(
+                path=os.getenv("RESULT_CACHE_PATH", "result_cache.sqlite3"),
+                max_entries=max_entries,
+                ttl=ttl
+            )
+        else:
+            raise ValueError(f"Unknown result cache backend: {backend_name}")
+        return cls(backend, model_hash, prompt_version, severity_config)
+
+    def key_for(self, image_bytes):
+        """
+        Compute the cache key for an image.
+
+        Args:
+            image_bytes: Raw uploaded image bytes
+
+        Returns:
+            str: Cache key
+        """
+        return f"{self.namespace}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+    async def get(self, key):
+        """
+        Look up a cached result.
+
+        Args:
+            key: Cache key from key_for()
+
+        Returns:
+            dict: Cached result, or None on a miss
+        """
+        if self.backend.blocking:
+            value = await get_executor().run_blocking(self.backend.get, key)
+        else:
+            value = self.backend.get(key)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value):
+        """
+        Store a result in the cache.
+
+        Args:
+            key: Cache key from key_for()
+            value: JSON-serializable result
+        """
+        if self.backend.blocking:
+            await get_executor().run_blocking(self.backend.set, key, value)
+        else:
+            self.backend.set(key, value)
+
+    def stats(self):
+        """
+        Return hit and miss counters.
+
+        Returns:
+            dict: Backend name, hits and misses
+        """
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses
+        }
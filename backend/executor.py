@@ -0,0 +1,308 @@
+"""
+Inference Executor - Off-Loop Execution of CPU-Bound and Blocking Work
+
+This module provides the InferenceExecutor class, which runs YOLO inference,
+OpenCV image work and blocking SDK calls outside the asyncio event loop so
+that health checks, uploads and other requests keep being served while an
+image is being processed.
+
+Features:
+    - Thread pool mode with bounded torch intra-op threads
+    - Process pool mode that loads the YOLO weights once per worker
+    - Separate thread pool for blocking I/O (e.g. synchronous SDK calls)
+    - Queue depth, in-flight count and wait time statistics
+
+Configuration (environment variables):
+    INFERENCE_EXECUTOR: "thread" (default) or "process"
+    INFERENCE_WORKERS: Number of inference workers (default: 1)
+    TORCH_NUM_THREADS: Torch intra-op threads per worker (default: CPU count / workers)
+    BLOCKING_IO_WORKERS: Threads for blocking I/O calls (default: 8)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Third-party imports
+import torch
+from ultralytics import YOLO
+
+# Local imports
+from observability import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# WORKER-SIDE STATE
+# ============================================================================
+
+# Each worker (thread or process) keeps its own model instance, since
+# ultralytics predictors are not safe to share between concurrent callers.
+_worker_state = threading.local()
+
+
+def _init_worker(model_path, torch_threads, shared_model=None):
+    """
+    Initialize an executor worker: bound torch threads and load the model.
+
+    Args:
+        model_path: Path to the YOLO weights or exported model
+        torch_threads: Number of torch intra-op threads to use
+        shared_model: Already-loaded model to reuse instead of loading a copy
+    """
+    configure_logging()
+    if torch_threads:
+        torch.set_num_threads(torch_threads)
+    # task is needed for exported models, which do not always carry it
+    _worker_state.model = shared_model if shared_model is not None else YOLO(model_path, task="detect")
+    logger.info(f"Inference worker ready (pid {os.getpid()}, thread {threading.current_thread().name}).")
+
+
+def get_worker_model():
+    """
+    Return the YOLO model owned by the current executor worker.
+
+    Returns:
+        YOLO: The worker's model instance
+
+    Raises:
+        RuntimeError: If called outside an initialized executor worker
+    """
+    model = getattr(_worker_state, "model", None)
+    if model is None:
+        raise RuntimeError("No YOLO model loaded in this worker.")
+    return model
+
+
+def predict_batch(images, **predict_kwargs):
+    """
+    Run the worker's YOLO model on a batch of images.
+
+    Args:
+        images: List of decoded BGR NumPy arrays
+        **predict_kwargs: Extra keyword arguments for the model call
+
+    Returns:
+        list: One Results object per input image, in input order
+    """
+    return get_worker_model()(images, **predict_kwargs)
+
+
+# ============================================================================
+# EXECUTOR
+# ============================================================================
+
+class InferenceExecutor:
+    """
+    Run CPU-bound and blocking work away from the asyncio event loop.
+
+    CPU-bound work (inference, image encoding) goes through a pool of
+    `workers` threads or processes, gated by a semaphore so that callers
+    waiting for a free worker are counted as queued. Blocking I/O goes
+    through a separate thread pool so it never waits behind inference.
+
+    Attributes:
+        mode: "thread" or "process"
+        workers: Number of inference workers
+        torch_threads: Torch intra-op threads per worker
+    """
+
+    def __init__(self, model_path, mode="thread", workers=1, torch_threads=None,
+                 io_workers=8, shared_model=None):
+        """
+        Initialize the executor and start its worker pools.
+
+        Args:
+            model_path: Path to the YOLO weights file loaded by each worker
+            mode: "thread" for a thread pool, "process" for a process pool
+            workers: Number of inference workers
+            torch_threads: Torch intra-op threads per worker (default: CPU count / workers)
+            io_workers: Number of threads for blocking I/O calls
+            shared_model: Loaded model to reuse in single-worker thread mode
+
+        Raises:
+            ValueError: If mode is not "thread" or "process"
+        """
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor mode: {mode}")
+
+        self.mode = mode
+        self.workers = max(1, int(workers))
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.workers)
+
+        if mode == "process":
+            # Spawn (not fork) so workers do not inherit torch/OpenMP thread state
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_path, self.torch_threads)
+            )
+        else:
+            # A loaded model can only be reused when a single thread owns it
+            reuse = shared_model if self.workers == 1 else None
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="inference",
+                initializer=_init_worker,
+                initargs=(model_path, self.torch_threads, reuse)
+            )
+        self._io_pool = ThreadPoolExecutor(max_workers=max(1, int(io_workers)), thread_name_prefix="blocking-io")
+
+        self._slots = asyncio.Semaphore(self.workers)
+        self._queued = 0
+        self._in_flight = 0
+        self._started = 0
+        self._completed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_wait = 0.0
+
+        logger.info(f"Inference executor started: {self.mode} mode, {self.workers} worker(s), "
+                    f"{self.torch_threads} torch thread(s) per worker.")
+
+    @classmethod
+    def from_env(cls, model_path, shared_model=None):
+        """
+        Create an executor configured from environment variables.
+
+        Args:
+            model_path: Path to the YOLO weights file
+            shared_model: Loaded model to reuse in single-worker thread mode
+
+        Returns:
+            InferenceExecutor: Configured executor
+        """
+        torch_threads = os.getenv("TORCH_NUM_THREADS")
+        return cls(
+            model_path,
+            mode=os.getenv("INFERENCE_EXECUTOR", "thread").lower(),
+            workers=int(os.getenv("INFERENCE_WORKERS", "1")),
+            torch_threads=int(torch_threads) if torch_threads else None,
+            io_workers=int(os.getenv("BLOCKING_IO_WORKERS", "8")),
+            shared_model=shared_model
+        )
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a CPU-bound function on an inference worker.
+
+        In process mode `fn` and its arguments must be picklable (module-level
+        functions such as `predict_batch`).
+
+        Args:
+            fn: Function to call
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            The return value of fn
+        """
+        enqueued = time.perf_counter()
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+
+        wait = time.perf_counter() - enqueued
+        self._started += 1
+        self._last_wait = wait
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            self._slots.release()
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """
+        Run a blocking I/O function (e.g. a synchronous SDK call) in a thread.
+
+        Args:
+            fn: Function to call
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            The return value of fn
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_pool, functools.partial(fn, *args, **kwargs))
+
+    def stats(self):
+        """
+        Return queue and timing statistics for the inference workers.
+
+        Returns:
+            dict: Mode, worker count, queue depth, in-flight tasks and wait times
+        """
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "torch_threads": self.torch_threads,
+            "queue_depth": self._queued,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "last_wait_ms": round(self._last_wait * 1000, 2),
+            "avg_wait_ms": round(self._total_wait / self._started * 1000, 2) if self._started else 0.0,
+            "max_wait_ms": round(self._max_wait * 1000, 2)
+        }
+
+    def shutdown(self):
+        """
+        Stop the worker pools, waiting for running tasks to finish.
+        """
+        self._pool.shutdown(wait=True)
+        self._io_pool.shutdown(wait=True)
+
+
+# ============================================================================
+# SHARED INSTANCE
+# ============================================================================
+
+_executor = None
+
+
+def configure_executor(model_path, shared_model=None):
+    """
+    Create the process-wide executor from environment variables.
+
+    Args:
+        model_path: Path to the YOLO weights file
+        shared_model: Loaded model to reuse in single-worker thread mode
+
+    Returns:
+        InferenceExecutor: The shared executor
+    """
+    global _executor
+    _executor = InferenceExecutor.from_env(model_path, shared_model=shared_model)
+    return _executor
+
+
+def get_executor():
+    """
+    Return the process-wide executor.
+
+    Returns:
+        InferenceExecutor: The shared executor
+
+    Raises:
+        RuntimeError: If configure_executor has not been called
+    """
+    if _executor is None:
+        raise RuntimeError("Inference executor has not been configured.")
+    return _executor
@@ -0,0 +1,442 @@
+"""
+Gemini Client - Rate-Limited, Deadline-Bound Calls with a Circuit Breaker
+
+This module wraps the Gemini model used by the API and by the Predictor so
+that a slow or failing provider cannot stall the server. Every call takes a
+token from a shared token bucket sized to the API quota, is bounded by a
+deadline that covers queueing, the request and all retries, and goes
+through a circuit breaker that fails fast while Gemini is down. Callers
+catch GeminiUnavailable and fall back to a YOLO-only result.
+
+Key Features:
+    - Token-bucket rate limiting (requests per minute plus burst); a call
+      that could not get a token before its deadline fails immediately
+    - Per-attempt timeouts capped by the remaining deadline
+    - Retries with full-jitter exponential backoff on retryable errors
+      (429, 5xx, timeouts, connection errors) only
+    - Circuit breaker: opens after consecutive failures, probes with a
+      single request after a cool-down, closes again on success
+    - Any object with generate_content/generate_content_async can be passed
+      as the model (bench.fake_services.FakeGeminiModel for offline runs)
+    - Local stub endpoints (GEMINI_API_ENDPOINT) use the REST transport,
+      which has no async client; async calls then run on a thread
+    - Per-attempt latency histogram and error counters (see observability.py)
+
+Configuration (environment variables):
+    GEMINI_RPM: Requests per minute allowed by the quota (default: 60)
+    GEMINI_BURST: Requests that may be sent back to back (default: 5)
+    GEMINI_TIMEOUT_SECONDS: Timeout of a single attempt (default: 15)
+    GEMINI_DEADLINE_SECONDS: Default budget for a call including retries (default: 30)
+    GEMINI_RETRIES: Retries after a retryable failure (default: 2)
+    GEMINI_BACKOFF_SECONDS: Base delay of the exponential backoff (default: 0.5)
+    GEMINI_MAX_BACKOFF_SECONDS: Maximum backoff delay (default: 8)
+    GEMINI_BREAKER_FAILURES: Consecutive failures that open the breaker (default: 5)
+    GEMINI_BREAKER_RESET_SECONDS: Cool-down before a probe request (default: 30)
+    GEMINI_API_ENDPOINT: Alternative API endpoint, e.g. a local stub (REST transport)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+# Third-party imports
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+# Local imports
+from observability import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+GEMINI_ATTEMPT_SECONDS = histogram(
+    "safestreet_gemini_attempt_seconds", "Latency of single Gemini requests.", ("outcome",)
+)
+GEMINI_ERRORS = counter("safestreet_gemini_errors_total", "Failed Gemini requests by kind.", ("kind",))
+
+
+class GeminiUnavailable(Exception):
+    """
+    Raised when a Gemini call cannot complete: breaker open, no token before
+    the deadline, deadline exceeded or retries exhausted.
+    """
+
+
+def is_retryable(error):
+    """
+    Return True for errors worth retrying (rate limits, server errors,
+    timeouts and connection problems).
+    """
+    if isinstance(error, google_exceptions.TooManyRequests):
+        return True
+    if isinstance(error, google_exceptions.ClientError):
+        return False
+    return isinstance(error, (
+        google_exceptions.ServerError, google_exceptions.DeadlineExceeded,
+        asyncio.TimeoutError, TimeoutError, ConnectionError
+    ))
+
+# ============================================================================
+# RATE LIMITING AND CIRCUIT BREAKER
+# ============================================================================
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens are reserved up front, so concurrent
+    callers are spaced out instead of all retrying at once.
+
+    Attributes:
+        rate: Tokens added per second
+        capacity: Maximum stored tokens (burst size)
+    """
+
+    def __init__(self, rate_per_minute=60, burst=5):
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate_per_minute: Sustained requests per minute
+            burst: Requests that may be sent back to back
+        """
+        self.rate = max(float(rate_per_minute), 0.001) / 60.0
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, deadline=None):
+        """
+        Reserve a token.
+
+        Args:
+            deadline: Optional time.monotonic() value the token must be
+                available by
+
+        Returns:
+            float: Seconds to wait before using the token, or None if it
+                would only be available after the deadline (nothing reserved)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker (closed -> open -> half-open).
+
+    Attributes:
+        failure_threshold: Consecutive failures that open the breaker
+        reset_seconds: Time the breaker stays open before a probe request
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        """
+        Initialize a closed breaker.
+
+        Args:
+            failure_threshold: Consecutive failures that open the breaker
+            reset_seconds: Time the breaker stays open before a probe request
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = float(reset_seconds)
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self):
+        """
+        Return True if a request may be sent now.
+
+        While half-open only one probe request is let through at a time (a
+        probe that never reported back is replaced after reset_seconds).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_started = None
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and (
+                self._probe_started is None or now - self._probe_started >= self.reset_seconds
+            ):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Close the breaker after a successful request."""
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker when needed."""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"❌ Gemini circuit breaker opened after {self._failures} failure(s).")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+
+# ============================================================================
+# CLIENT
+# ============================================================================
+
+class GeminiClient:
+    """
+    Gemini model wrapper applying rate limiting, deadlines, retries and the
+    circuit breaker to every call.
+
+    Attributes:
+        model: genai.GenerativeModel or a stand-in with the same methods
+        bucket: TokenBucket shared by all calls through this client
+        breaker: CircuitBreaker shared by all calls through this client
+        timeout: Timeout of a single attempt in seconds
+        deadline: Default budget of a call in seconds
+        retries: Retries after a retryable failure
+        backoff: Base delay of the exponential backoff in seconds
+        max_backoff: Maximum backoff delay in seconds
+    """
+
+    def __init__(self, model, rate_per_minute=60, burst=5, timeout=15.0, deadline=30.0, retries=2,
+                 backoff=0.5, max_backoff=8.0, breaker_failures=5, breaker_reset=30.0, async_transport=True):
+        """
+        Initialize the client.
+
+        Args:
+            model: genai.GenerativeModel or a stand-in with the same methods
+            rate_per_minute: Sustained requests per minute
+            burst: Requests that may be sent back to back
+            timeout: Timeout of a single attempt in seconds
+            deadline: Default budget of a call in seconds
+            retries: Retries after a retryable failure
+            backoff: Base delay of the exponential backoff in seconds
+            max_backoff: Maximum backoff delay in seconds
+            breaker_failures: Consecutive failures that open the breaker
+            breaker_reset: Seconds before a probe request is let through
+            async_transport: False if the model has no working async call
+                (REST transport); generate() then calls it on a thread
+        """
+        self.model = model
+        self.async_transport = async_transport
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.timeout = float(timeout)
+        self.deadline = float(deadline)
+        self.retries = max(0, int(retries))
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self._counts = {"calls": 0, "succeeded": 0, "retried": 0, "failed": 0, "unavailable": 0}
+
+    @classmethod
+    def from_env(cls, model, **overrides):
+        """
+        Create a client configured from environment variables.
+
+        Args:
+            model: genai.GenerativeModel or a stand-in with the same methods
+            **overrides: Constructor arguments taking precedence over the environment
+
+        Returns:
+            GeminiClient: Configured client
+        """
+        settings = {
+            "rate_per_minute": float(os.getenv("GEMINI_RPM", "60")),
+            "burst": float(os.getenv("GEMINI_BURST", "5")),
+            "timeout": float(os.getenv("GEMINI_TIMEOUT_SECONDS", "15")),
+            "deadline": float(os.getenv("GEMINI_DEADLINE_SECONDS", "30")),
+            "retries": int(os.getenv("GEMINI_RETRIES", "2")),
+            "backoff": float(os.getenv("GEMINI_BACKOFF_SECONDS", "0.5")),
+            "max_backoff": float(os.getenv("GEMINI_MAX_BACKOFF_SECONDS", "8")),
+            "breaker_failures": int(os.getenv("GEMINI_BREAKER_FAILURES", "5")),
+            "breaker_reset": float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30")),
+            "async_transport": not os.getenv("GEMINI_API_ENDPOINT")
+        }
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(model, **settings)
+
+    def _start(self, deadline):
+        """
+        Check the breaker and reserve a token; return (deadline, wait).
+        """
+        self._counts["calls"] += 1
+        deadline = deadline if deadline is not None else time.monotonic() + self.deadline
+        if not self.breaker.allow():
+            self._counts["unavailable"] += 1
+            raise GeminiUnavailable("circuit breaker is open")
+        wait = self.bucket.reserve(deadline)
+        if wait is None:
+            self._counts["unavailable"] += 1
+            raise GeminiUnavailable("rate limit: no request slot before the deadline")
+        return deadline, wait
+
+    def _attempt_timeout(self, deadline):
+        """
+        Return the timeout for the next attempt, or raise if the deadline passed.
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            self._counts["unavailable"] += 1
+            raise GeminiUnavailable("deadline exceeded")
+        return min(self.timeout, remaining)
+
+    def _after_failure(self, error, attempt, deadline):
+        """
+        Record a failed attempt and return the delay before the next one.
+
+        Raises:
+            Exception: The error itself if it is not retryable
+            GeminiUnavailable: If no further attempt fits
+        """
+        if not is_retryable(error):
+            # The provider answered; the request itself was rejected
+            self.breaker.record_success()
+            self._counts["failed"] += 1
+            GEMINI_ERRORS.inc(("rejected",))
+            raise error
+        self.breaker.record_failure()
+        timed_out = isinstance(error, (asyncio.TimeoutError, TimeoutError))
+        GEMINI_ERRORS.inc(("timeout" if timed_out else "retryable",))
+        reason = "timed out" if timed_out else f"failed: {error}"
+        if attempt >= self.retries:
+            self._counts["unavailable"] += 1
+            raise GeminiUnavailable(f"Gemini call {reason} after {attempt + 1} attempt(s)") from error
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if time.monotonic() + delay >= deadline:
+            self._counts["unavailable"] += 1
+            raise GeminiUnavailable(f"Gemini call {reason}; no time left to retry") from error
+        if not self.breaker.allow():
+            self._counts["unavailable"] += 1
+            raise GeminiUnavailable("circuit breaker is open") from error
+        self._counts["retried"] += 1
+        logger.warning(f"Gemini call {reason}; retrying in {delay:.1f}s...")
+        return delay
+
+    async def generate(self, contents, deadline=None):
+        """
+        Call generate_content_async with rate limiting, retries and the breaker.
+
+        Args:
+            contents: Prompt parts passed to the model
+            deadline: Optional time.monotonic() value by which the call must
+                finish (default: now + deadline)
+
+        Returns:
+            GenerateContentResponse: Model response
+
+        Raises:
+            GeminiUnavailable: If the call cannot complete in time
+            Exception: Non-retryable errors from the API (e.g. invalid request)
+        """
+        deadline, wait = self._start(deadline)
+        if wait:
+            await asyncio.sleep(wait)
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            started = time.perf_counter()
+            try:
+                if self.async_transport:
+                    call = self.model.generate_content_async(contents)
+                else:
+                    call = asyncio.to_thread(self.model.generate_content, contents, request_options={"timeout": timeout})
+                response = await asyncio.wait_for(call, timeout=timeout)
+            except Exception as e:
+                GEMINI_ATTEMPT_SECONDS.observe(time.perf_counter() - started, ("error",))
+                await asyncio.sleep(self._after_failure(e, attempt, deadline))
+                attempt += 1
+                continue
+            GEMINI_ATTEMPT_SECONDS.observe(time.perf_counter() - started, ("ok",))
+            self.breaker.record_success()
+            self._counts["succeeded"] += 1
+            return response
+
+    def generate_sync(self, contents, deadline=None):
+        """
+        Blocking variant of generate() for synchronous callers.
+
+        Args:
+            contents: Prompt parts passed to the model
+            deadline: Optional time.monotonic() deadline
+
+        Returns:
+            GenerateContentResponse: Model response
+
+        Raises:
+            GeminiUnavailable: If the call cannot complete in time
+            Exception: Non-retryable errors from the API
+        """
+        deadline, wait = self._start(deadline)
+        if wait:
+            time.sleep(wait)
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout(deadline)
+            started = time.perf_counter()
+            try:
+                response = self.model.generate_content(contents, request_options={"timeout": timeout})
+            except Exception as e:
+                GEMINI_ATTEMPT_SECONDS.observe(time.perf_counter() - started, ("error",))
+                time.sleep(self._after_failure(e, attempt, deadline))
+                attempt += 1
+                continue
+            GEMINI_ATTEMPT_SECONDS.observe(time.perf_counter() - started, ("ok",))
+            self.breaker.record_success()
+            self._counts["succeeded"] += 1
+            return response
+
+    def stats(self):
+        """
+        Return call counters and the breaker state.
+        """
+        return {**self._counts, "breaker": self.breaker.state, "breaker_rejected": self.breaker.rejected}
+
+# ============================================================================
+# MODEL CREATION
+# ============================================================================
+
+def create_model(api_key, model_name):
+    """
+    Configure the Gemini SDK and create the model.
+
+    Args:
+        api_key: Gemini API key
+        model_name: Gemini model name
+
+    Returns:
+        genai.GenerativeModel
+
+    Raises:
+        ValueError: If no API key is given for the real model
+    """
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    endpoint = os.getenv("GEMINI_API_ENDPOINT")
+    if endpoint:
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": endpoint})
+    else:
+        genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
+
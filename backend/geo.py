@@ -0,0 +1,298 @@
+"""
+Geospatial Damage Index - Locating Reports and Linking Duplicates
+
+This module keeps a local spatial index of recently processed damages so the
+same pothole reported by several people is analyzed only once. Each indexed
+damage carries its location, damage types, Gemini report and annotated image
+ID; a new report whose location and damage types match a recent entry is
+linked to it instead of running Gemini and the storage upload again.
+
+Key Features:
+    - GPS extraction from EXIF (GPSInfo IFD), as decimal degrees
+    - Geohash bucketing sized to the match radius; lookups only scan the
+      cells around the query point
+    - Duplicate matching by haversine distance, time window and damage type
+    - Bounded size with age-based expiry
+    - "Nearby damage" queries for arbitrary radii
+
+Configuration (environment variables):
+    DUPLICATE_SUPPRESSION: "false" to disable the index (default: true)
+    DUPLICATE_RADIUS_M: Match radius in meters (default: 15)
+    DUPLICATE_WINDOW_HOURS: How long a damage stays matchable (default: 72)
+    DUPLICATE_INDEX_SIZE: Maximum indexed damages (default: 50000)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import math
+import os
+import time
+from collections import deque
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_EARTH_RADIUS_M = 6371008.8
+_METERS_PER_DEGREE = math.pi * _EARTH_RADIUS_M / 180
+
+# EXIF tags
+_GPS_IFD = 0x8825
+_GPS_LATITUDE_REF, _GPS_LATITUDE, _GPS_LONGITUDE_REF, _GPS_LONGITUDE = 1, 2, 3, 4
+
+# ============================================================================
+# LOCATIONS
+# ============================================================================
+
+def gps_from_exif(exif):
+    """
+    Read the GPS position from EXIF data.
+
+    Args:
+        exif: PIL Image.Exif (from Image.getexif())
+
+    Returns:
+        tuple: (latitude, longitude) in decimal degrees, or None if the image
+            has no usable GPS position
+    """
+    try:
+        gps = exif.get_ifd(_GPS_IFD)
+        if _GPS_LATITUDE not in gps or _GPS_LONGITUDE not in gps:
+            return None
+
+        def degrees(value, ref, negative):
+            d, m, s = (float(v) for v in value)
+            result = d + m / 60 + s / 3600
+            return -result if str(ref).upper().startswith(negative) else result
+
+        location = (
+            degrees(gps[_GPS_LATITUDE], gps.get(_GPS_LATITUDE_REF, "N"), "S"),
+            degrees(gps[_GPS_LONGITUDE], gps.get(_GPS_LONGITUDE_REF, "E"), "W")
+        )
+    except (TypeError, ValueError, ZeroDivisionError, KeyError, AttributeError):
+        return None
+    return location if valid_location(*location) and location != (0.0, 0.0) else None
+
+
+def valid_location(latitude, longitude):
+    """
+    Return True if the coordinates are finite and within range.
+    """
+    return (
+        math.isfinite(latitude) and math.isfinite(longitude)
+        and -90 <= latitude <= 90 and -180 <= longitude <= 180
+    )
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two points in meters.
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    )
+    return 2 * _EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def geohash(latitude, longitude, precision=8):
+    """
+    Encode a position as a geohash string.
+
+    Args:
+        latitude: Latitude in decimal degrees
+        longitude: Longitude in decimal degrees
+        precision: Number of characters (each adds 5 bits)
+
+    Returns:
+        str: Geohash of the cell containing the position
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, value, bits, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            value, bits = 0, 0
+    return "".join(chars)
+
+
+def _cell_degrees(precision):
+    """
+    Return the (latitude, longitude) size in degrees of a geohash cell.
+    """
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+# ============================================================================
+# INDEX
+# ============================================================================
+
+class DamageIndex:
+    """
+    In-memory geohash index of recently processed damages.
+
+    Cells are the smallest geohash cells at least `radius_m` high, so a
+    duplicate lookup scans the query cell and its neighbours only.
+
+    Attributes:
+        radius_m: Maximum distance between duplicate reports
+        window_seconds: How long an indexed damage can be matched
+        max_entries: Maximum number of indexed damages (oldest dropped first)
+        precision: Geohash precision of the cells
+    """
+
+    def __init__(self, radius_m=15.0, window_seconds=72 * 3600, max_entries=50000):
+        """
+        Initialize an empty index.
+
+        Args:
+            radius_m: Maximum distance between duplicate reports
+            window_seconds: How long an indexed damage can be matched
+            max_entries: Maximum number of indexed damages
+        """
+        self.radius_m = float(radius_m)
+        self.window_seconds = float(window_seconds)
+        self.max_entries = max(1, int(max_entries))
+        self.precision = max(
+            [p for p in range(1, 10) if _cell_degrees(p)[0] * _METERS_PER_DEGREE >= self.radius_m] or [1]
+        )
+        self._cells = {}
+        self._entries = deque()
+        self.links = 0
+        self.lookups = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create an index configured from environment variables.
+
+        Returns:
+            DamageIndex: Configured index, or None if DUPLICATE_SUPPRESSION is false
+        """
+        if os.getenv("DUPLICATE_SUPPRESSION", "true").lower() != "true":
+            return None
+        return cls(
+            radius_m=float(os.getenv("DUPLICATE_RADIUS_M", "15")),
+            window_seconds=float(os.getenv("DUPLICATE_WINDOW_HOURS", "72")) * 3600,
+            max_entries=int(os.getenv("DUPLICATE_INDEX_SIZE", "50000"))
+        )
+
+    def add(self, image_id, latitude, longitude, types, report, processed_image_id):
+        """
+        Index a processed damage.
+
+        Args:
+            image_id: imageId of the record holding the analysis
+            latitude: Latitude in decimal degrees
+            longitude: Longitude in decimal degrees
+            types: Damage types detected in the image
+            report: Gemini structured report
+            processed_image_id: Appwrite file ID of the annotated image
+        """
+        self._prune()
+        entry = {
+            "image_id": image_id,
+            "latitude": latitude,
+            "longitude": longitude,
+            "types": sorted(set(types)),
+            "report": report,
+            "processed_image_id": processed_image_id,
+            "indexed_at": time.time(),
+            "cell": geohash(latitude, longitude, self.precision)
+        }
+        self._cells.setdefault(entry["cell"], []).append(entry)
+        self._entries.append(entry)
+        while len(self._entries) > self.max_entries:
+            self._remove(self._entries.popleft())
+
+    def find_duplicate(self, latitude, longitude, types):
+        """
+        Return the closest recent damage within the radius sharing a damage type.
+
+        Args:
+            latitude: Latitude of the new report
+            longitude: Longitude of the new report
+            types: Damage types detected in the new report
+
+        Returns:
+            dict: The matching entry, or None
+        """
+        self.lookups += 1
+        types = set(types)
+        for entry in self.nearby(latitude, longitude, self.radius_m):
+            if types & set(entry["types"]):
+                self.links += 1
+                return entry
+        return None
+
+    def nearby(self, latitude, longitude, radius_m):
+        """
+        Return recent damages within a radius, closest first.
+
+        Args:
+            latitude: Latitude of the query point
+            longitude: Longitude of the query point
+            radius_m: Search radius in meters
+
+        Returns:
+            list: Index entries with an added "distance_m", sorted by distance
+        """
+        self._prune()
+        cell_lat, cell_lon = _cell_degrees(self.precision)
+        lat_steps = math.ceil(radius_m / (cell_lat * _METERS_PER_DEGREE))
+        lon_meters = cell_lon * _METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6)
+        lon_steps = math.ceil(radius_m / lon_meters)
+
+        if (2 * lat_steps + 1) * (2 * lon_steps + 1) > len(self._cells):
+            candidates = (entry for entries in self._cells.values() for entry in entries)
+        else:
+            cells = {
+                geohash(
+                    max(-90.0, min(90.0, latitude + i * cell_lat)),
+                    (longitude + j * cell_lon + 180.0) % 360.0 - 180.0,
+                    self.precision
+                )
+                for i in range(-lat_steps, lat_steps + 1)
+                for j in range(-lon_steps, lon_steps + 1)
+            }
+            candidates = (entry for cell in cells for entry in self._cells.get(cell, ()))
+
+        matches = []
+        for entry in candidates:
+            distance = haversine_m(latitude, longitude, entry["latitude"], entry["longitude"])
+            if distance <= radius_m:
+                matches.append({**entry, "distance_m": distance})
+        return sorted(matches, key=lambda entry: entry["distance_m"])
+
+    def stats(self):
+        """
+        Return index size and link counters.
+        """
+        return {
+            "entries": len(self._entries),
+            "cells": len(self._cells),
+            "lookups": self.lookups,
+            "links": self.links
+        }
+
+    def _prune(self):
+        cutoff = time.time() - self.window_seconds
+        while self._entries and self._entries[0]["indexed_at"] < cutoff:
+            self._remove(self._entries.popleft())
+
+    def _remove(self, entry):
+        cell = self._cells.get(entry["cell"])
+        if cell:
+            cell.remove(entry)
+            if not cell:
+                del self._cells[entry["cell"]]
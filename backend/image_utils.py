@@ -0,0 +1,342 @@
+"""
+Image Utilities - In-Memory Decoding and Encoding
+
+This module provides helpers for moving images between raw bytes and NumPy
+arrays without touching the filesystem. The functions are module-level so
+they can be submitted to the inference executor in both thread and process
+mode.
+
+Key Features:
+    - Decode uploaded bytes straight into a BGR NumPy array
+    - Prepare an upload in one pass: reduced-size JPEG decode (draft mode),
+      EXIF orientation, a model-sized input, a size-capped JPEG for Gemini
+      and a capped base image for the annotated output; the EXIF GPS
+      position is read along the way
+    - Encode arrays (e.g. annotated detections) into JPEG or WebP bytes
+    - Render detections into an annotated image in one drawing pass, with
+      boxes rescaled to the image they are drawn on
+    - Read the images contained in an uploaded zip or tar archive, with
+      entry count and uncompressed size limits checked before decompressing
+    - Draw synthetic road scenes for benchmarks and model parity checks
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import io
+import mimetypes
+import tarfile
+import zipfile
+
+# Third-party imports
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+# Local imports
+from geo import gps_from_exif
+from postprocess import draw_detections
+from uploads import BufferReader, UploadTooLarge
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def decode_image(data):
+    """
+    Decode image bytes into a BGR NumPy array.
+
+    Args:
+        data: Encoded image bytes (JPEG, PNG, ...)
+
+    Returns:
+        numpy.ndarray: Decoded BGR image, or None if the bytes are not an image
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def encode_image(image, extension=".jpg", params=None):
+    """
+    Encode a BGR NumPy array into image bytes.
+
+    Args:
+        image: BGR image as a NumPy array
+        extension: Output format extension understood by OpenCV (e.g. ".jpg")
+        params: Optional list of OpenCV encoding parameters
+
+    Returns:
+        bytes: Encoded image
+
+    Raises:
+        ValueError: If OpenCV fails to encode the image
+    """
+    ok, encoded = cv2.imencode(extension, image, params or [])
+    if not ok:
+        raise ValueError(f"Failed to encode image as {extension}.")
+    return encoded.tobytes()
+
+
+def read_archive_images(fileobj, filename="", max_files=None, max_entry_bytes=None, max_total_bytes=None):
+    """
+    Read all image entries from a zip or tar archive.
+
+    Entries are returned sorted by name; non-image entries (by extension)
+    and directories are skipped. The archive type is detected from its
+    content, so the file name is only used in error messages. The limits
+    are enforced while iterating: an entry's declared size is checked before
+    it is decompressed, and every read is bounded, so an archive bomb never
+    inflates past the limits.
+
+    Args:
+        fileobj: Seekable binary file object containing the archive
+        filename: Original archive file name
+        max_files: Maximum number of image entries (None: unlimited)
+        max_entry_bytes: Maximum uncompressed size of one image (None: unlimited)
+        max_total_bytes: Maximum uncompressed size of all images (None: unlimited)
+
+    Returns:
+        list: (entry_name, image_bytes, mime_type) tuples
+
+    Raises:
+        ValueError: If the file is neither a zip nor a tar archive, or holds
+            more than max_files images
+        UploadTooLarge: If an image or all images together exceed their limit
+    """
+    def image_mime_type(name):
+        mime_type = mimetypes.guess_type(name)[0]
+        return mime_type if mime_type and mime_type.startswith("image/") else None
+
+    entries = []
+    total = 0
+
+    def check_size(name, size):
+        if max_entry_bytes is not None and size > max_entry_bytes:
+            raise UploadTooLarge(f"Image {name} exceeds the {max_entry_bytes} byte limit.")
+        if max_total_bytes is not None and total + size > max_total_bytes:
+            raise UploadTooLarge(f"Images in {filename or 'the archive'} exceed the {max_total_bytes} byte limit in total.")
+
+    def read_entry(name, declared_size, open_entry, mime_type):
+        nonlocal total
+        if max_files is not None and len(entries) >= max_files:
+            raise ValueError(f"Too many images in {filename or 'the archive'} (maximum {max_files}).")
+        check_size(name, declared_size)
+        # Do not trust the header: read at most one byte past the limits
+        limits = [limit for limit in (max_entry_bytes, max_total_bytes and max_total_bytes - total) if limit is not None]
+        with open_entry() as entry:
+            data = entry.read(min(limits) + 1 if limits else -1)
+        check_size(name, len(data))
+        total += len(data)
+        entries.append((name, data, mime_type))
+
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in sorted(archive.infolist(), key=lambda i: i.filename):
+                mime_type = image_mime_type(info.filename)
+                if not info.is_dir() and mime_type:
+                    read_entry(info.filename, info.file_size, lambda: archive.open(info), mime_type)
+        return entries
+
+    fileobj.seek(0)
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+            for member in sorted(archive.getmembers(), key=lambda m: m.name):
+                mime_type = image_mime_type(member.name)
+                if member.isfile() and mime_type:
+                    read_entry(member.name, member.size, lambda: archive.extractfile(member), mime_type)
+    except tarfile.TarError as e:
+        raise ValueError(f"{filename or 'Upload'} is not a zip or tar archive: {e}")
+    return entries
+
+
+# ============================================================================
+# PREPROCESSING
+# ============================================================================
+
+class PreparedImage:
+    """
+    Downscaled views of one uploaded image, produced by prepare_image().
+
+    All boxes produced on `model_image` are mapped back to the original
+    (orientation-corrected) image by multiplying with `scale`.
+
+    Attributes:
+        original_size: (width, height) of the upload after EXIF orientation
+        model_image: BGR array with its long side at most the model input size
+        scale: Original pixels per model_image pixel
+        annotated_base: BGR array the annotated output is drawn on
+        gemini_bytes: JPEG sent to Gemini instead of the original upload
+        gemini_scale: Gemini image pixels per original pixel
+        detail_image: Higher-resolution BGR array for tiled inference, or None
+        gps: (latitude, longitude) from EXIF, or None
+    """
+
+    def __init__(self, original_size, model_image, annotated_base, gemini_bytes, gemini_long_side,
+                 detail_image=None, gps=None):
+        """
+        Initialize the prepared views.
+
+        Args:
+            original_size: (width, height) of the upload after EXIF orientation
+            model_image: Model-sized BGR array
+            annotated_base: BGR array for the annotated output
+            gemini_bytes: JPEG bytes for Gemini
+            gemini_long_side: Long side in pixels of the Gemini JPEG
+            detail_image: Optional higher-resolution view for tiled inference
+            gps: Optional (latitude, longitude) from EXIF
+        """
+        self.original_size = original_size
+        self.model_image = model_image
+        self.annotated_base = annotated_base
+        self.gemini_bytes = gemini_bytes
+        self.scale = max(original_size) / max(model_image.shape[:2])
+        self.gemini_scale = gemini_long_side / max(original_size)
+        self.detail_image = detail_image
+        self.gps = gps
+
+
+def _fit(image, max_side):
+    """
+    Shrink an image so its long side is at most max_side (never enlarges).
+    """
+    height, width = image.shape[:2]
+    factor = max_side / max(height, width)
+    if factor >= 1:
+        return image
+    size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def prepare_image(data, model_size=640, gemini_max_side=1024, gemini_quality=85, annotated_max_side=1920,
+                  detail_max_side=0):
+    """
+    Decode an upload once and derive every view the pipeline needs.
+
+    JPEGs are decoded in draft mode, i.e. already reduced by 1/2, 1/4 or 1/8
+    during decoding when the largest requested view is that much smaller
+    than the photo. EXIF orientation is applied before anything is derived.
+    Formats Pillow cannot read fall back to a full OpenCV decode.
+
+    Args:
+        data: Encoded image (bytes-like; read in place, not copied)
+        model_size: Long side of the model input (YOLO letterboxes it to a square)
+        gemini_max_side: Long side cap of the JPEG sent to Gemini
+        gemini_quality: JPEG quality of the Gemini image
+        annotated_max_side: Long side cap of the annotated output
+        detail_max_side: Long side cap of the view kept for tiled inference
+            (0 keeps no detail view)
+
+    Returns:
+        PreparedImage: Prepared views, or None if the bytes are not an image
+    """
+    gps = None
+    try:
+        pil_image = Image.open(io.BytesIO(data) if isinstance(data, bytes) else BufferReader(data))
+        width, height = pil_image.size
+        exif = pil_image.getexif()
+        gps = gps_from_exif(exif)
+        if exif.get(0x0112, 1) in _TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+        largest = max(model_size, gemini_max_side, annotated_max_side, detail_max_side)
+        factor = min(1.0, largest / max(width, height))
+        stored_width, stored_height = pil_image.size
+        pil_image.draft("RGB", (max(1, int(stored_width * factor)), max(1, int(stored_height * factor))))
+        pil_image = ImageOps.exif_transpose(pil_image).convert("RGB")
+        image = cv2.cvtColor(np.asarray(pil_image), cv2.COLOR_RGB2BGR)
+        del pil_image
+    except Exception:
+        # Not readable by Pillow; OpenCV applies the EXIF orientation itself
+        image = decode_image(data)
+        if image is None:
+            return None
+        height, width = image.shape[:2]
+
+    annotated_base = _fit(image, annotated_max_side)
+    model_image = _fit(image, model_size)
+    gemini_image = _fit(image, gemini_max_side)
+    gemini_bytes = encode_image(gemini_image, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, int(gemini_quality)])
+    detail_image = _fit(image, detail_max_side) if detail_max_side else None
+    return PreparedImage(
+        (width, height), model_image, annotated_base, gemini_bytes, max(gemini_image.shape[:2]), detail_image, gps
+    )
+
+
+def render_annotated(prepared, detections, extension=".jpg", quality=85):
+    """
+    Draw detections onto the annotated base image (in place) and encode it.
+
+    Args:
+        prepared: PreparedImage the detections were made on
+        detections: postprocess.Detections in original image coordinates
+        extension: Output format, ".jpg" or ".webp"
+        quality: Encoding quality (1-100)
+
+    Returns:
+        bytes: Encoded annotated image
+    """
+    image = prepared.annotated_base
+    boxes = detections.boxes * (max(image.shape[:2]) / max(prepared.original_size))
+    labels = [f"{name} {confidence:.2f}" for name, confidence in zip(detections.names, detections.confidences.tolist())]
+    draw_detections(image, boxes, detections.class_ids, labels)
+    quality_flag = cv2.IMWRITE_WEBP_QUALITY if extension == ".webp" else cv2.IMWRITE_JPEG_QUALITY
+    return encode_image(image, extension, [quality_flag, int(quality)])
+
+
+def synthetic_road_image(width, height, rng):
+    """
+    Draw a synthetic road scene with damage-like structures.
+
+    Used by the benchmark corpus and as the default parity-check image of
+    exported models; it is no substitute for a real road photo.
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        rng: numpy.random.Generator
+
+    Returns:
+        numpy.ndarray: BGR image
+    """
+    # Asphalt: grey base with coarse and fine grain
+    base = rng.integers(85, 120)
+    coarse = cv2.resize(rng.normal(0, 12, (height // 16 + 1, width // 16 + 1)), (width, height))
+    grain = rng.normal(0, 9, (height, width))
+    image = np.clip(base + coarse + grain, 0, 255).astype(np.uint8)
+    image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+    # Lane markings
+    for x in rng.choice(width, size=int(rng.integers(1, 3)), replace=False):
+        for y in range(0, height, height // 6):
+            cv2.rectangle(image, (int(x), y), (int(x) + width // 80, y + height // 12), (225, 225, 225), -1)
+
+    # Potholes: dark ellipses with a lighter rim
+    for _ in range(int(rng.integers(1, 4))):
+        center = (int(rng.integers(width // 8, width * 7 // 8)), int(rng.integers(height // 3, height * 7 // 8)))
+        axes = (int(rng.integers(width // 40, width // 12)), int(rng.integers(height // 50, height // 20)))
+        angle = float(rng.uniform(0, 180))
+        cv2.ellipse(image, center, (axes[0] + 6, axes[1] + 6), angle, 0, 360, (130, 130, 135), -1)
+        cv2.ellipse(image, center, axes, angle, 0, 360, (35, 35, 40), -1)
+
+    # Cracks: jagged polylines, mostly longitudinal or transverse
+    for _ in range(int(rng.integers(2, 6))):
+        points = [(int(rng.integers(0, width)), int(rng.integers(0, height)))]
+        horizontal = rng.random() < 0.5
+        for _ in range(int(rng.integers(6, 20))):
+            x, y = points[-1]
+            step = int(rng.integers(width // 60, width // 25))
+            jitter = int(rng.integers(-step // 2, step // 2 + 1))
+            points.append((x + step, y + jitter) if horizontal else (x + jitter, y + step))
+        thickness = max(1, width // 800)
+        cv2.polylines(image, [np.array(points, dtype=np.int32)], False, (30, 30, 30), thickness)
+
+    # Occasional manhole cover
+    if rng.random() < 0.3:
+        center = (int(rng.integers(width // 4, width * 3 // 4)), int(rng.integers(height // 2, height * 7 // 8)))
+        radius = max(4, width // 30)
+        cv2.circle(image, center, radius, (60, 65, 70), -1)
+        cv2.circle(image, center, radius, (40, 40, 40), max(1, radius // 8))
+    return image
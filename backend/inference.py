@@ -6,23 +6,50 @@ using YOLO object detection and Google Gemini AI for detailed analysis.
 
 Features:
     - YOLO-based damage detection with bounding box visualization
+    - Optional sliced inference: overlapping tiles plus the full frame in one
+      YOLO batch, merged with cross-tile NMS or WBF
     - AI-powered severity analysis using Google Gemini
+    - Concurrent per-detection Gemini calls with bounded concurrency, through
+      the shared Gemini client (rate limit, timeouts, jittered retries and a
+      circuit breaker); detections are marked for later analysis when
+      Gemini is unavailable
+    - Optional batched mode that packs several crops into one structured-JSON
+      Gemini request, falling back to per-crop calls on invalid responses
+    - Local severity model per detection: only crops whose estimate is
+      uncertain are sent to Gemini
+    - Array-based post-processing of the boxes (one tensor transfer per
+      image) and single-pass annotation drawing
     - Damage scoring based on confidence and severity
     - Detailed report generation with repair recommendations
+    - Runs on the shared pipeline core (pipeline.py): the same model
+      instance and class map as the API, YOLO calls batched across
+      concurrent predictions, and timed stages (see Predictor.stats())
 
 Author: SafeStreet Team
 """
 
 # Standard library imports
+import asyncio
+import json
+import logging
 import os
+import threading
+import weakref
 
 # Third-party imports
 import cv2
-import torch
 import numpy as np
-from ultralytics import YOLO
 from PIL import Image
-import google.generativeai as genai
+
+# Local imports
+from batching import BatchScheduler
+from gemini_client import GeminiClient, GeminiUnavailable, create_model
+from pipeline import DAMAGE_TYPE_MAPPING, Detector, Pipeline, Stage, shared_model
+from postprocess import draw_detections, postprocess
+from observability import configure_logging
+from severity import SeverityModel
+
+logger = logging.getLogger(__name__)
 
 
 class Predictor:
@@ -33,34 +60,84 @@ class Predictor:
     analyze, and report on road damage in images.
     
     Attributes:
-        yolo_model: Loaded YOLO model for damage detection
+        yolo_model: Loaded YOLO model for damage detection (shared per process)
         yolo_class_names: Mapping of class IDs to class names
-        damage_type_mapping: Mapping of YOLO codes to human-readable damage types
+        damage_type_mapping: Mapping of YOLO codes to human-readable damage
+            types (DAMAGE_TYPE_MAPPING, shared with the API)
+        detector: Detector batching YOLO calls of concurrent predictions
+        pipeline: Pipeline of the decode, detect, postprocess, enrich,
+            assemble, annotate and persist stages
         gemini_model: Google Gemini model for AI-powered analysis
+        gemini_client: GeminiClient applying the rate limit, retries and
+            circuit breaker to every call
+        gemini_concurrency: Maximum number of Gemini calls in flight per image
+        gemini_timeout: Timeout in seconds for a single Gemini call
+        gemini_retries: Number of retries after a failed or timed-out Gemini call
+        gemini_backoff: Initial retry delay in seconds (doubled on each retry)
+        gemini_batch_size: Maximum crops per batched Gemini request (0 or 1 disables batching)
+        severity_model: SeverityModel deciding which detections need Gemini
     """
+
+    # Severity labels accepted in batched responses and their numerical values
+    SEVERITY_LEVELS = {"minor": 1, "moderate": 2, "severe": 3}
+    SEVERITY_NAMES = {1: "Minor", 2: "Moderate", 3: "Severe"}
+
+    # Analysis text of detections whose Gemini call could not be made
+    ANALYSIS_PENDING = "Analysis pending: Gemini is currently unavailable."
+
+    # Analysis text of detections whose severity was estimated locally
+    LOCAL_ANALYSIS = (
+        "**1. Severity Analysis:** {label}. Estimated locally from the damage type, detection "
+        "confidence and size (confidence {confidence:.2f}); no expert analysis was requested.\n"
+        "**2. Location Description:** Not analyzed.\n"
+        "**3. Repair Recommendations:** Not analyzed."
+    )
     
-    def __init__(self, yolo_model_path, gemini_api_key):
+    def __init__(self, yolo_model_path, gemini_api_key, gemini_concurrency=4,
+                 gemini_timeout=30.0, gemini_retries=2, gemini_backoff=1.0,
+                 gemini_batch_size=0, inference_backend=None, tile_size=0, tile_overlap=0.2,
+                 tile_max=16, tile_merge="nms", tile_merge_iou=0.5, severity_model=None, gemini_model=None):
         """
         Initialize the Predictor with YOLO and Gemini models.
         
         Args:
             yolo_model_path: Path to the YOLO model file (.pt)
-            gemini_api_key: Google Gemini API key
+            gemini_api_key: Google Gemini API key (unused with gemini_model)
+            gemini_concurrency: Maximum number of Gemini calls in flight per image
+            gemini_timeout: Timeout in seconds for a single Gemini call
+            gemini_retries: Number of retries after a failed or timed-out Gemini call
+            gemini_backoff: Base retry delay in seconds (jittered, doubled on each retry)
+            gemini_batch_size: Maximum crops per batched Gemini request
+                (0 or 1 sends one request per detection)
+            inference_backend: YOLO runtime ("torch", "onnx", "openvino" or
+                "torchscript"; default: INFERENCE_BACKEND, see model_runtime.py)
+            tile_size: Tile side in pixels for sliced inference on large images
+                (0 runs a single full-frame pass)
+            tile_overlap: Fraction of a tile shared with its neighbour
+            tile_max: Maximum number of tiles per image
+            tile_merge: Cross-tile merge method, "nms" or "wbf"
+            tile_merge_iou: Minimum IoU for merging boxes across tiles
+            severity_model: SeverityModel deciding which detections need
+                Gemini (default: SeverityModel.from_env(), see severity.py)
+            gemini_model: Model object to use instead of creating the Gemini
+                model from gemini_api_key, e.g. bench.fake_services.FakeGeminiModel
         
         Raises:
             AssertionError: If YOLO model file doesn't exist
             Exception: If model loading or API configuration fails
         """
         assert os.path.exists(yolo_model_path), f"YOLO model not found at {yolo_model_path}"
+        configure_logging()
 
-        # Load YOLO model with environment variable workaround
+        # Load YOLO model with environment variable workaround (once per
+        # process; later Predictors and the API reuse the same instance)
         original_torch_load_env = os.environ.get("TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD")
         os.environ["TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD"] = "1"
         try:
-            self.yolo_model = YOLO(yolo_model_path)
-            print("YOLO model loaded successfully.")
+            self.yolo_model, _, backend = shared_model(yolo_model_path, backend=inference_backend)
+            logger.info(f"YOLO model loaded successfully ({backend} backend).")
         except Exception as e:
-            print(f"Fatal Error during YOLO model loading: {e}")
+            logger.error(f"Fatal Error during YOLO model loading: {e}")
             raise e
         finally:
             if original_torch_load_env is not None:
@@ -69,24 +146,62 @@ class Predictor:
                 del os.environ["TORCH_FORCE_NO_WEIGHTS_ONLY_LOAD"]
 
         # Store YOLO class names and damage type mappings
-        self.damage_type_mapping = {
-            'D00': 'Longitudinal Crack',
-            'D10': 'Transverse Crack',
-            'D20': 'Alligator Crack',
-            'D40': 'Pothole',
-            'D50': 'Manhole'
-        }
-        print(f"Defined damage type mapping: {self.damage_type_mapping}")
-
-        # Initialize Gemini AI model
+        self.yolo_class_names = self.yolo_model.names
+        self.damage_type_mapping = DAMAGE_TYPE_MAPPING
+        logger.info(f"Defined damage type mapping: {self.damage_type_mapping}")
+
+        # Initialize Gemini AI model (unless the caller supplies one)
         try:
-            genai.configure(api_key=gemini_api_key)
-            self.gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-            print("Gemini Flash model configured successfully.")
+            self.gemini_model = gemini_model or create_model(gemini_api_key, 'gemini-1.5-flash-latest')
+            logger.info("Gemini Flash model configured successfully.")
         except Exception as e:
-            print(f"Fatal Error during Gemini configuration: {e}")
+            logger.error(f"Fatal Error during Gemini configuration: {e}")
             raise e
 
+        self.gemini_concurrency = max(1, int(gemini_concurrency))
+        self.gemini_timeout = gemini_timeout
+        self.gemini_retries = max(0, int(gemini_retries))
+        self.gemini_backoff = gemini_backoff
+        # Rate limit, deadline and breaker settings come from the GEMINI_* variables
+        self.gemini_client = GeminiClient.from_env(
+            self.gemini_model, timeout=gemini_timeout, retries=self.gemini_retries, backoff=gemini_backoff
+        )
+        self.gemini_batch_size = max(0, int(gemini_batch_size))
+        self.tile_size = max(0, int(tile_size))
+        self.severity_model = severity_model or SeverityModel.from_env()
+
+        # Concurrent predictions (and the tiles of one image) share YOLO batches
+        self.detector = Detector(
+            BatchScheduler(self._predict_images), self.tile_size, tile_overlap, tile_max, tile_merge, tile_merge_iou
+        )
+        self.pipeline = Pipeline("predictor", [
+            Stage("decode", self._decode_stage),
+            Stage("detect", self._detect_stage),
+            Stage("postprocess", self._postprocess_stage),
+            Stage("enrich", self._enrich_stage),
+            Stage("assemble", self._assemble_stage),
+            Stage("annotate", self._annotate_stage),
+            Stage("persist", self._persist_stage)
+        ])
+        # Private event loop thread running every pipeline call, started on first use
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @staticmethod
+    def _build_prompt(damage_type):
+        """
+        Build the per-detection Gemini prompt for a damage type.
+        """
+        return (
+            f"This image shows a type of road damage identified as '{damage_type}'. "
+            f"Your task is to act as a road maintenance expert. "
+            f"Analyze the image and provide a concise report. "
+            f"Structure your response with three distinct sections: "
+            f"1. **Severity Analysis:** Describe the severity of the damage (e.g., minor, moderate, severe) and explain why. "
+            f"2. **Location Description:** Briefly describe where the damage is located within the provided image crop. "
+            f"3. **Repair Recommendations:** Suggest specific, actionable repair steps for this type of damage. Be practical and clear."
+        )
+
     def generate_gemini_response(self, image_crop, damage_type):
         """
         Generate AI-powered analysis for detected road damage.
@@ -98,31 +213,272 @@ class Predictor:
         Returns:
             str: Detailed analysis text from Gemini AI
         """
-        prompt = (
-            f"This image shows a type of road damage identified as '{damage_type}'. "
-            f"Your task is to act as a road maintenance expert. "
-            f"Analyze the image and provide a concise report. "
-            f"Structure your response with three distinct sections: "
-            f"1. **Severity Analysis:** Describe the severity of the damage (e.g., minor, moderate, severe) and explain why. "
-            f"2. **Location Description:** Briefly describe where the damage is located within the provided image crop. "
-            f"3. **Repair Recommendations:** Suggest specific, actionable repair steps for this type of damage. Be practical and clear."
-        )
+        prompt = self._build_prompt(damage_type)
         try:
-            response = self.gemini_model.generate_content([prompt, image_crop])
+            response = self.gemini_client.generate_sync([prompt, image_crop])
             if not response.parts:
                 return "Content generation was blocked by safety settings. Cannot provide analysis."
             return response.text
+        except GeminiUnavailable as e:
+            logger.warning(f"Gemini unavailable: {e}")
+            return self.ANALYSIS_PENDING
         except Exception as e:
-            print(f"Error generating response from Gemini: {e}")
+            logger.error(f"Error generating response from Gemini: {e}")
             return "Failed to generate analysis from Gemini due to an API error."
 
+    async def generate_gemini_response_async(self, image_crop, damage_type, semaphore):
+        """
+        Generate AI-powered analysis for one detection without blocking.
+        
+        The call waits for a slot on `semaphore` and goes through the Gemini
+        client, which bounds each attempt by `gemini_timeout` and retries
+        retryable failures up to `gemini_retries` times with jittered
+        exponential backoff.
+        
+        Args:
+            image_crop: PIL Image object of the cropped damage area
+            damage_type: Type of damage detected (e.g., "Pothole")
+            semaphore: asyncio.Semaphore bounding concurrent Gemini calls
+        
+        Returns:
+            str: Detailed analysis text from Gemini AI, or ANALYSIS_PENDING
+            if Gemini is unavailable
+        """
+        prompt = self._build_prompt(damage_type)
+        try:
+            async with semaphore:
+                response = await self.gemini_client.generate([prompt, image_crop])
+            if not response.parts:
+                return "Content generation was blocked by safety settings. Cannot provide analysis."
+            return response.text
+        except GeminiUnavailable as e:
+            logger.warning(f"Gemini unavailable for '{damage_type}': {e}")
+            return self.ANALYSIS_PENDING
+        except Exception as e:
+            logger.error(f"Error generating response from Gemini: {e}")
+        return "Failed to generate analysis from Gemini due to an API error."
+
+    @staticmethod
+    def _build_batch_prompt(damage_types):
+        """
+        Build the Gemini prompt for a batch of crops, requesting structured JSON.
+        """
+        crop_list = "\n".join(
+            f"- Image {index}: road damage identified as '{damage_type}'"
+            for index, damage_type in enumerate(damage_types)
+        )
+        return (
+            "You are a road maintenance expert. The following images are crops of "
+            "individual road damages detected in one photo, given in order:\n"
+            f"{crop_list}\n\n"
+            "For EACH image, provide a concise assessment. Respond with ONLY a JSON array "
+            "containing one object per image, with the following keys:\n"
+            "1. `index`: The image number from the list above (integer).\n"
+            "2. `severity`: One of \"minor\", \"moderate\" or \"severe\".\n"
+            "3. `severity_analysis`: One or two sentences explaining the severity.\n"
+            "4. `location`: Where the damage is located within the crop.\n"
+            "5. `repair`: Specific, actionable repair steps for this damage.\n"
+            "Example: [{\"index\": 0, \"severity\": \"moderate\", \"severity_analysis\": \"...\", "
+            "\"location\": \"...\", \"repair\": \"...\"}]"
+        )
+
+    def _validate_batch_response(self, response_text, count):
+        """
+        Parse and validate a batched Gemini response.
+        
+        Args:
+            response_text: Raw text returned by Gemini
+            count: Number of crops in the batch
+        
+        Returns:
+            list: One (analysis_text, numerical_severity) tuple per crop in
+            index order, or None if the response is not valid
+        """
+        text = response_text.strip()
+        if text.startswith("```"):
+            text = text.strip("`").strip()
+            if text.startswith("json"):
+                text = text[len("json"):].strip()
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(items, dict):
+            items = items.get("detections")
+        if not isinstance(items, list) or len(items) != count:
+            return None
+
+        results = [None] * count
+        for item in items:
+            if not isinstance(item, dict):
+                return None
+            index = item.get("index")
+            severity = str(item.get("severity", "")).strip().lower()
+            if not isinstance(index, int) or not 0 <= index < count or results[index] is not None:
+                return None
+            if severity not in self.SEVERITY_LEVELS:
+                return None
+            # Same section layout as per-crop responses, so reports look identical
+            analysis_text = (
+                f"**1. Severity Analysis:** {severity.capitalize()}. {item.get('severity_analysis', '')}\n"
+                f"**2. Location Description:** {item.get('location', '')}\n"
+                f"**3. Repair Recommendations:** {item.get('repair', '')}"
+            )
+            results[index] = (analysis_text, self.SEVERITY_LEVELS[severity])
+        return results
+
+    async def generate_gemini_batch_response_async(self, crops, semaphore):
+        """
+        Analyze several crops with a single structured-JSON Gemini request.
+        
+        Args:
+            crops: List of (PIL Image, damage type) tuples
+            semaphore: asyncio.Semaphore bounding concurrent Gemini calls
+        
+        Returns:
+            list: One (analysis_text, numerical_severity) tuple per crop
+            (ANALYSIS_PENDING with severity 0 if Gemini is unavailable), or
+            None if the request failed or the response did not validate
+        """
+        prompt = self._build_batch_prompt([damage_type for _, damage_type in crops])
+        contents = [prompt]
+        for index, (crop, _) in enumerate(crops):
+            contents.extend([f"Image {index}:", crop])
+        try:
+            async with semaphore:
+                response = await self.gemini_client.generate(contents)
+            if not response.parts:
+                return None
+            results = self._validate_batch_response(response.text, len(crops))
+            if results is None:
+                logger.warning(f"Batched Gemini response failed validation: {response.text[:200]}")
+            return results
+        except GeminiUnavailable as e:
+            logger.warning(f"Gemini unavailable for a batch of {len(crops)} crop(s): {e}")
+            return [(self.ANALYSIS_PENDING, 0)] * len(crops)
+        except Exception as e:
+            logger.warning(f"Batched Gemini call for {len(crops)} crop(s) failed: {e}.")
+            return None
+
+    async def _analyze_single_crops(self, crops, semaphore):
+        """
+        Analyze crops with one Gemini request each, concurrently.
+        
+        Returns:
+            list: One (analysis_text, None) tuple per crop; the severity is
+            parsed from the text later
+        """
+        texts = await asyncio.gather(*[
+            self.generate_gemini_response_async(crop, damage_type, semaphore)
+            for crop, damage_type in crops
+        ])
+        return [(text, None) for text in texts]
+
+    async def _analyze_batch(self, crops, semaphore):
+        """
+        Analyze a group of crops in one request, falling back to per-crop calls.
+        """
+        results = await self.generate_gemini_batch_response_async(crops, semaphore)
+        if results is None:
+            logger.warning(f"Falling back to per-crop Gemini calls for {len(crops)} crop(s).")
+            results = await self._analyze_single_crops(crops, semaphore)
+        return results
+
+    async def _analyze_crops(self, crops):
+        """
+        Run the Gemini analysis for all crops concurrently.
+        
+        With `gemini_batch_size` > 1, crops are packed into groups of up to
+        that size and each group is sent as one request.
+        
+        Args:
+            crops: List of (PIL Image, damage type) tuples
+        
+        Returns:
+            list: (analysis_text, numerical_severity) tuples in the same order
+            as `crops`; numerical_severity is None when it must be parsed
+            from the text
+        """
+        semaphore = asyncio.Semaphore(self.gemini_concurrency)
+        if self.gemini_batch_size <= 1 or len(crops) <= 1:
+            return await self._analyze_single_crops(crops, semaphore)
+
+        groups = [crops[i:i + self.gemini_batch_size] for i in range(0, len(crops), self.gemini_batch_size)]
+        group_results = await asyncio.gather(*[self._analyze_batch(group, semaphore) for group in groups])
+        return [result for results in group_results for result in results]
+
+    @staticmethod
+    def _parse_analysis(gemini_analysis_text):
+        """
+        Split a Gemini analysis into its sections and derive a numerical severity.
+        
+        Args:
+            gemini_analysis_text: Analysis text returned by Gemini
+        
+        Returns:
+            tuple: (severity_text, location_text, repair_text, numerical_severity)
+        """
+        severity_text_extracted = ""
+        location_text_extracted = ""
+        repair_text_extracted = ""
+        numerical_severity = 0
+
+        if "**1. Severity Analysis:**" in gemini_analysis_text:
+            parts = gemini_analysis_text.split("**1. Severity Analysis:**", 1)
+            if len(parts) > 1:
+                severity_section_content = parts[1].split("**2. Location Description:**", 1)
+                severity_text_extracted = severity_section_content[0].strip()
+
+                if "severe" in severity_text_extracted.lower():
+                    numerical_severity = 3
+                elif "moderate" in severity_text_extracted.lower():
+                    numerical_severity = 2
+                elif "minor" in severity_text_extracted.lower():
+                    numerical_severity = 1
+
+                if len(severity_section_content) > 1:
+                    location_section_content = severity_section_content[1].split("**3. Repair Recommendations:**", 1)
+                    location_text_extracted = location_section_content[0].strip()
+                    if len(location_section_content) > 1:
+                        repair_text_extracted = location_section_content[1].strip()
+
+        return severity_text_extracted, location_text_extracted, repair_text_extracted, numerical_severity
+
     def predict_and_report(self, image_path, save_path):
         """
         Detect road damage in an image and generate a comprehensive report.
         
-        This method performs YOLO detection, generates AI analysis for each
-        detection, calculates damage scores, annotates the image, and saves
-        both the annotated image and a detailed text report.
+        Synchronous wrapper around `predict_and_report_async`. The pipeline
+        runs on the Predictor's private event loop thread, so this works in
+        plain scripts as well as where an event loop is already running
+        (Jupyter, async applications), blocking the caller until the report
+        is ready; async code should await `predict_and_report_async` instead.
+        
+        Args:
+            image_path: Path to the input image
+            save_path: Path where annotated image will be saved
+        
+        Returns:
+            tuple: (detections_list, report_text)
+        
+        Raises:
+            FileNotFoundError: If input image doesn't exist or can't be read
+        """
+        return self._submit(image_path, save_path).result()
+
+    async def predict_and_report_async(self, image_path, save_path):
+        """
+        Detect road damage in an image and generate a comprehensive report.
+        
+        This method runs the image through the Predictor's pipeline: YOLO
+        detection (batched with concurrent calls), local severity estimates
+        per detection, AI analysis generated concurrently for the detections
+        whose estimate is uncertain (the others are reported with the local
+        estimate), damage scores, annotation, and saving both the annotated
+        image and a detailed text report. Results are assembled in detection
+        order regardless of which Gemini call finishes first. The pipeline
+        runs on the Predictor's private event loop thread, so callers on any
+        event loop (and synchronous callers) share its YOLO batches.
         
         Args:
             image_path: Path to the input image
@@ -136,122 +492,199 @@ class Predictor:
         Raises:
             FileNotFoundError: If input image doesn't exist or can't be read
         """
-        original_image = cv2.imread(image_path)
-        if original_image is None:
-            raise FileNotFoundError(f"Image not found or could not be read: {image_path}")
+        return await asyncio.wrap_future(self._submit(image_path, save_path))
+
+    def stats(self):
+        """
+        Return per-stage call counts and timings of the Predictor's pipeline.
+        """
+        return self.pipeline.stats()
+
+    def close(self):
+        """
+        Stop the private event loop thread (also done at interpreter exit).
+        """
+        with self._loop_lock:
+            if self._loop is not None:
+                self._close_loop()
+                self._loop = None
 
-        # Perform YOLO inference
-        yolo_results = self.yolo_model.predict(image_path, verbose=False)
+    # ========================================================================
+    # PIPELINE STAGES
+    # ========================================================================
+
+    def _submit(self, image_path, save_path):
+        """
+        Schedule one pipeline run on the private event loop.
+
+        The batch scheduler and the Gemini client keep asyncio state bound to
+        the loop they first ran on, so every run goes through the same loop.
+
+        Returns:
+            concurrent.futures.Future: Resolves to (detections_list, report_text)
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="predictor-loop", daemon=True)
+                thread.start()
+                self._close_loop = weakref.finalize(self, _stop_loop, self._loop, thread)
+        return asyncio.run_coroutine_threadsafe(self._run_pipeline(image_path, save_path), self._loop)
+
+    async def _run_pipeline(self, image_path, save_path):
+        """Run the pipeline for one image and format its result."""
+        ctx = await self.pipeline.run({"image_path": image_path, "save_path": save_path})
+        report_summary = ctx["report_summary"]
+        return ctx["detections"], "\n".join(report_summary) if report_summary else "No damage detected."
+
+    async def _predict_images(self, images):
+        """Run one batch of images through YOLO off the event loop."""
+        return await asyncio.to_thread(self.yolo_model.predict, images, verbose=False)
+
+    async def _decode_stage(self, ctx):
+        """
+        Read the input image.
+        """
+        ctx["image"] = await asyncio.to_thread(cv2.imread, ctx["image_path"])
+        if ctx["image"] is None:
+            raise FileNotFoundError(f"Image not found or could not be read: {ctx['image_path']}")
+
+    async def _detect_stage(self, ctx):
+        """
+        Perform YOLO inference, sliced into tiles of the full image if configured.
+        """
+        ctx["results"] = await self.detector.detect(ctx["image"], ctx["image"])
+
+    async def _postprocess_stage(self, ctx):
+        """
+        Collect valid detections, clipped to the image (one transfer of the
+        boxes tensor, then array operations).
+        """
+        results = ctx.pop("results")
+        height, width = ctx["image"].shape[:2]
+        found = postprocess(results.boxes.data, self.yolo_class_names, self.damage_type_mapping, image_size=(width, height))
+        if not len(found):
+            logger.info("No detections found by YOLO model.")
+        else:
+            logger.info(f"YOLO found {len(found)} valid detection(s): {found.counts()}")
+        ctx["found"] = found
+
+    async def _enrich_stage(self, ctx):
+        """
+        Estimate every detection's severity locally, then generate AI analysis
+        concurrently for the detections whose estimate is uncertain.
+        """
+        image, found = ctx["image"], ctx["found"]
+        height, width = image.shape[:2]
+        boxes = found.boxes.astype(np.int64)
+        estimates = self.severity_model.estimate_boxes(found.records(), (width, height))
+        uncertain = [i for i, estimate in enumerate(estimates) if not self.severity_model.is_confident(estimate)]
+        analyses = [
+            (self.LOCAL_ANALYSIS.format(label=self.SEVERITY_NAMES[estimate["severity"]], confidence=estimate["confidence"]),
+             estimate["severity"])
+            for estimate in estimates
+        ]
+        if len(uncertain) < len(found):
+            logger.info(f"Local severity used for {len(found) - len(uncertain)} of {len(found)} detection(s).")
+        if uncertain:
+            # Convert the image once; only the crops sent to Gemini are cut out
+            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            crops = [
+                (Image.fromarray(rgb_image[boxes[i, 1]:boxes[i, 3], boxes[i, 0]:boxes[i, 2]]), found.types[i])
+                for i in uncertain
+            ]
+            for i, analysis in zip(uncertain, await self._analyze_crops(crops)):
+                analyses[i] = analysis
+        ctx.update(estimates=estimates, asked=set(uncertain), analyses=analyses)
+
+    async def _assemble_stage(self, ctx):
+        """
+        Score the detections and build the report entries, in detection order.
+        """
+        found, estimates, asked = ctx["found"], ctx["estimates"], ctx["asked"]
         report_summary = []
         detections = []
+        labels = []
+        columns = zip(
+            found.boxes.astype(np.int64).tolist(), found.confidences.tolist(), found.names.tolist(),
+            found.types.tolist(), ctx["analyses"]
+        )
+        for j, ((x1, y1, x2, y2), conf, yolo_code_name, descriptive_damage_name, (gemini_analysis_text, numerical_severity)) in enumerate(columns):
+            if numerical_severity is None:
+                _, _, _, numerical_severity = self._parse_analysis(gemini_analysis_text)
+            severity_source = "gemini" if j in asked else "local"
+            # Gemini unavailable or no severity in its answer: use the local estimate
+            if not numerical_severity:
+                numerical_severity, severity_source = estimates[j]["severity"], "local"
+
+            # Calculate damage score (0-100)
+            damage_score = (conf * numerical_severity / 3.0) * 100 if numerical_severity > 0 else 0
+            damage_score = round(max(0, min(100, damage_score)), 2)
+
+            # Create report entry for this detection
+            report_entry = (
+                f"Detection {j+1}:\n"
+                f"  - Damage Type: {descriptive_damage_name} ({yolo_code_name})\n"
+                f"  - Bounding Box: [{x1}, {y1}, {x2}, {y2}]\n"
+                f"  - Confidence: {conf:.2f}\n"
+                f"  - Numerical Severity: {numerical_severity} (1=Minor, 2=Moderate, 3=Severe)\n"
+                f"  - Damage Score: {damage_score:.2f} (out of 100)\n"
+                f"  - Expert Analysis:\n{gemini_analysis_text}\n"
+            )
+            report_summary.append(report_entry)
+
+            # Store detection data
+            detections.append({
+                "damage_type": descriptive_damage_name,
+                "bbox": [x1, y1, x2, y2],
+                "confidence": round(conf, 2),
+                "numerical_severity": numerical_severity,
+                "severity_source": severity_source,
+                "damage_score": damage_score,
+                "analysis_text": gemini_analysis_text,
+                "pending_enrichment": gemini_analysis_text == self.ANALYSIS_PENDING
+            })
+            labels.append(f"{descriptive_damage_name} (Score:{damage_score:.0f})")
+        ctx.update(report_summary=report_summary, detections=detections, labels=labels)
+
+    async def _annotate_stage(self, ctx):
+        """
+        Draw all bounding boxes and labels in one pass.
+        """
+        draw_detections(ctx["image"], ctx["found"].boxes.astype(np.int64), labels=ctx["labels"], color=(0, 0, 255), line_width=2)
+
+    async def _persist_stage(self, ctx):
+        """
+        Save the annotated image and the text report next to it.
+        """
+        save_path = ctx["save_path"]
+        await asyncio.to_thread(cv2.imwrite, save_path, ctx.pop("image"))
 
-        # Check for detections
-        if not yolo_results or not yolo_results[0].boxes:
-            print("No detections found by YOLO model.")
-        else:
-            # Process each detected damage
-            for j, box in enumerate(yolo_results[0].boxes):
-                # Extract bounding box coordinates
-                xyxy = box.xyxy[0].cpu().numpy().astype(int)
-                x1, y1, x2, y2 = xyxy
-
-                # Validate bounding box
-                if y2 <= y1 or x2 <= x1:
-                    print(f"Skipping invalid bounding box: [{x1}, {y1}, {x2}, {y2}]")
-                    continue
-
-                # Crop the damage area from the image
-                cropped_image_cv = original_image[y1:y2, x1:x2]
-                if cropped_image_cv.size == 0:
-                    print(f"Skipping empty cropped image for box: [{x1}, {y1}, {x2}, {y2}]")
-                    continue
-
-                # Convert to PIL Image for Gemini
-                if cropped_image_cv.shape[0] > 0 and cropped_image_cv.shape[1] > 0:
-                    cropped_image_pil = Image.fromarray(cv2.cvtColor(cropped_image_cv, cv2.COLOR_BGR2RGB))
-                else:
-                    print(f"Skipping invalid cropped image (zero dimension) for box: [{x1}, {y1}, {x2}, {y2}]")
-                    continue
-
-                # Extract detection metadata
-                conf = box.conf[0].cpu().item()
-                cls_id = int(box.cls[0].cpu().item())
-                yolo_code_name = self.yolo_class_names[cls_id]
-                descriptive_damage_name = self.damage_type_mapping.get(yolo_code_name, yolo_code_name)
-
-                # Generate AI analysis
-                print(f"Analyzing detection {j+1}: {descriptive_damage_name} with confidence {conf:.2f}...")
-                gemini_analysis_text = self.generate_gemini_response(cropped_image_pil, descriptive_damage_name)
-
-                severity_text_extracted = ""
-                location_text_extracted = ""
-                repair_text_extracted = ""
-                numerical_severity = 0
-
-                # Parse Gemini response for severity and other details
-                if "**1. Severity Analysis:**" in gemini_analysis_text:
-                    parts = gemini_analysis_text.split("**1. Severity Analysis:**", 1)
-                    if len(parts) > 1:
-                        severity_section_content = parts[1].split("**2. Location Description:**", 1)
-                        severity_text_extracted = severity_section_content[0].strip()
-
-                        if "severe" in severity_text_extracted.lower():
-                            numerical_severity = 3
-                        elif "moderate" in severity_text_extracted.lower():
-                            numerical_severity = 2
-                        elif "minor" in severity_text_extracted.lower():
-                            numerical_severity = 1
-
-                        if len(severity_section_content) > 1:
-                            location_section_content = severity_section_content[1].split("**3. Repair Recommendations:**", 1)
-                            location_text_extracted = location_section_content[0].strip()
-                            if len(location_section_content) > 1:
-                                repair_text_extracted = location_section_content[1].strip()
-
-                # Calculate damage score (0-100)
-                damage_score = (conf * numerical_severity / 3.0) * 100 if numerical_severity > 0 else 0
-                damage_score = round(max(0, min(100, damage_score)), 2)
-
-                # Create report entry for this detection
-                report_entry = (
-                    f"Detection {j+1}:\n"
-                    f"  - Damage Type: {descriptive_damage_name} ({yolo_code_name})\n"
-                    f"  - Bounding Box: [{x1}, {y1}, {x2}, {y2}]\n"
-                    f"  - Confidence: {conf:.2f}\n"
-                    f"  - Numerical Severity: {numerical_severity} (1=Minor, 2=Moderate, 3=Severe)\n"
-                    f"  - Damage Score: {damage_score:.2f} (out of 100)\n"
-                    f"  - Expert Analysis:\n{gemini_analysis_text}\n"
-                )
-                report_summary.append(report_entry)
-
-                # Store detection data
-                detections.append({
-                    "damage_type": descriptive_damage_name,
-                    "bbox": [int(x1), int(y1), int(x2), int(y2)],
-                    "confidence": round(conf, 2),
-                    "numerical_severity": numerical_severity,
-                    "damage_score": damage_score,
-                    "analysis_text": gemini_analysis_text
-                })
-
-                # Draw bounding box and label on image
-                cv2.rectangle(original_image, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                label = f"{descriptive_damage_name} (Score:{damage_score:.0f})"
-                cv2.putText(original_image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
-
-        # Save annotated image
-        cv2.imwrite(save_path, original_image)
-
-        # Save report to a text file
         report_path = os.path.splitext(save_path)[0] + "_report.txt"
         with open(report_path, 'w') as f:
             f.write("Road Damage Detection Report\n============================\n\n")
-            if report_summary:
-                f.write("\n".join(report_summary))
+            if ctx["report_summary"]:
+                f.write("\n".join(ctx["report_summary"]))
             else:
                 f.write("No damage detected in the image.\n")
 
-        print(f"✅ Annotated image saved to {save_path}")
-        print(f"✅ Text report saved to {report_path}")
+        logger.info(f"✅ Annotated image saved to {save_path}")
+        logger.info(f"✅ Text report saved to {report_path}")
+
+
+def _stop_loop(loop, thread):
+    """
+    Cancel the tasks of a Predictor's private event loop, then stop and close it.
+    """
+    async def cancel_tasks():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        loop.stop()
 
-        return detections, "\n".join(report_summary) if report_summary else "No damage detected."
\ No newline at end of file
+    if loop.is_running():
+        asyncio.run_coroutine_threadsafe(cancel_tasks(), loop)
+        thread.join(timeout=5)
+    if not loop.is_running():
+        loop.close()
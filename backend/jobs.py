@@ -0,0 +1,450 @@
+"""
+Job Queue - Asynchronous Image Processing Jobs
+
+This module provides a small job queue used by the asynchronous submission
+mode of /process-image/. Submissions are stored as jobs and answered right
+away with a job ID; a pool of background workers runs the processing
+pipeline and records progress that clients can poll.
+
+Key Features:
+    - Pool of asyncio workers running a pluggable job handler
+    - Optional bound on waiting jobs: submissions beyond it are refused with
+      JobQueueFull, so callers can push back instead of buffering payloads
+    - Job status and stage tracking (queued -> processing -> processed/failed)
+    - In-memory store (default) with retention-based cleanup
+    - SQLite store that keeps queued payloads on disk and resumes unfinished
+      jobs after a restart
+    - Blocking stores run on the shared executor's I/O threads
+    - Per-queue environment prefix, so several queues (e.g. image jobs and
+      Gemini enrichment) can be configured independently
+
+Configuration (environment variables, for the default "JOB" prefix):
+    JOB_QUEUE_BACKEND: "memory" (default) or "sqlite"
+    JOB_QUEUE_PATH: SQLite database file (default: jobs.sqlite3)
+    JOB_WORKERS: Number of background workers (default: 2)
+    JOB_RETENTION_SECONDS: How long finished jobs stay queryable (default: 3600)
+    JOB_MAX_QUEUED: Maximum jobs waiting for a worker, 0 for no limit
+        (default: 100)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Local imports
+from executor import get_executor
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = "queued"
+JOB_PROCESSING = "processing"
+JOB_PROCESSED = "processed"
+JOB_FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """
+    Raised by JobQueue.submit() when the maximum number of jobs is waiting.
+    """
+
+
+# ============================================================================
+# STORES
+# ============================================================================
+
+class MemoryJobStore:
+    """
+    In-process job store. Jobs are lost on restart.
+
+    Attributes:
+        retention: Seconds a finished job is kept before being pruned
+        blocking: False, operations run directly on the event loop
+    """
+
+    blocking = False
+
+    def __init__(self, retention=3600):
+        """
+        Initialize an empty store.
+
+        Args:
+            retention: Seconds a finished job is kept before being pruned
+        """
+        self.retention = float(retention)
+        self._jobs = {}
+        self._payloads = {}
+
+    def create(self, job, payload):
+        """
+        Store a new job and its payload, pruning expired finished jobs.
+        """
+        self._prune()
+        self._jobs[job["id"]] = dict(job)
+        self._payloads[job["id"]] = payload
+
+    def update(self, job_id, **fields):
+        """
+        Update fields of a job. Finished jobs drop their payload.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields, updated_at=time.time())
+        if job["status"] in (JOB_PROCESSED, JOB_FAILED):
+            self._payloads.pop(job_id, None)
+
+    def get(self, job_id):
+        """
+        Return a copy of a job, or None if unknown.
+        """
+        job = self._jobs.get(job_id)
+        return dict(job) if job else None
+
+    def load_payload(self, job_id):
+        """
+        Return the payload of a job, or None if it has been released.
+        """
+        return self._payloads.get(job_id)
+
+    def unfinished(self):
+        """
+        Return the IDs of queued or processing jobs (none after a restart).
+        """
+        return [job_id for job_id, job in self._jobs.items() if job["status"] in (JOB_QUEUED, JOB_PROCESSING)]
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] in (JOB_PROCESSED, JOB_FAILED) and job["updated_at"] < cutoff
+        ]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+            self._payloads.pop(job_id, None)
+
+
+class SQLiteJobStore:
+    """
+    Durable job store backed by a SQLite database.
+
+    Payloads of unfinished jobs are kept in the database so that jobs queued
+    or interrupted before a restart are picked up again on startup.
+
+    Attributes:
+        path: Path to the SQLite database file
+        retention: Seconds a finished job is kept before being pruned
+        blocking: True, operations run on the executor's I/O threads
+    """
+
+    blocking = True
+
+    _COLUMNS = ("id", "original_image_id", "status", "stage", "created_at", "updated_at", "result", "error", "location",
+                "context")
+
+    def __init__(self, path="jobs.sqlite3", retention=3600):
+        """
+        Open (or create) the job database.
+
+        Args:
+            path: Path to the SQLite database file
+            retention: Seconds a finished job is kept before being pruned
+        """
+        self.path = path
+        self.retention = float(retention)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, original_image_id TEXT, status TEXT, stage TEXT, "
+            "created_at REAL, updated_at REAL, result TEXT, error TEXT, payload BLOB, mime_type TEXT, location TEXT, context TEXT)"
+        )
+        # Databases created before jobs carried a location or context
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column in ("location", "context"):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+        self._conn.commit()
+
+    def create(self, job, payload):
+        """
+        Store a new job and its payload, pruning expired finished jobs.
+        """
+        image_bytes, mime_type = payload
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JOB_PROCESSED, JOB_FAILED, time.time() - self.retention)
+            )
+            self._conn.execute(
+                "INSERT INTO jobs (id, original_image_id, status, stage, created_at, updated_at, payload, mime_type, location, context) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["original_image_id"], job["status"], job["stage"], job["created_at"],
+                 job["updated_at"], sqlite3.Binary(image_bytes), mime_type, json.dumps(job["location"]),
+                 json.dumps(job["context"]))
+            )
+            self._conn.commit()
+
+    def update(self, job_id, **fields):
+        """
+        Update fields of a job. Finished jobs drop their payload.
+        """
+        fields["updated_at"] = time.time()
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"])
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        if fields.get("status") in (JOB_PROCESSED, JOB_FAILED):
+            assignments += ", payload = NULL"
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def get(self, job_id):
+        """
+        Return a job as a dict, or None if unknown.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(self._COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["location"] = json.loads(job["location"]) if job["location"] else None
+        job["context"] = json.loads(job["context"]) if job["context"] else None
+        return job
+
+    def load_payload(self, job_id):
+        """
+        Return the (image_bytes, mime_type) payload of a job, or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT payload, mime_type FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return bytes(row[0]), row[1]
+
+    def unfinished(self):
+        """
+        Return the IDs of queued or processing jobs, oldest first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at",
+                (JOB_QUEUED, JOB_PROCESSING)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+# ============================================================================
+# QUEUE
+# ============================================================================
+
+class JobQueue:
+    """
+    Queue of image processing jobs served by a pool of background workers.
+
+    The handler is a coroutine function called as
+    `handler(job, image_bytes, mime_type, progress)`, where `progress` is a
+    coroutine function taking a stage name. Its return value is stored as the
+    job result; an exception marks the job as failed.
+
+    Attributes:
+        store: Job store (MemoryJobStore or SQLiteJobStore)
+        handler: Coroutine function that processes one job
+        workers: Number of background workers
+        max_queued: Maximum number of jobs waiting for a worker (0: no limit)
+    """
+
+    def __init__(self, store, handler, workers=2, max_queued=0):
+        """
+        Initialize the queue. Call start() from a running event loop.
+
+        Args:
+            store: Job store instance
+            handler: Coroutine function that processes one job
+            workers: Number of background workers
+            max_queued: Maximum number of jobs waiting for a worker (0: no limit)
+        """
+        self.store = store
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_queued = max(0, int(max_queued))
+        self._queue = None
+        self._tasks = []
+
+    @classmethod
+    def from_env(cls, handler, prefix="JOB", default_path="jobs.sqlite3", default_workers=2, default_max_queued=0):
+        """
+        Create a job queue configured from environment variables.
+
+        Args:
+            handler: Coroutine function that processes one job
+            prefix: Prefix of the variables ({prefix}_QUEUE_BACKEND,
+                {prefix}_QUEUE_PATH, {prefix}_WORKERS, {prefix}_RETENTION_SECONDS,
+                {prefix}_MAX_QUEUED)
+            default_path: SQLite database file if {prefix}_QUEUE_PATH is unset
+            default_workers: Worker count if {prefix}_WORKERS is unset
+            default_max_queued: Waiting job limit if {prefix}_MAX_QUEUED is unset
+
+        Returns:
+            JobQueue: Configured queue
+
+        Raises:
+            ValueError: If {prefix}_QUEUE_BACKEND is not a known backend
+        """
+        backend_name = os.getenv(f"{prefix}_QUEUE_BACKEND", "memory").lower()
+        retention = float(os.getenv(f"{prefix}_RETENTION_SECONDS", "3600"))
+        if backend_name == "memory":
+            store = MemoryJobStore(retention=retention)
+        elif backend_name == "sqlite":
+            store = SQLiteJobStore(path=os.getenv(f"{prefix}_QUEUE_PATH", default_path), retention=retention)
+        else:
+            raise ValueError(f"Unknown job queue backend: {backend_name}")
+        return cls(
+            store, handler,
+            workers=int(os.getenv(f"{prefix}_WORKERS", str(default_workers))),
+            max_queued=int(os.getenv(f"{prefix}_MAX_QUEUED", str(default_max_queued)))
+        )
+
+    async def _call(self, fn, *args, **kwargs):
+        """
+        Call a store method, off the event loop if the store is blocking.
+        """
+        if self.store.blocking:
+            return await get_executor().run_blocking(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def start(self):
+        """
+        Start the workers and re-queue jobs left unfinished by a previous run.
+        """
+        self._queue = asyncio.Queue()
+        for job_id in await self._call(self.store.unfinished):
+            self._queue.put_nowait(job_id)
+        if self._queue.qsize():
+            logger.info(f"Resuming {self._queue.qsize()} unfinished job(s).")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Job queue started: {type(self.store).__name__}, {self.workers} worker(s).")
+
+    async def stop(self):
+        """
+        Stop the workers. Interrupted jobs stay unfinished in durable stores.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """
+        Wait until every queued job has been processed.
+        """
+        await self._queue.join()
+
+    def full(self):
+        """
+        Return True if max_queued jobs are waiting for a worker.
+        """
+        return bool(self.max_queued) and self._queue is not None and self._queue.qsize() >= self.max_queued
+
+    async def submit(self, original_image_id, image_bytes, mime_type, location=None, context=None):
+        """
+        Store a new job and queue it for processing.
+
+        Args:
+            original_image_id: imageId of the Appwrite record to update
+            image_bytes: Raw uploaded image bytes
+            mime_type: MIME type of the uploaded image
+            location: Optional [latitude, longitude] sent with the upload
+            context: Optional JSON-serializable dict passed through to the handler
+
+        Returns:
+            dict: The created job
+
+        Raises:
+            JobQueueFull: If max_queued jobs are already waiting
+        """
+        if self.full():
+            raise JobQueueFull(f"{self._queue.qsize()} job(s) already waiting (maximum {self.max_queued}).")
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "original_image_id": original_image_id,
+            "status": JOB_QUEUED,
+            "stage": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+            "location": list(location) if location else None,
+            "context": context
+        }
+        await self._call(self.store.create, job, (image_bytes, mime_type))
+        self._queue.put_nowait(job["id"])
+        return job
+
+    async def get(self, job_id):
+        """
+        Return a job by ID, or None if unknown.
+        """
+        return await self._call(self.store.get, job_id)
+
+    async def _worker(self):
+        """
+        Background worker: take job IDs off the queue and process them.
+        """
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._process(job_id)
+            except Exception as e:
+                logger.error(f"❌ Job worker error for job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job_id):
+        """
+        Run the handler for one job and record its outcome.
+        """
+        job = await self._call(self.store.get, job_id)
+        payload = await self._call(self.store.load_payload, job_id)
+        if job is None or payload is None:
+            return
+
+        async def progress(stage):
+            await self._call(self.store.update, job_id, stage=stage)
+
+        await self._call(self.store.update, job_id, status=JOB_PROCESSING, stage="started")
+        image_bytes, mime_type = payload
+        try:
+            result = await self.handler(job, image_bytes, mime_type, progress)
+        except Exception as e:
+            logger.error(f"❌ Job {job_id} failed: {e}")
+            await self._call(self.store.update, job_id, status=JOB_FAILED, stage="failed", error=str(e))
+            return
+        await self._call(self.store.update, job_id, status=JOB_PROCESSED, stage="done", result=result)
+
+    def stats(self):
+        """
+        Return the number of queued jobs and workers.
+
+        Returns:
+            dict: Store name, queued job count, limit and worker count
+        """
+        return {
+            "backend": type(self.store).__name__,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queued": self.max_queued,
+            "workers": self.workers
+        }
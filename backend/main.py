@@ -7,31 +7,85 @@ Gemini AI for detailed analysis.
 
 Features:
     - Road damage detection using YOLOv8 model
-    - AI-powered damage analysis using Google Gemini
+    - Dynamic micro-batching of concurrent requests into single YOLO calls
+    - CPU-bound and blocking work runs on a dedicated executor, off the event loop
+    - Memory-only image pipeline: uploads are decoded and re-encoded in memory
+    - Single reduced-size decode per upload into a model-sized input, a
+      size-capped Gemini image and a capped JPEG/WebP annotated output
+    - Optional tiled inference for small defects in high-resolution photos
+    - Streaming, size-limited multipart parsing; decoding starts as soon as
+      the file part has arrived
+    - Content-addressed result cache so re-uploaded photos skip YOLO and Gemini
+    - GPS from EXIF or form fields; reports of a damage already analyzed
+      nearby are linked to it instead of running Gemini and the upload again
+    - Persistent pooled HTTP client for all Appwrite calls, opened at startup
+    - Optional asynchronous mode: submissions return 202 with a job ID and are
+      processed by background workers (status via GET /jobs/{job_id})
+    - Batch ingestion of many images per request (multipart or zip/tar), with
+      optional NDJSON streaming of per-image results
+    - Dashcam video ingestion: sampled frames are batched through YOLO and
+      tracked, so each physical damage is analyzed and stored once
+    - AI-powered damage analysis using Google Gemini, behind a rate limiter,
+      per-request deadlines, retries and a circuit breaker; when Gemini is
+      unavailable the YOLO-only result is returned, marked for later analysis
+    - Optional deferred enrichment: the record is written right after
+      detection with a heuristic severity and Status "Analyzing", and a
+      background worker patches in the Gemini summary and severity during
+      quiet periods
+    - Local, vectorized severity model: Gemini is only called when its
+      estimate is uncertain (calibratable against stored Gemini severities)
     - Automatic image annotation with bounding boxes
+    - Every image runs through one staged pipeline (decode, detect,
+      postprocess, dedupe, annotate, enrich, upload, persist; see
+      pipeline.py) with per-stage timings in GET /stats
     - Integration with Appwrite for storage and database management
+    - Models load and warm up in the background at startup; GET /ready
+      reports readiness and processing endpoints answer 503 until then
     - Structured JSON reports with damage types, severity, and summaries
+    - Prometheus metrics on GET /metrics (request, stage, batch, Gemini and
+      Appwrite latencies, queue depths, error counters), X-Request-ID on
+      every response and in every log line, optional JSON logs and
+      OpenTelemetry spans (see observability.py)
 
 Author: SafeStreet Team
 """
 
 # Standard library imports
+import asyncio
+import logging
 import os
-import shutil
+import time
 import uuid
 import mimetypes
+from contextlib import asynccontextmanager
 from datetime import datetime
+from urllib.parse import urlsplit
 
 # Third-party imports
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse
-from ultralytics import YOLO
-import google.generativeai as genai
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
+import numpy as np
+import cv2
 import json
 
 # Local imports
 import appwrite_utils
+from batching import BatchScheduler
+from executor import configure_executor, predict_batch
+from image_utils import encode_image, prepare_image, render_annotated, read_archive_images
+from cache import ResultCache, file_sha256
+from jobs import JobQueue, JobQueueFull
+from uploads import BufferReader, UploadTooLarge, read_multipart, remove_spooled
+from video import DamageTracker, FrameSampler
+from geo import DamageIndex, valid_location
+from severity import SEVERITY_LABELS, SeverityModel
+from postprocess import postprocess, to_numpy
+from pipeline import DAMAGE_TYPE_MAPPING, Detector, Pipeline, Stage, shared_model
+from gemini_client import GeminiClient, GeminiUnavailable, create_model
+from observability import (
+    METRICS_CONTENT_TYPE, RequestObserver, configure_logging, histogram, register_collector, render_metrics
+)
 
 # ============================================================================
 # CONFIGURATION
@@ -40,62 +94,320 @@ import appwrite_utils
 # Load environment variables from .env file
 load_dotenv()
 
-app = FastAPI()
+# Log to stdout in the LOG_FORMAT format (see observability.py)
+configure_logging()
+logger = logging.getLogger(__name__)
 
-# Ensure the 'tmp' directory exists for temporary file storage
-TMP_DIR = "tmp"
-os.makedirs(TMP_DIR, exist_ok=True)
+# Time spent receiving and parsing multipart uploads
+UPLOAD_PARSE_SECONDS = histogram("safestreet_upload_parse_seconds", "Multipart upload receive and parse time.")
 
 # ============================================================================
-# YOLO MODEL INITIALIZATION
+# YOLO MODEL CONFIGURATION
 # ============================================================================
-try:
-    model = YOLO("best.pt")
-    print("YOLO model loaded successfully.")
-except Exception as e:
-    print(f"Error loading YOLO model: {e}")
-    # Exit or handle gracefully if model cannot be loaded
-    exit(1)
-
-# Mapping from YOLO class codes to human-readable damage types
-damage_type_mapping = {
-    'D00': 'Pothole',
-    'D10': 'Longitudinal Crack',
-    'D20': 'Alligator Crack',
-    'D40': 'Transverse Crack',
-    'D50': 'Manhole'
+YOLO_MODEL_PATH = "best.pt"
+
+# YOLO class codes map to damage types through DAMAGE_TYPE_MAPPING (pipeline.py),
+# shared with the Predictor
+logger.info(f"Defined damage type mapping: {DAMAGE_TYPE_MAPPING}")
+
+# Micro-batching: concurrent requests are grouped into one YOLO call once either
+# the batch is full or the oldest queued image has waited long enough.
+YOLO_MAX_BATCH_SIZE = int(os.getenv("YOLO_MAX_BATCH_SIZE", "8"))
+YOLO_MAX_BATCH_WAIT_MS = float(os.getenv("YOLO_MAX_BATCH_WAIT_MS", "20"))
+
+# Batch ingestion (/process-images/): maximum images per request and how many
+# of them may be in the Gemini/storage/database stages at once
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Upload limits: per image, and per /process-images/ request body
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+MAX_BATCH_UPLOAD_BYTES = int(float(os.getenv("MAX_BATCH_UPLOAD_MB", "500")) * 1024 * 1024)
+
+# Startup: run warm-up inferences before reporting ready (see GET /ready)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+
+# Preprocessing: the upload is decoded once into a model-sized input, a
+# size-capped JPEG for Gemini and a capped base for the annotated output
+PREPROCESS_OPTIONS = {
+    "model_size": int(os.getenv("INFERENCE_IMGSZ", "640")),
+    "gemini_max_side": int(os.getenv("GEMINI_IMAGE_MAX_SIDE", "1024")),
+    "gemini_quality": int(os.getenv("GEMINI_IMAGE_QUALITY", "85")),
+    "annotated_max_side": int(os.getenv("ANNOTATED_MAX_SIDE", "1920"))
 }
-print(f"Defined damage type mapping: {damage_type_mapping}")
+# Tiled inference: overlapping tiles of a higher-resolution view are run
+# through YOLO together with the full frame and merged (see tiling.py)
+TILED_INFERENCE = os.getenv("TILED_INFERENCE", "false").lower() == "true"
+TILE_SIZE = int(os.getenv("TILE_SIZE", "640"))
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+TILE_MAX = int(os.getenv("TILE_MAX", "16"))
+TILE_MERGE = os.getenv("TILE_MERGE", "nms").lower()
+TILE_MERGE_IOU = float(os.getenv("TILE_MERGE_IOU", "0.5"))
+if TILED_INFERENCE:
+    PREPROCESS_OPTIONS["detail_max_side"] = int(os.getenv("TILE_SOURCE_MAX_SIDE", "2560"))
+
+# Video ingestion (/process-video/): frame sampling, tracking and how many
+# unique damages may be in the Gemini/storage/database stages at once
+MAX_VIDEO_UPLOAD_BYTES = int(float(os.getenv("MAX_VIDEO_UPLOAD_MB", "2048")) * 1024 * 1024)
+VIDEO_FRAME_STRIDE = int(os.getenv("VIDEO_FRAME_STRIDE", "5"))
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "0"))
+VIDEO_MOTION_THRESHOLD = float(os.getenv("VIDEO_MOTION_THRESHOLD", "0"))
+VIDEO_MIN_CONFIDENCE = float(os.getenv("VIDEO_MIN_CONFIDENCE", "0.25"))
+VIDEO_TRACK_IOU = float(os.getenv("VIDEO_TRACK_IOU", "0.2"))
+VIDEO_TRACK_MAX_AGE = int(os.getenv("VIDEO_TRACK_MAX_AGE", "5"))
+VIDEO_TRACK_MIN_HITS = int(os.getenv("VIDEO_TRACK_MIN_HITS", "2"))
+VIDEO_CONCURRENCY = int(os.getenv("VIDEO_CONCURRENCY", "4"))
+# Hosts /process-video/ may read a video_url from (empty: URL input disabled)
+VIDEO_URL_SCHEMES = ("http", "https", "rtsp")
+VIDEO_URL_HOSTS = {host.strip().lower() for host in os.getenv("VIDEO_URL_HOSTS", "").split(",") if host.strip()}
+
+ANNOTATED_EXTENSION = ".webp" if os.getenv("ANNOTATED_FORMAT", "jpeg").lower() == "webp" else ".jpg"
+ANNOTATED_QUALITY = int(os.getenv("ANNOTATED_QUALITY", "85"))
+
+# Time kept free after the Gemini call for the upload and database write when
+# a client announces its timeout (X-Request-Timeout header)
+REQUEST_DEADLINE_MARGIN_SECONDS = float(os.getenv("REQUEST_DEADLINE_MARGIN_SECONDS", "2"))
+
+# Gemini enrichment: "inline" waits for the report before answering; "deferred"
+# answers after detection and upload with a heuristic severity and leaves the
+# report to the enrichment workers (ENRICHMENT_* settings, see jobs.py). Results
+# marked pending because Gemini was unavailable are enriched in both modes.
+GEMINI_ENRICHMENT = os.getenv("GEMINI_ENRICHMENT", "inline").lower()
+# Enrichment waits until no upload has started for ENRICHMENT_IDLE_SECONDS,
+# but never longer than ENRICHMENT_MAX_DELAY_SECONDS after the upload
+ENRICHMENT_IDLE_SECONDS = float(os.getenv("ENRICHMENT_IDLE_SECONDS", "2"))
+ENRICHMENT_MAX_DELAY_SECONDS = float(os.getenv("ENRICHMENT_MAX_DELAY_SECONDS", "60"))
+ENRICHMENT_MAX_ATTEMPTS = int(os.getenv("ENRICHMENT_MAX_ATTEMPTS", "5"))
+
+# Duplicate suppression (see geo.py for the DUPLICATE_* settings): optional
+# record attribute that stores the imageId a duplicate report was linked to
+DUPLICATE_LINK_ATTRIBUTE = os.getenv("DUPLICATE_LINK_ATTRIBUTE", "")
+
+# Bump whenever the Gemini prompt (or the image sent with it) or the cached
+# entry format changes so cached reports are not reused
+GEMINI_PROMPT_VERSION = "3"
+
+# Created by load_components() during startup, not at import time
+model = None
+inference_executor = None
+batch_scheduler = None
+detector = None
+image_pipeline = None
+gemini_model = None
+gemini_client = None
+result_cache = None
+damage_index = None
+severity_model = None
+
+# time.time() of the most recent pipeline start, used to find quiet periods
+last_pipeline_started = 0.0
+
+# Startup progress reported by GET /ready
+startup_state = {"status": "starting", "error": None, "started_at": time.time(), "ready_at": None}
 
 # ============================================================================
-# GEMINI AI INITIALIZATION
+# STARTUP
 # ============================================================================
 
-try:
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
-    genai.configure(api_key=gemini_api_key)
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-    print("Gemini Flash model configured successfully.")
-except Exception as e:
-    print(f"Error configuring Gemini API: {e}")
-    exit(1)
+def load_components():
+    """
+    Load the YOLO model, start the inference executor and configure Gemini.
+
+    Blocking; runs in a thread during startup so the server can already answer
+    GET /ready while weights are being loaded.
+
+    Raises:
+        Exception: If the model or the Gemini API cannot be set up
+    """
+    global model, inference_executor, batch_scheduler, gemini_model, gemini_client, result_cache, damage_index
+    global severity_model, detector, image_pipeline
+
+    # Exports to ONNX/OpenVINO/TorchScript on first start when INFERENCE_BACKEND
+    # asks for it (see model_runtime.py); executor workers load the same artifact.
+    # The instance is shared with any Predictor created in this process.
+    model, inference_model_path, inference_backend = shared_model(YOLO_MODEL_PATH)
+    logger.info(f"YOLO model loaded successfully ({inference_backend} backend).")
+
+    # Inference executor: YOLO, OpenCV and blocking SDK calls run here instead of
+    # on the event loop (see executor.py for the INFERENCE_* settings).
+    inference_executor = configure_executor(inference_model_path, shared_model=model)
+
+    batch_scheduler = BatchScheduler(
+        _predict_images,
+        max_batch_size=YOLO_MAX_BATCH_SIZE,
+        max_wait_ms=YOLO_MAX_BATCH_WAIT_MS,
+        max_concurrent_batches=inference_executor.workers
+    )
+    logger.info(f"YOLO batching configured: max batch {YOLO_MAX_BATCH_SIZE}, max wait {YOLO_MAX_BATCH_WAIT_MS} ms")
+    detector = Detector(
+        batch_scheduler, TILE_SIZE if TILED_INFERENCE else 0, TILE_OVERLAP, TILE_MAX, TILE_MERGE, TILE_MERGE_IOU
+    )
+
+    # Every Gemini call goes through the rate limiter, deadline and circuit
+    # breaker (see gemini_client.py for the GEMINI_* settings).
+    gemini_model = create_model(os.getenv("GEMINI_API_KEY"), 'gemini-1.5-flash')
+    gemini_client = GeminiClient.from_env(gemini_model)
+    logger.info(f"Gemini Flash model configured successfully ({gemini_client.bucket.rate * 60:.0f} requests/min).")
+
+    # Local severity estimate; Gemini is only asked when it is uncertain (see
+    # severity.py for the SEVERITY_* settings and calibration)
+    severity_model = SeverityModel.from_env()
+    logger.info(f"Severity model: {'local, min confidence ' + str(severity_model.min_confidence) if severity_model.enabled else 'disabled (Gemini only)'}")
+
+    # Results are keyed by image bytes + weights hash + runtime backend + prompt
+    # version + severity settings, so local-only reports are not served once
+    # the severity configuration changes (see cache.py for RESULT_CACHE_*).
+    result_cache = ResultCache.from_env(
+        f"{file_sha256(YOLO_MODEL_PATH)}:{inference_backend}", GEMINI_PROMPT_VERSION, severity_model.fingerprint()
+    )
+    logger.info(f"Result cache: {type(result_cache.backend).__name__ if result_cache else 'disabled'}")
+
+    damage_index = DamageIndex.from_env()
+    if damage_index:
+        logger.info(f"Duplicate suppression: {damage_index.radius_m:.0f} m radius, geohash precision {damage_index.precision}")
+    else:
+        logger.info("Duplicate suppression: disabled")
+
+    image_pipeline = build_image_pipeline()
+
+
+async def _predict_images(images):
+    """Run one batch of decoded images through YOLO on the inference executor."""
+    return await inference_executor.run(predict_batch, images, verbose=False)
+
+
+async def warm_up():
+    """
+    Run synthetic inferences on every worker so the first real request does
+    not pay for kernel selection and allocator growth.
+
+    Each worker is warmed at batch size 1 and at the maximum batch size.
+    """
+    image = np.zeros((640, 640, 3), dtype=np.uint8)
+    started = time.perf_counter()
+    for size in sorted({1, YOLO_MAX_BATCH_SIZE}):
+        await asyncio.gather(*(
+            inference_executor.run(predict_batch, [image] * size, verbose=False)
+            for _ in range(inference_executor.workers)
+        ))
+    await inference_executor.run(encode_image, image)
+    logger.info(f"Warm-up finished in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+
+async def initialize():
+    """
+    Background startup: load components, warm up, then start the job workers.
+    """
+    try:
+        await asyncio.to_thread(load_components)
+        if STARTUP_WARMUP:
+            await warm_up()
+        await job_queue.start()
+        await enrichment_queue.start()
+    except Exception as e:
+        logger.error(f"❌ Startup failed: {e}")
+        startup_state.update(status="failed", error=str(e))
+        return
+    startup_state.update(status="ready", ready_at=time.time())
+    logger.info(f"✅ Ready after {startup_state['ready_at'] - startup_state['started_at']:.1f} s.")
+
+
+def require_ready():
+    """
+    Reject requests with 503 until startup has finished.
+
+    Raises:
+        HTTPException: 503 while starting or after a failed startup
+    """
+    if startup_state["status"] != "ready":
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service is {startup_state['status']}.",
+            headers={"Retry-After": "5"}
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open long-lived clients and start background initialization at startup;
+    release everything at shutdown.
+    """
+    appwrite_utils.init_http_client()
+    init_task = asyncio.create_task(initialize())
+    yield
+    init_task.cancel()
+    await asyncio.gather(init_task, return_exceptions=True)
+    await job_queue.stop()
+    await enrichment_queue.stop()
+    await appwrite_utils.close_http_client()
+    if inference_executor is not None:
+        inference_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RequestObserver)
 
 # ============================================================================
 # HELPER FUNCTIONS
 # ============================================================================
 
-async def generate_gemini_report(image_path: str, detections: list):
+def detection_report(detections: list, image_size=None, estimate=None, pending=True):
+    """
+    Build a report from the detections alone, with the local severity estimate.
+
+    Pending reports (deferred enrichment mode, Gemini unavailable, or an
+    uncertain estimate) are neither cached nor indexed, and the enrichment
+    workers replace their summary and severity. Final reports are used when
+    the local severity model is confident.
+
+    Args:
+        detections: Detections with type, confidence and xyxy box
+        image_size: Optional (width, height) the boxes refer to
+        estimate: Local estimate from severity_model.estimate(), if computed
+        pending: Mark the report for Gemini enrichment
+    """
+    estimate = estimate or severity_model.estimate(detections, image_size)
+    counts = {}
+    for det in detections:
+        counts[det["type"]] = counts.get(det["type"], 0) + 1
+    found = ", ".join(f"{count} {damage_type}" for damage_type, count in counts.items())
+    if pending:
+        summary = f"Detected: {found}. Detailed analysis pending." if counts else "No damage detected. Detailed analysis pending."
+    else:
+        summary = (
+            f"Detected: {found}. Estimated severity: {SEVERITY_LABELS[estimate['severity']]}."
+            if counts else "No damage detected."
+        )
+    report = {
+        "summary": summary,
+        "damage_types": list(counts) or ["None"],
+        "overall_severity": estimate["severity"],
+        "severity_source": "local",
+        "local_severity": estimate
+    }
+    if pending:
+        report["pending_enrichment"] = True
+    return report
+
+
+async def generate_gemini_report(image_bytes: bytes, mime_type: str, detections: list, deadline=None,
+                                 image_size=None):
     """
     Generates a detailed report using Gemini based on the image and YOLO detections,
     requesting a structured JSON output.
+
+    The call is rate limited and bounded by `deadline` (a time.monotonic()
+    value; default GEMINI_DEADLINE_SECONDS from now). If Gemini is
+    unavailable (circuit breaker open, no quota before the deadline, or
+    retries exhausted) the detection-only report is returned right away,
+    with a severity estimated from the boxes (image_size is their frame).
     """
     try:
-        # Prepare content for Gemini
+        # Prepare content for Gemini (the original upload bytes, no re-read)
         image_part = {
-            'mime_type': mimetypes.guess_type(image_path)[0] or 'image/jpeg',
-            'data': open(image_path, 'rb').read()
+            'mime_type': mime_type,
+            'data': image_bytes
         }
 
         # Construct prompt for Gemini
@@ -125,7 +437,7 @@ async def generate_gemini_report(image_path: str, detections: list):
             "Ensure the response is ONLY the JSON object, nothing else."
         )
 
-        response = await gemini_model.generate_content_async([prompt_text, image_part])
+        response = await gemini_client.generate([prompt_text, image_part], deadline)
         
         # Parse the JSON response (handle markdown code blocks if present)
         try:
@@ -136,10 +448,11 @@ async def generate_gemini_report(image_path: str, detections: list):
                 json_string = response_text
             
             parsed_report = json.loads(json_string)
+            parsed_report["severity_source"] = "gemini"
             return parsed_report
         except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from Gemini: {e}")
-            print(f"Gemini raw response: {response.text}")
+            logger.error(f"Error decoding JSON from Gemini: {e}")
+            logger.error(f"Gemini raw response: {response.text}")
             # Fallback to a default structure if JSON parsing fails
             return {
                 "summary": "Failed to generate structured summary.",
@@ -147,8 +460,11 @@ async def generate_gemini_report(image_path: str, detections: list):
                 "overall_severity": 0 # Use 0 or another indicator for failed severity
             }
 
+    except GeminiUnavailable as e:
+        logger.error(f"❌ Gemini unavailable ({e}); returning the YOLO-only result.")
+        return detection_report(detections, image_size)
     except Exception as e:
-        print(f"Error generating Gemini report: {e}")
+        logger.error(f"Error generating Gemini report: {e}")
         return {
             "summary": f"Failed to generate report: {e}",
             "damage_types": ["Error"],
@@ -156,123 +472,1122 @@ async def generate_gemini_report(image_path: str, detections: list):
         }
 
 # ============================================================================
-# API ENDPOINTS
+# IMAGE PIPELINE STAGES
 # ============================================================================
+# Each stage reads and extends the context dict built by run_pipeline() (see
+# pipeline.py). The detection group holds detect_slots; Gemini, upload and
+# database stages hold enrich_slots.
+
+# Context entries stored in the result cache for an analyzed image
+ANALYSIS_OUTPUTS = ("detections", "report", "processed_image_id")
+
 
-@app.post("/process-image/")
-async def process_image(
-    file: UploadFile = File(...),
-    original_image_id: str = Form(..., description="The imageId of the record in Appwrite to update or create.")
-):
+async def decode_stage(ctx):
     """
-    Process uploaded road image for damage detection and analysis.
-    
+    Decode and downscale the upload once (or await the decode started while
+    the upload was still arriving); EXIF GPS fills in a missing location.
+
+    Raises:
+        ValueError: If the image cannot be decoded
+    """
+    decoded = ctx.pop("decoded", None)
+    prepared = await (decoded or inference_executor.run(prepare_image, ctx["image_bytes"], **PREPROCESS_OPTIONS))
+    if prepared is None:
+        raise ValueError("Uploaded file could not be decoded as an image.")
+    ctx["prepared"] = prepared
+    ctx["location"] = ctx.get("location") or prepared.gps
+
+
+async def detect_stage(ctx):
+    """
+    Run YOLO on the model-sized view (batched with concurrent requests),
+    tiled when TILED_INFERENCE is enabled.
+    """
+    prepared = ctx["prepared"]
+    ctx["results"] = await detector.detect(prepared.model_image, prepared.detail_image)
+    prepared.detail_image = None
+
+
+async def postprocess_stage(ctx):
+    """
+    Extract detection details, with boxes in original image coordinates (one
+    transfer of the boxes tensor, then array operations).
+    """
+    prepared = ctx["prepared"]
+    found = postprocess(
+        ctx.pop("results").boxes.data, model.names, DAMAGE_TYPE_MAPPING, prepared.scale, prepared.original_size
+    )
+    ctx["found"] = found
+    ctx["detections"] = found.records()
+    logger.info(f"YOLO found {len(found)} detection(s): {found.counts()}")
+
+
+async def dedupe_stage(ctx):
+    """
+    Link to a damage already analyzed at this location, if any, reusing its
+    report and annotated image (jumps straight to the database write).
+    """
+    location, detections = ctx["location"], ctx["detections"]
+    if damage_index is None or not location or not detections:
+        return None
+    duplicate = damage_index.find_duplicate(*location, [det["type"] for det in detections])
+    if not duplicate:
+        return None
+    logger.info(f"✅ Linked to damage {duplicate['image_id']} {duplicate['distance_m']:.1f} m away; skipping Gemini and upload.")
+    ctx.update(
+        report=duplicate["report"], processed_image_id=duplicate["processed_image_id"],
+        duplicate_of=duplicate["image_id"]
+    )
+    return "persist"
+
+
+async def annotate_stage(ctx):
+    """
+    Render the annotated image with the detected bounding boxes into a buffer.
+    """
+    ctx["annotated_bytes"] = await inference_executor.run(
+        render_annotated, ctx["prepared"], ctx.pop("found"), ANNOTATED_EXTENSION, ANNOTATED_QUALITY
+    )
+
+
+async def enrich_stage(ctx):
+    """
+    Estimate the severity locally; only if the estimate is uncertain, generate
+    the Gemini report on the size-capped image with boxes given in its
+    coordinates (deferred mode: later, by the enrichment workers).
+
+    Pending reports leave ctx["enrichment"] with the Gemini image,
+    detections, Gemini scale and image size needed to analyze them later.
+    """
+    prepared = ctx.pop("prepared")
+    detections = ctx["detections"]
+    estimate = severity_model.estimate(detections, prepared.original_size)
+    if severity_model.is_confident(estimate):
+        if estimate.get("empty"):
+            logger.info("✅ No detections; skipping Gemini (SEVERITY_EMPTY_POLICY=local).")
+        else:
+            logger.info(f"✅ Local severity {estimate['severity']} (confidence {estimate['confidence']:.2f}); skipping Gemini.")
+        report = detection_report(detections, estimate=estimate, pending=False)
+    elif GEMINI_ENRICHMENT == "deferred":
+        report = detection_report(detections, estimate=estimate)
+    else:
+        if ctx.get("progress"):
+            await ctx["progress"]("analyzing")
+        gemini_detections = [
+            {**det, "box": [v * prepared.gemini_scale for v in det["box"]]} for det in detections
+        ]
+        report = await generate_gemini_report(
+            prepared.gemini_bytes, "image/jpeg", gemini_detections, ctx.get("deadline"),
+            [v * prepared.gemini_scale for v in prepared.original_size]
+        )
+        report.setdefault("local_severity", estimate)
+    if report.get("pending_enrichment"):
+        ctx["enrichment"] = {
+            "image": prepared.gemini_bytes,
+            "detections": detections,
+            "gemini_scale": prepared.gemini_scale,
+            "image_size": list(prepared.original_size)
+        }
+    ctx["report"] = report
+    logger.info(f"✅ Structured report generated: {json.dumps(report)}")
+
+
+async def upload_stage(ctx):
+    """
+    Upload the annotated image to Appwrite Storage.
+
+    Raises:
+        ValueError: If the bucket is not configured
+        HTTPException: If the upload fails
+    """
+    appwrite_bucket_id = os.getenv("APPWRITE_BUCKET_ID")
+    if not appwrite_bucket_id:
+        raise ValueError("APPWRITE_BUCKET_ID not found in environment variables. Image will not be uploaded to storage.")
+
+    uploaded_file_id = await appwrite_utils.upload_to_storage(
+        ctx.pop("annotated_bytes"),
+        f"annotated_{uuid.uuid4()}{ANNOTATED_EXTENSION}",
+        appwrite_bucket_id
+    )
+    if not uploaded_file_id:
+        raise HTTPException(status_code=500, detail="Failed to upload annotated image to Appwrite Storage.")
+    logger.info(f"✅ Annotated image uploaded to Appwrite Storage with ID: {uploaded_file_id}")
+    ctx["processed_image_id"] = uploaded_file_id
+
+
+def record_data(ctx):
+    """
+    Build the Appwrite Database fields of an analyzed image.
+    """
+    report = ctx["report"]
+    appwrite_data = {
+        "imageId": ctx["original_image_id"],
+        "timestamp": datetime.now().isoformat(),
+        "Type": ", ".join(report.get("damage_types", ["Unknown"])),
+        "Severity": str(report.get("overall_severity", 0)),
+        "Summary": report.get("summary", "No summary provided by Gemini."),
+        "Status": "Analyzing" if ctx.get("enrichment") else "Processed",
+        "processedImageId": ctx["processed_image_id"]
+    }
+    if ctx.get("duplicate_of") and DUPLICATE_LINK_ATTRIBUTE:
+        appwrite_data[DUPLICATE_LINK_ATTRIBUTE] = ctx["duplicate_of"]
+    return appwrite_data
+
+
+async def persist_stage(ctx):
+    """
+    Update or create the Appwrite Database record of the image.
+
+    Raises:
+        HTTPException: If the database update fails
+    """
+    appwrite_response = await appwrite_utils.update_damage_record(ctx["original_image_id"], record_data(ctx))
+    if not appwrite_response:
+        raise HTTPException(status_code=500, detail="Failed to update Appwrite database.")
+    ctx["appwrite_response"] = appwrite_response
+
+
+def is_final_analysis(ctx):
+    """
+    Failed (severity 0), pending and linked reports are neither cached nor indexed.
+    """
+    return bool(
+        ctx["report"].get("overall_severity", 0) and not ctx.get("enrichment") and not ctx.get("duplicate_of")
+    )
+
+
+async def analysis_cache_key(ctx):
+    """
+    Result cache key of the uploaded bytes (hashed on the executor).
+    """
+    return await inference_executor.run_blocking(result_cache.key_for, ctx["image_bytes"])
+
+
+async def index_stage(ctx):
+    """
+    Index a freshly analyzed damage for duplicate suppression.
+    """
+    if "analysis" not in ctx.get("cache_hits", ()) and is_final_analysis(ctx):
+        await remember_analysis(
+            ctx["original_image_id"], None, ctx["detections"], ctx["report"], ctx["processed_image_id"],
+            ctx.get("location")
+        )
+
+
+async def enqueue_stage(ctx):
+    """
+    Queue a pending report for the enrichment workers. If ENRICHMENT_MAX_QUEUED
+    is set and reached, the record keeps its detection-only report.
+    """
+    enrichment = ctx.get("enrichment")
+    if enrichment:
+        try:
+            await enrichment_queue.submit(
+                ctx["original_image_id"], enrichment.pop("image"), "image/jpeg", ctx.get("location"),
+                {
+                    **enrichment,
+                    "cache_key": ctx.get("cache_keys", {}).get("analysis"),
+                    "processed_image_id": ctx["processed_image_id"]
+                }
+            )
+        except JobQueueFull as e:
+            logger.warning(f"Enrichment queue full ({e}); {ctx['original_image_id']} keeps its detection-only report.")
+
+
+def build_image_pipeline(enrich=enrich_stage, persist=persist_stage, dedupe=True, store_results=True):
+    """
+    Assemble the stages run for every image; the analysis group (detection,
+    Gemini and upload) is cached as a whole by the result cache.
+
     Args:
-        file: Uploaded image file
-        original_image_id: ID of the record in Appwrite database
-    
+        enrich: Severity/Gemini stage function (bulk.py can replace it)
+        persist: Database write stage function (bulk.py batches the writes)
+        dedupe: Link images to damages already analyzed nearby and index new
+            ones for that; False analyzes every image and leaves the live
+            duplicate index untouched (bulk re-scoring)
+        store_results: Store finished analyses in the result cache; False
+            only reads it (for an enrich stage that does not follow the
+            configured severity settings, such as bulk.py's local-only mode)
+
     Returns:
-        JSONResponse with processing results including damage analysis and file IDs
-    
+        Pipeline: decode -> detect -> postprocess -> dedupe -> annotate ->
+        enrich -> upload -> persist -> index -> enqueue (without dedupe and
+        index if dedupe is False)
+    """
+    detection = Pipeline("detection", [
+        Stage("decode", decode_stage),
+        Stage("detect", detect_stage),
+        Stage("postprocess", postprocess_stage),
+        *([Stage("dedupe", dedupe_stage)] if dedupe else []),
+        Stage("annotate", annotate_stage)
+    ])
+    analysis = Pipeline("analysis", [
+        Stage("detection", detection, limit="detect_slots", progress="detecting"),
+        Stage("enrich", enrich, limit="enrich_slots"),
+        Stage("upload", upload_stage, limit="enrich_slots", progress="uploading")
+    ])
+    return Pipeline("image", [
+        Stage(
+            "analysis", analysis, cache=result_cache, cache_key=analysis_cache_key,
+            outputs=ANALYSIS_OUTPUTS, store_if=is_final_analysis if store_results else (lambda ctx: False)
+        ),
+        Stage("persist", persist, limit="enrich_slots", progress="saving"),
+        *([Stage("index", index_stage)] if dedupe else []),
+        Stage("enqueue", enqueue_stage)
+    ])
+
+
+async def remember_analysis(original_image_id: str, cache_key, detections: list, report: dict,
+                            processed_image_id: str, location=None):
+    """
+    Cache a finished analysis and index it for duplicate suppression.
+
+    Args:
+        original_image_id: imageId of the record holding the analysis
+        cache_key: Result cache key of the image bytes (None skips the cache)
+        detections: Detections in original image coordinates
+        report: Gemini structured report
+        processed_image_id: Appwrite file ID of the annotated image
+        location: Optional (latitude, longitude) of the image
+    """
+    if result_cache is not None and cache_key:
+        await result_cache.set(cache_key, dict(zip(ANALYSIS_OUTPUTS, (detections, report, processed_image_id))))
+    if damage_index is not None and location and detections:
+        damage_index.add(
+            original_image_id, *location, [det["type"] for det in detections], report, processed_image_id
+        )
+
+
+async def run_pipeline(image_bytes: bytes, mime_type: str, original_image_id: str, progress=None,
+                       detect_slots=None, enrich_slots=None, decoded=None, location=None, deadline=None):
+    """
+    Run the full processing pipeline for one image and update its record.
+
+    Identical image bytes reuse the cached analysis. If the image is located
+    (form fields, else EXIF GPS) and a damage of the same type was analyzed
+    within the duplicate radius recently, the report and annotated image of
+    that damage are reused instead. Reports pending enrichment (deferred
+    mode, or Gemini unavailable) are saved with Status "Analyzing" and
+    queued for the enrichment workers.
+
+    Args:
+        image_bytes: Raw uploaded image bytes
+        mime_type: MIME type of the uploaded image
+        original_image_id: imageId of the Appwrite record to update or create
+        progress: Optional coroutine function called with the name of each stage
+        detect_slots: Optional semaphore bounding concurrent decode/detection
+        enrich_slots: Optional semaphore bounding concurrent Gemini, storage
+            and database work
+        decoded: Optional task already decoding image_bytes (started while
+            the rest of the upload was still arriving)
+        location: Optional (latitude, longitude) sent with the upload
+        deadline: Optional time.monotonic() value the Gemini call must finish by
+
+    Returns:
+        dict: Response content with the report summary, Appwrite IDs and the
+        imageId of the damage the report was linked to (duplicate_of)
+
     Raises:
-        HTTPException: If processing fails or Appwrite operations fail
+        ValueError: If the image cannot be decoded or the bucket is not configured
+        HTTPException: If the storage upload or database update fails
     """
-    input_file_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}_{file.filename}")
-    annotated_file_path = os.path.join(TMP_DIR, f"annotated_{uuid.uuid4()}.jpg")
-    report_file_path = os.path.splitext(annotated_file_path)[0] + "_report.txt"
+    global last_pipeline_started
+    last_pipeline_started = time.time()
 
+    ctx = {
+        "image_bytes": image_bytes,
+        "mime_type": mime_type,
+        "original_image_id": original_image_id,
+        "progress": progress,
+        "detect_slots": detect_slots,
+        "enrich_slots": enrich_slots,
+        "decoded": decoded,
+        "location": location,
+        "deadline": deadline
+    }
     try:
-        # 1. Save the uploaded image locally
-        with open(input_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # 2. Perform YOLO detection
-        results = model(input_file_path)
-
-        detections = []
-        for r in results:
-            # Save annotated image with bounding boxes drawn by YOLO
-            r.save(filename=annotated_file_path)
-            # Extract detection details
-            for *xyxy, conf, cls in r.boxes.data:
-                class_name = model.names[int(cls)]
-                mapped_type = damage_type_mapping.get(class_name, class_name)
-                detections.append({
-                    "type": mapped_type,
-                    "confidence": float(conf),
-                    "box": [float(v) for v in xyxy]
-                })
-                print(f"Analyzing detection {len(detections)}: {mapped_type} with confidence {float(conf):.2f}...")
-
-        # 3. Generate AI-powered analysis report using Gemini
-        gemini_structured_report = await generate_gemini_report(input_file_path, detections)
-        
-        # Extract data from the structured report
-        report_summary = gemini_structured_report.get("summary", "No summary provided by Gemini.")
-        damage_types_str = ", ".join(gemini_structured_report.get("damage_types", ["Unknown"]))
-        overall_severity = str(gemini_structured_report.get("overall_severity", 0))
+        await image_pipeline.run(ctx)
+    finally:
+        # Still set when the decode stage did not run (cache hit or error)
+        if ctx.get("decoded"):
+            ctx["decoded"].cancel()
 
-        # Save the structured report as JSON for debugging and records
-        with open(report_file_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(gemini_structured_report, indent=2))
-        print(f"✅ Structured report saved to {report_file_path}")
+    return pipeline_result(ctx)
 
 
-        # 4. Upload annotated image to Appwrite Storage
-        appwrite_bucket_id = os.getenv("APPWRITE_BUCKET_ID")
-        if not appwrite_bucket_id:
-            raise ValueError("APPWRITE_BUCKET_ID not found in environment variables. Image will not be uploaded to storage.")
+def pipeline_result(ctx):
+    """
+    Build the response content of an image that went through the pipeline.
+    """
+    cached = "analysis" in ctx.get("cache_hits", ())
+    if cached:
+        logger.info(f"✅ Result cache hit for imageId {ctx['original_image_id']}; skipping detection and Gemini.")
+    return {
+        "status": "success",
+        "message": "Image processed, report generated, and database updated.",
+        "original_image_id": ctx["original_image_id"],
+        "processed_image_appwrite_id": ctx["processed_image_id"],
+        "report_summary": ctx["report"].get("summary", "No summary provided by Gemini."),
+        "appwrite_document_id": ctx["appwrite_response"]['$id'],
+        "cached": cached,
+        "duplicate_of": ctx.get("duplicate_of"),
+        "pending_enrichment": bool(ctx.get("enrichment"))
+    }
+
+
+async def set_record_status(original_image_id: str, status: str):
+    """
+    Set the Status of an existing record. Status-only updates never create a
+    record: the pipeline's database write creates it with the full report.
+    """
+    response = await appwrite_utils.update_damage_record(original_image_id, {"Status": status}, create=False)
+    if response is None:
+        logger.info(f"Status {status} not recorded for imageId {original_image_id} (no record yet).")
+    return response
 
-        uploaded_file_id = await appwrite_utils.upload_to_storage(
-            annotated_file_path,
-            appwrite_bucket_id
-        )
 
-        if not uploaded_file_id:
-            raise HTTPException(status_code=500, detail="Failed to upload annotated image to Appwrite Storage.")
-        print(f"✅ Annotated image uploaded to Appwrite Storage with ID: {uploaded_file_id}")
-
-        # 5. Prepare data for Appwrite Database
-        appwrite_data = {
-            "imageId": original_image_id,
-            "timestamp": datetime.now().isoformat(),
-            "Type": damage_types_str,
-            "Severity": overall_severity,
-            "Summary": report_summary,
-            "Status": "Processed",
-            "processedImageId": uploaded_file_id
+async def run_job(job: dict, image_bytes: bytes, mime_type: str, progress):
+    """
+    Job queue handler: run the pipeline for a queued image.
+
+    The Appwrite record moves from Queued to Processing here, and to
+    Processed (or Failed) when the pipeline finishes.
+    """
+    original_image_id = job["original_image_id"]
+    await set_record_status(original_image_id, "Processing")
+    try:
+        return await run_pipeline(image_bytes, mime_type, original_image_id, progress, location=job.get("location"))
+    except Exception:
+        await set_record_status(original_image_id, "Failed")
+        raise
+
+
+async def wait_for_quiet(job: dict):
+    """
+    Wait until no pipeline has started for ENRICHMENT_IDLE_SECONDS, or until
+    the job is ENRICHMENT_MAX_DELAY_SECONDS old, whichever comes first.
+    """
+    give_up_at = job["created_at"] + ENRICHMENT_MAX_DELAY_SECONDS
+    while True:
+        now = time.time()
+        quiet_at = last_pipeline_started + ENRICHMENT_IDLE_SECONDS
+        if now >= quiet_at or now >= give_up_at:
+            return
+        await asyncio.sleep(min(quiet_at, give_up_at) - now)
+
+
+async def run_enrichment(job: dict, image_bytes: bytes, mime_type: str, progress):
+    """
+    Enrichment queue handler: generate the Gemini report for a saved record.
+
+    Waits for a quiet period, then calls Gemini on the stored Gemini-sized
+    image and patches Summary and Severity of the record in place (Status
+    Analyzing -> Processed). While Gemini is unavailable the call is retried
+    after the circuit breaker's reset time; after ENRICHMENT_MAX_ATTEMPTS the
+    record keeps its detection-only values with Status "Detected".
+    """
+    original_image_id = job["original_image_id"]
+    context = job["context"]
+    scale = context["gemini_scale"]
+    gemini_detections = [{**det, "box": [v * scale for v in det["box"]]} for det in context["detections"]]
+    gemini_size = [v * scale for v in context["image_size"]]
+
+    await progress("waiting")
+    await wait_for_quiet(job)
+    for attempt in range(1, ENRICHMENT_MAX_ATTEMPTS + 1):
+        await progress("analyzing")
+        report = await generate_gemini_report(image_bytes, mime_type, gemini_detections, image_size=gemini_size)
+        if report.get("overall_severity", 0) and not report.get("pending_enrichment"):
+            break
+        logger.error(f"❌ Enrichment of {original_image_id} failed (attempt {attempt}/{ENRICHMENT_MAX_ATTEMPTS}).")
+        if attempt < ENRICHMENT_MAX_ATTEMPTS:
+            await asyncio.sleep(gemini_client.breaker.reset_seconds)
+    else:
+        await set_record_status(original_image_id, "Detected")
+        raise RuntimeError(f"Gemini analysis failed after {ENRICHMENT_MAX_ATTEMPTS} attempts.")
+    report.setdefault("local_severity", severity_model.estimate(context["detections"], context["image_size"]))
+
+    await progress("saving")
+    appwrite_response = await appwrite_utils.update_damage_record(original_image_id, {
+        "imageId": original_image_id,
+        "Summary": report.get("summary", "No summary provided by Gemini."),
+        "Severity": str(report.get("overall_severity", 0)),
+        "Status": "Processed"
+    })
+    if not appwrite_response:
+        raise RuntimeError("Failed to update Appwrite database.")
+    logger.info(f"✅ Enriched record {original_image_id}: severity {report.get('overall_severity')}")
+
+    await remember_analysis(
+        original_image_id, context.get("cache_key"), context["detections"], report,
+        context["processed_image_id"], job.get("location")
+    )
+    return {"original_image_id": original_image_id, "report_summary": report.get("summary"),
+            "severity": report.get("overall_severity")}
+
+
+def open_video(source):
+    """
+    Open a video file or stream URL with the configured frame sampling.
+
+    Raises:
+        ValueError: If the source cannot be opened
+    """
+    return FrameSampler(
+        source, VIDEO_FRAME_STRIDE, VIDEO_SAMPLE_FPS, VIDEO_MOTION_THRESHOLD, PREPROCESS_OPTIONS["model_size"]
+    )
+
+
+async def run_video(sampler, video_id: str):
+    """
+    Report every unique damage in a video through the image pipeline.
+
+    Sampled frames are read in batches of the YOLO batch size (the next batch
+    is decoded while the current one is detected) and their detections are
+    fed to a DamageTracker. When a track closes, its best frame is run
+    through run_pipeline() as imageId "{video_id}_{track id}", so each
+    physical damage produces one Gemini report, annotated image and record.
+
+    Args:
+        sampler: FrameSampler from open_video() (closed when done)
+        video_id: Prefix for the imageId of each reported damage
+
+    Yields:
+        dict: One result per reported damage, in completion order, followed
+        by a summary line with "status": "complete"
+    """
+    tracker = DamageTracker(VIDEO_TRACK_IOU, VIDEO_TRACK_MAX_AGE, VIDEO_TRACK_MIN_HITS)
+    enrich_slots = asyncio.Semaphore(VIDEO_CONCURRENCY)
+    batch_size = batch_scheduler.max_batch_size
+    pending = set()
+
+    async def report_track(track):
+        image_id = f"{video_id}_{track['id']:04d}"
+        frame, track["best_frame"] = track["best_frame"], None
+        info = {
+            "track_id": track["id"],
+            "type": DAMAGE_TYPE_MAPPING.get(model.names[int(track["cls"])], model.names[int(track["cls"])]),
+            "confidence": track["best_conf"],
+            "frames": track["hits"],
+            "frame_index": track["best_frame_index"],
+            "timestamp_ms": round(track["best_timestamp_ms"]),
+            "box": track["best_box"]
         }
+        try:
+            frame_bytes = await inference_executor.run(encode_image, frame, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, 95])
+            del frame
+            result = await run_pipeline(frame_bytes, "image/jpeg", image_id, enrich_slots=enrich_slots)
+        except Exception as e:
+            logger.error(f"❌ Video {video_id} track {track['id']} failed: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            result = {"status": "error", "original_image_id": image_id, "detail": detail}
+        return {**info, **result}
 
-        # 6. Update or create Appwrite Database record
-        appwrite_response = await appwrite_utils.update_damage_record(
-            original_image_id,
-            appwrite_data
+    def track_frames(frames, results):
+        for (index, timestamp_ms, frame, model_frame), r in zip(frames, results):
+            boxes = to_numpy(r.boxes.data)
+            boxes = boxes[boxes[:, 4] >= VIDEO_MIN_CONFIDENCE]
+            boxes[:, :4] *= max(frame.shape[:2]) / max(model_frame.shape[:2])
+            for track in tracker.update(index, timestamp_ms, frame, boxes):
+                pending.add(asyncio.ensure_future(report_track(track)))
+
+    logger.info(f"Processing video {video_id} (stride {sampler.stride} at {sampler.fps:.1f} fps)...")
+    started = time.perf_counter()
+    next_frames = asyncio.ensure_future(inference_executor.run_blocking(sampler.read_batch, batch_size))
+    try:
+        while True:
+            frames = await next_frames
+            if not frames:
+                break
+            next_frames = asyncio.ensure_future(inference_executor.run_blocking(sampler.read_batch, batch_size))
+            results = await asyncio.gather(*(batch_scheduler.submit(model_frame) for *_, model_frame in frames))
+            track_frames(frames, results)
+            del frames, results
+            for task in [task for task in pending if task.done()]:
+                pending.discard(task)
+                yield task.result()
+
+        for track in tracker.flush():
+            pending.add(asyncio.ensure_future(report_track(track)))
+        for finished in asyncio.as_completed(pending):
+            yield await finished
+        pending.clear()
+
+        logger.info(f"✅ Video {video_id}: {sampler.frames_read} frame(s) sampled in {time.perf_counter() - started:.1f} s.")
+        yield {
+            "status": "complete",
+            "video_id": video_id,
+            "frames_sampled": sampler.frames_read,
+            "frames_skipped_static": sampler.frames_skipped_static,
+            "damages_reported": tracker.tracks_reported,
+            "tracks_dropped": tracker.tracks_dropped
+        }
+    finally:
+        # Client went away or the video failed: stop outstanding work
+        next_frames.cancel()
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(next_frames, return_exceptions=True)
+        sampler.close()
+
+
+# ============================================================================
+# JOB QUEUE INITIALIZATION
+# ============================================================================
+
+# "sync" keeps the request open until processing finishes; "async" answers
+# 202 with a job ID (see jobs.py for the JOB_* settings).
+PROCESS_IMAGE_MODE = os.getenv("PROCESS_IMAGE_MODE", "sync").lower()
+job_queue = JobQueue.from_env(run_job, default_max_queued=100)
+logger.info(f"Image processing mode: {PROCESS_IMAGE_MODE}")
+
+# Background Gemini analysis of records saved with a detection-only report
+enrichment_queue = JobQueue.from_env(
+    run_enrichment, prefix="ENRICHMENT", default_path="enrichment.sqlite3", default_workers=1
+)
+logger.info(f"Gemini enrichment mode: {GEMINI_ENRICHMENT}")
+
+# ============================================================================
+# API ENDPOINTS
+# ============================================================================
+
+@app.get("/ready")
+async def get_ready():
+    """
+    Readiness probe: 200 once the model is loaded and warmed up, 503 before.
+
+    Returns:
+        JSONResponse: Startup status ("starting", "ready" or "failed"), the
+        startup error if any, and the time startup took once ready
+    """
+    content = {"status": startup_state["status"], "error": startup_state["error"]}
+    if startup_state["ready_at"]:
+        content["startup_seconds"] = round(startup_state["ready_at"] - startup_state["started_at"], 2)
+    return JSONResponse(status_code=200 if startup_state["status"] == "ready" else 503, content=content)
+
+
+@app.get("/stats")
+async def get_stats():
+    """
+    Report inference executor, batching, result cache and job queue statistics.
+
+    Returns:
+        dict: Executor queue depth, in-flight tasks and wait times, the number
+        of images waiting for a YOLO batch, result cache hits/misses, and the
+        number of queued jobs, the size of the duplicate-damage index and
+        Gemini call counters with the circuit breaker state, the number of
+        records waiting for Gemini enrichment, and per-stage pipeline timings
+    """
+    require_ready()
+    return {
+        "inference_executor": inference_executor.stats(),
+        "batching": batch_scheduler.stats(),
+        "result_cache": result_cache.stats() if result_cache else None,
+        "damage_index": damage_index.stats() if damage_index else None,
+        "gemini": gemini_client.stats(),
+        "jobs": job_queue.stats(),
+        "enrichment": enrichment_queue.stats(),
+        "pipeline": image_pipeline.stats()
+    }
+
+
+def collect_metrics():
+    """
+    Export the queue depths and counters behind GET /stats as metrics.
+
+    Yields:
+        tuple: (name, help, value[, labels]) samples for render_metrics()
+    """
+    if startup_state["status"] != "ready":
+        return
+    executor_stats = inference_executor.stats()
+    yield "safestreet_executor_queue_depth", "Inference tasks waiting for a worker.", executor_stats["queue_depth"]
+    yield "safestreet_executor_in_flight", "Inference tasks running.", executor_stats["in_flight"]
+    batching = batch_scheduler.stats()
+    yield "safestreet_batch_pending_images", "Images waiting for a YOLO batch.", batching["pending_images"]
+    yield "safestreet_batch_running", "YOLO batches running.", batching["running_batches"]
+    yield "safestreet_jobs_queued", "Jobs waiting in a queue.", job_queue.stats()["queued"], {"queue": "jobs"}
+    yield "safestreet_jobs_queued", "Jobs waiting in a queue.", enrichment_queue.stats()["queued"], {"queue": "enrichment"}
+    gemini = gemini_client.stats()
+    for result in ("calls", "succeeded", "failed", "retried", "unavailable"):
+        yield "safestreet_gemini_calls", "Gemini call counters since startup.", gemini[result], {"result": result}
+    for state in ("closed", "open", "half_open"):
+        yield (
+            "safestreet_gemini_breaker_state", "Gemini circuit breaker state.", int(gemini["breaker"] == state),
+            {"state": state}
         )
+    if result_cache:
+        cache = result_cache.stats()
+        yield "safestreet_result_cache_lookups", "Result cache lookups since startup.", cache["hits"], {"result": "hit"}
+        yield "safestreet_result_cache_lookups", "Result cache lookups since startup.", cache["misses"], {"result": "miss"}
+
+
+register_collector(collect_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Serve Prometheus metrics in the text exposition format.
+
+    Available before the service is ready (queue gauges appear once it is).
+    """
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _form_body(properties, required):
+    """OpenAPI request body for the hand-parsed multipart endpoints."""
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {
+        "schema": {"type": "object", "properties": properties, "required": required}
+    }}}}
+
+
+def _form_bool(values, default):
+    """Parse an optional boolean form field ("true"/"false", "1"/"0", ...)."""
+    if not values:
+        return default
+    return values[0].strip().lower() in ("1", "true", "yes", "on")
+
+
+def _form_locations(fields, count, latitude_field="latitude", longitude_field="longitude"):
+    """
+    Parse optional latitude/longitude form fields into one location per image.
+
+    Raises:
+        HTTPException: 400 if only one of the fields is given, the counts do
+            not match or a value is not a valid coordinate
+    """
+    latitudes, longitudes = fields.get(latitude_field), fields.get(longitude_field)
+    if not latitudes and not longitudes:
+        return [None] * count
+    if not latitudes or not longitudes or len(latitudes) != count or len(longitudes) != count:
+        raise HTTPException(status_code=400, detail=f"Provide one {latitude_field} and one {longitude_field} per image.")
+    try:
+        locations = [(float(lat), float(lon)) for lat, lon in zip(latitudes, longitudes)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Latitude and longitude must be numbers.")
+    if not all(valid_location(*location) for location in locations):
+        raise HTTPException(status_code=400, detail="Latitude must be within ±90 and longitude within ±180.")
+    return locations
+
+
+def _video_url(url):
+    """
+    Validate a client-supplied video URL before FFmpeg opens it.
+
+    Only http, https and rtsp URLs on a VIDEO_URL_HOSTS host are accepted, so
+    API callers cannot make the server read local files or reach internal
+    hosts through other FFmpeg protocols.
+
+    Raises:
+        HTTPException: 400 if the URL is not allowed
+    """
+    if not VIDEO_URL_HOSTS:
+        raise HTTPException(status_code=400, detail="video_url is disabled on this server; upload the video file instead.")
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in VIDEO_URL_SCHEMES or (parts.hostname or "") not in VIDEO_URL_HOSTS:
+        raise HTTPException(status_code=400, detail=f"video_url must be an {'/'.join(VIDEO_URL_SCHEMES)} URL on an allowed host.")
+    return url
+
+
+def _request_deadline(request: Request, started: float):
+    """
+    Gemini deadline (time.monotonic()) derived from the client's own timeout.
+
+    Clients may send `X-Request-Timeout: <seconds>`; Gemini must then finish
+    early enough to leave REQUEST_DEADLINE_MARGIN_SECONDS for the storage
+    upload and database write. Without the header the client default
+    (GEMINI_DEADLINE_SECONDS) applies.
+    """
+    try:
+        timeout = float(request.headers.get("x-request-timeout", ""))
+    except ValueError:
+        return None
+    return started + max(0.0, timeout - REQUEST_DEADLINE_MARGIN_SECONDS)
+
+
+def _upload_mime_type(part):
+    """MIME type of an uploaded image, falling back to the file name."""
+    mime_type = part.content_type or mimetypes.guess_type(part.filename or "")[0] or "image/jpeg"
+    return mime_type if mime_type.startswith("image/") else "image/jpeg"
+
+
+async def _read_form(request: Request, max_file_bytes: int, max_total_bytes: int, on_file=None, spool_files=False):
+    """
+    Stream and parse a multipart request, mapping upload errors to HTTP errors.
 
-        if appwrite_response:
+    Raises:
+        HTTPException: 413 if an upload is too large, 400 if the body is malformed
+    """
+    try:
+        with UPLOAD_PARSE_SECONDS.time():
+            return await read_multipart(
+                request, max_file_bytes, max_total_bytes, on_file=on_file, spool_files=spool_files
+            )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid upload: {e}")
+
+
+@app.post("/process-image/", openapi_extra=_form_body({
+    "file": {"type": "string", "format": "binary"},
+    "original_image_id": {"type": "string", "description": "The imageId of the record in Appwrite to update or create."},
+    "async_mode": {"type": "boolean", "description": "Return 202 with a job ID instead of waiting for the result. Defaults to PROCESS_IMAGE_MODE."},
+    "latitude": {"type": "number", "description": "Where the photo was taken. Defaults to the EXIF GPS position."},
+    "longitude": {"type": "number", "description": "Where the photo was taken. Defaults to the EXIF GPS position."}
+}, ["file", "original_image_id"]))
+async def process_image(request: Request):
+    """
+    Process uploaded road image for damage detection and analysis.
+    
+    The multipart body is parsed while it streams in and is limited to
+    MAX_UPLOAD_MB. In synchronous mode decoding starts as soon as the file
+    part is complete, and the request stays open until the image has been
+    processed. In asynchronous mode the image is queued as a job and the
+    response (202) only carries the job ID; progress is available from
+    GET /jobs/{job_id} and the Appwrite record's Status field.
+    
+    A report located near a recently analyzed damage of the same type is
+    linked to it (duplicate_of) and reuses its report and annotated image.
+    If Gemini is unavailable or cannot answer before the deadline (see the
+    X-Request-Timeout header), the YOLO-only result is returned with
+    pending_enrichment set and the record's Status is "Analyzing" until the
+    enrichment workers have added the Gemini report (also the normal path
+    when GEMINI_ENRICHMENT is "deferred").
+    
+    Form fields:
+        file: Uploaded image file
+        original_image_id: ID of the record in Appwrite database
+        async_mode: Override PROCESS_IMAGE_MODE for this request
+        latitude, longitude: Location of the photo (default: EXIF GPS)
+    
+    Returns:
+        JSONResponse with processing results including damage analysis and file IDs,
+        or (asynchronous mode) the queued job ID
+    
+    Raises:
+        HTTPException: 413 if the upload exceeds MAX_UPLOAD_MB
+        HTTPException: 422 if the file or original_image_id is missing
+        HTTPException: If processing fails or Appwrite operations fail
+        HTTPException: 503 until startup has finished, or (asynchronous
+            mode) while JOB_MAX_QUEUED jobs are waiting
+    """
+    require_ready()
+    deadline = _request_deadline(request, time.monotonic())
+
+    # 1. Stream the upload into memory; start decoding the image right away
+    # unless it is likely to be queued as a job
+    decode_tasks = []
+
+    def start_decode(part):
+        if part.field_name == "file" and not decode_tasks and PROCESS_IMAGE_MODE != "async":
+            decode_tasks.append(asyncio.ensure_future(
+                inference_executor.run(prepare_image, part.data, **PREPROCESS_OPTIONS)
+            ))
+
+    decoded = None
+    try:
+        fields, files = await _read_form(request, MAX_UPLOAD_BYTES, MAX_UPLOAD_BYTES + 1024 * 1024, start_decode)
+        decoded = decode_tasks[0] if decode_tasks else None
+        upload = next((part for part in files if part.field_name == "file"), None)
+        original_image_id = (fields.get("original_image_id") or [""])[0]
+        if upload is None or not original_image_id:
+            raise HTTPException(status_code=422, detail="Both file and original_image_id are required.")
+        image_bytes = upload.data
+        mime_type = _upload_mime_type(upload)
+        location = _form_locations(fields, 1)[0]
+
+        use_async = _form_bool(fields.get("async_mode"), PROCESS_IMAGE_MODE == "async")
+        if use_async:
+            if job_queue.full():
+                raise HTTPException(status_code=503, detail="Job queue is full.", headers={"Retry-After": "5"})
+            # Mark the record as queued before a worker can move it to Processing
+            await set_record_status(original_image_id, "Queued")
+            try:
+                job = await job_queue.submit(original_image_id, image_bytes, mime_type, location)
+            except JobQueueFull as e:
+                raise HTTPException(status_code=503, detail=f"Job queue is full: {e}", headers={"Retry-After": "5"})
             return JSONResponse(
-                status_code=200,
+                status_code=202,
                 content={
-                    "status": "success",
-                    "message": "Image processed, report generated, and database updated.",
+                    "status": "queued",
+                    "message": "Image queued for processing.",
                     "original_image_id": original_image_id,
-                    "processed_image_appwrite_id": uploaded_file_id,
-                    "report_summary": report_summary,
-                    "appwrite_document_id": appwrite_response['$id']
+                    "job_id": job["id"],
+                    "status_url": f"/jobs/{job['id']}"
                 }
             )
-        else:
-            raise HTTPException(status_code=500, detail="Failed to update Appwrite database.")
 
+        return JSONResponse(
+            status_code=200,
+            content=await run_pipeline(
+                image_bytes, mime_type, original_image_id, decoded=decoded, location=location, deadline=deadline
+            )
+        )
+
+    except HTTPException as e:
+        if e.status_code < 500 or e.status_code == 503:
+            raise
+        logger.error(f"Unhandled exception during processing: {e.detail}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e.detail}")
     except Exception as e:
-        print(f"Unhandled exception during processing: {e}")
+        logger.error(f"Unhandled exception during processing: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
-
     finally:
-        # Clean up temporary files
-        if os.path.exists(input_file_path):
-            os.remove(input_file_path)
-        if os.path.exists(annotated_file_path):
-            os.remove(annotated_file_path)
-        if os.path.exists(report_file_path):
-            os.remove(report_file_path)
+        for task in decode_tasks:
+            task.cancel()
+
+
+@app.post("/process-images/", openapi_extra=_form_body({
+    "files": {"type": "array", "items": {"type": "string", "format": "binary"}, "description": "Image files to process."},
+    "archive": {"type": "string", "format": "binary", "description": "Zip or tar archive of images, as an alternative to files."},
+    "original_image_ids": {"type": "array", "items": {"type": "string"}, "description": "imageId for each file or archive entry, in order. Archive entries default to their file name without extension."},
+    "stream": {"type": "boolean", "description": "Stream one NDJSON line per image as it finishes."},
+    "latitudes": {"type": "array", "items": {"type": "number"}, "description": "Latitude of each image, in order. Defaults to the EXIF GPS position."},
+    "longitudes": {"type": "array", "items": {"type": "number"}, "description": "Longitude of each image, in order. Defaults to the EXIF GPS position."}
+}, []))
+async def process_images(request: Request):
+    """
+    Process many road images in one request.
+    
+    All images are submitted to the detector together, so they are run in
+    full YOLO batches; the Gemini, storage and database stages then run with
+    bounded concurrency (BATCH_CONCURRENCY). Each image succeeds or fails on
+    its own. The body is limited to MAX_BATCH_UPLOAD_MB and each image file
+    to MAX_UPLOAD_MB.
+    
+    Form fields:
+        files: Uploaded image files (multipart)
+        archive: Zip or tar archive of images, instead of individual files
+        original_image_ids: imageId of each image, in upload/archive order
+        stream: Stream results as NDJSON in completion order instead of
+            returning one JSON array in input order
+        latitudes, longitudes: Location of each image (default: EXIF GPS)
+    
+    Returns:
+        JSONResponse with a per-image result array, or a StreamingResponse of
+        NDJSON lines. Every result carries its `index` in the input.
+    
+    Raises:
+        HTTPException: 400 if the input is missing, too large or the ids do not match
+        HTTPException: 413 if the body or an image exceeds its size limit
+        HTTPException: 503 until startup has finished
+    """
+    require_ready()
+    deadline = _request_deadline(request, time.monotonic())
+
+    # 1. Collect (original_image_id, bytes, mime type) for every image
+    fields, parts = await _read_form(request, MAX_BATCH_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES)
+    files = [part for part in parts if part.field_name == "files"]
+    archive = next((part for part in parts if part.field_name == "archive"), None)
+    original_image_ids = fields.get("original_image_ids")
+    stream = _form_bool(fields.get("stream"), False)
+    del parts
+
+    items = []
+    if archive is not None:
+        try:
+            entries = await inference_executor.run_blocking(
+                read_archive_images, BufferReader(archive.data), archive.filename or "",
+                BATCH_MAX_FILES, MAX_UPLOAD_BYTES, MAX_BATCH_UPLOAD_BYTES
+            )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        del archive
+        ids = original_image_ids or [os.path.splitext(os.path.basename(name))[0] for name, _, _ in entries]
+        if len(ids) != len(entries):
+            raise HTTPException(status_code=400, detail=f"Archive has {len(entries)} image(s) but {len(ids)} original_image_ids were given.")
+        items = [(image_id, data, mime_type) for image_id, (_, data, mime_type) in zip(ids, entries)]
+    elif files:
+        if not original_image_ids or len(original_image_ids) != len(files):
+            raise HTTPException(status_code=400, detail="Provide exactly one original_image_id per file.")
+        items = [(image_id, upload.data, _upload_mime_type(upload)) for image_id, upload in zip(original_image_ids, files)]
+        del files
+    else:
+        raise HTTPException(status_code=400, detail="Provide image files or an archive.")
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in the request.")
+    if len(items) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many images: {len(items)} (maximum {BATCH_MAX_FILES}).")
+    oversized = next((image_id for image_id, data, _ in items if len(data) > MAX_UPLOAD_BYTES), None)
+    if oversized is not None:
+        raise HTTPException(status_code=413, detail=f"Image {oversized} exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+    locations = _form_locations(fields, len(items), "latitudes", "longitudes")
+
+    # 2. Run all pipelines concurrently: detection fills YOLO batches, the
+    # remaining stages are bounded by enrich_slots
+    detect_slots = asyncio.Semaphore(batch_scheduler.max_batch_size * inference_executor.workers)
+    enrich_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def process_one(index, image_id, image_bytes, mime_type, location):
+        try:
+            result = await run_pipeline(
+                image_bytes, mime_type, image_id,
+                detect_slots=detect_slots, enrich_slots=enrich_slots, location=location, deadline=deadline
+            )
+        except Exception as e:
+            logger.error(f"❌ Batch item {index} ({image_id}) failed: {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            result = {"status": "error", "original_image_id": image_id, "detail": detail}
+        return {"index": index, **result}
+
+    tasks = [
+        asyncio.ensure_future(process_one(index, image_id, image_bytes, mime_type, location))
+        for index, ((image_id, image_bytes, mime_type), location) in enumerate(zip(items, locations))
+    ]
+    del items
+    logger.info(f"Processing batch of {len(tasks)} image(s)...")
+
+    if stream:
+        async def ndjson_lines():
+            try:
+                for finished in asyncio.as_completed(tasks):
+                    yield json.dumps(await finished) + "\n"
+            finally:
+                # Client went away: stop work that has not finished yet
+                for task in tasks:
+                    task.cancel()
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    results = await asyncio.gather(*tasks)
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    return JSONResponse(
+        status_code=200,
+        content={
+            "status": "success" if succeeded == len(results) else "partial",
+            "processed": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results
+        }
+    )
+
+
+@app.post("/process-video/", openapi_extra=_form_body({
+    "file": {"type": "string", "format": "binary", "description": "Video file (e.g. dashcam MP4)."},
+    "video_url": {"type": "string", "description": "HTTP(S) or RTSP URL of a video, as an alternative to file."},
+    "video_id": {"type": "string", "description": "Prefix for the imageId of each reported damage."}
+}, ["video_id"]))
+async def process_video(request: Request):
+    """
+    Detect and report the unique road damages in a dashcam video.
+    
+    The upload is streamed to a temporary file (limited to
+    MAX_VIDEO_UPLOAD_MB) and decoded frame by frame; a URL is read directly.
+    Sampled frames are detected in YOLO batches and tracked across frames,
+    and only the best frame of each tracked damage goes through Gemini,
+    storage and the database, as record "{video_id}_{track id}".
+    
+    Form fields:
+        file: Uploaded video file
+        video_url: Video URL on a VIDEO_URL_HOSTS host, instead of file
+        video_id: Prefix for the imageId of each reported damage
+    
+    Returns:
+        StreamingResponse of NDJSON lines: one per reported damage (track
+        id, type, best confidence, frame index/timestamp and the pipeline
+        result), then a summary line with "status": "complete"
+    
+    Raises:
+        HTTPException: 400 if the input is missing, the video_url is not an
+            http(s)/rtsp URL on a VIDEO_URL_HOSTS host, or the input cannot
+            be opened as a video
+        HTTPException: 413 if the upload exceeds MAX_VIDEO_UPLOAD_MB
+        HTTPException: 503 until startup has finished
+    """
+    require_ready()
+
+    fields, files = await _read_form(request, MAX_VIDEO_UPLOAD_BYTES, MAX_VIDEO_UPLOAD_BYTES + 1024 * 1024, spool_files=True)
+    upload = next((part for part in files if part.field_name == "file"), None)
+    video_url = (fields.get("video_url") or [""])[0]
+    video_id = (fields.get("video_id") or [""])[0]
+    try:
+        if not video_id or not (upload or video_url):
+            raise HTTPException(status_code=400, detail="Provide video_id and either a video file or video_url.")
+        if not upload:
+            video_url = _video_url(video_url)
+        try:
+            sampler = await inference_executor.run_blocking(open_video, upload.path if upload else video_url)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Could not open {upload.filename if upload else video_url} as a video.")
+    except HTTPException:
+        remove_spooled(files)
+        raise
+
+    async def ndjson_lines():
+        try:
+            async for line in run_video(sampler, video_id):
+                yield json.dumps(line) + "\n"
+        finally:
+            remove_spooled(files)
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/damages/nearby")
+async def get_nearby_damages(latitude: float, longitude: float, radius_m: float = 100.0):
+    """
+    List recently analyzed damages near a location, closest first.
+    
+    Only damages processed by this instance within DUPLICATE_WINDOW_HOURS
+    are known (see geo.py).
+    
+    Args:
+        latitude: Latitude of the query point
+        longitude: Longitude of the query point
+        radius_m: Search radius in meters (at most 5000)
+    
+    Returns:
+        dict: Matching damages with their imageId, distance, damage types,
+        severity, summary and annotated image ID
+    
+    Raises:
+        HTTPException: 400 if the location or radius is invalid
+        HTTPException: 404 if duplicate suppression is disabled
+        HTTPException: 503 until startup has finished
+    """
+    require_ready()
+    if damage_index is None:
+        raise HTTPException(status_code=404, detail="Duplicate suppression is disabled.")
+    if not valid_location(latitude, longitude) or not 0 < radius_m <= 5000:
+        raise HTTPException(status_code=400, detail="Invalid location or radius.")
+    damages = [
+        {
+            "image_id": entry["image_id"],
+            "latitude": entry["latitude"],
+            "longitude": entry["longitude"],
+            "distance_m": round(entry["distance_m"], 1),
+            "damage_types": entry["types"],
+            "severity": entry["report"].get("overall_severity", 0),
+            "summary": entry["report"].get("summary", ""),
+            "processed_image_id": entry["processed_image_id"],
+            "indexed_at": datetime.fromtimestamp(entry["indexed_at"]).isoformat()
+        }
+        for entry in damage_index.nearby(latitude, longitude, radius_m)
+    ]
+    return {"count": len(damages), "damages": damages}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Report the status of an asynchronous processing job.
+    
+    Args:
+        job_id: ID returned by POST /process-image/ in asynchronous mode
+    
+    Returns:
+        dict: Job status ("queued", "processing", "processed" or "failed"),
+        current stage, timestamps, and the result or error once finished
+    
+    Raises:
+        HTTPException: 404 if the job is unknown or has expired
+        HTTPException: 503 until startup has finished
+    """
+    require_ready()
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return job
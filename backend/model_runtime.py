@@ -0,0 +1,356 @@
+"""
+Model Runtime - Optimized Inference Backends for the YOLO Weights
+
+This module loads the YOLO detector through a configurable runtime. Besides
+the default eager PyTorch path it can export `best.pt` once to ONNX (served by
+ONNX Runtime, optionally INT8-quantized), OpenVINO IR or TorchScript, cache
+the exported artifact next to the weights and serve through it. Exported
+models are still wrapped by ultralytics, so callers get the same Results
+objects (boxes, class names, plotting) regardless of the backend.
+
+Key Features:
+    - One-time export per checkpoint, cached next to the weights and keyed by
+      the checkpoint hash (stale exports are never reused)
+    - Optional dynamic INT8 quantization for ONNX, calibrated INT8 for OpenVINO
+    - Parity check of the exported model against the torch path at startup
+      on low-confidence raw outputs, falling back to torch if they disagree
+      or if nothing was detected to compare
+    - Optional shared model directory (e.g. /dev/shm) holding the weights and
+      exports for all uvicorn workers on a host; a file lock makes sure only
+      one worker copies or exports while the others wait and reuse the result
+
+Configuration (environment variables):
+    INFERENCE_BACKEND: "torch" (default), "onnx", "openvino" or "torchscript"
+    INFERENCE_INT8: "true" to quantize the exported model to INT8 (default: false)
+    INFERENCE_INT8_DATA: Dataset YAML used to calibrate OpenVINO INT8 exports
+    INFERENCE_IMGSZ: Input size used for the export (default: 640)
+    INFERENCE_PARITY_CHECK: "false" to skip the parity check (default: true)
+    INFERENCE_PARITY_IMAGE: Road photo (or directory of photos) used for the
+        parity check (default: a synthetic road scene)
+    INFERENCE_MODEL_DIR: Shared directory for weights and exports (default:
+        next to the weights)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import logging
+import os
+import shutil
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+# Third-party imports
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+# Local imports
+from cache import file_sha256
+from image_utils import synthetic_road_image
+
+logger = logging.getLogger(__name__)
+
+# Export format and artifact suffix for each non-torch backend
+BACKENDS = {
+    "onnx": ("onnx", ".onnx"),
+    "openvino": ("openvino", "_openvino_model"),
+    "torchscript": ("torchscript", ".torchscript")
+}
+
+# ============================================================================
+# SHARED MODEL DIRECTORY
+# ============================================================================
+
+@contextmanager
+def _file_lock(path):
+    """
+    Hold an exclusive lock on path, shared by all processes on the host.
+    """
+    with open(path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _model_file_path(weights_path, suffix, model_dir=None):
+    """
+    Return the hash-keyed path of a model file derived from a checkpoint.
+    """
+    directory = model_dir or os.path.dirname(weights_path)
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    return os.path.join(directory, f"{stem}.{file_sha256(weights_path)[:12]}{suffix}")
+
+
+def stage_weights(weights_path, model_dir):
+    """
+    Copy a checkpoint into the shared model directory, once per host.
+
+    With a tmpfs directory such as /dev/shm, every worker then loads the
+    weights from memory and the file pages are shared between them.
+
+    Args:
+        weights_path: Path to the .pt checkpoint
+        model_dir: Shared directory
+
+    Returns:
+        str: Path of the staged checkpoint
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    target = _model_file_path(weights_path, os.path.splitext(weights_path)[1], model_dir)
+    with _file_lock(f"{target}.lock"):
+        if not os.path.exists(target):
+            shutil.copyfile(weights_path, f"{target}.tmp")
+            os.replace(f"{target}.tmp", target)
+            logger.info(f"Staged {weights_path} at {target}")
+    return target
+
+
+# ============================================================================
+# EXPORT
+# ============================================================================
+
+def artifact_path_for(weights_path, backend, int8=False, model_dir=None):
+    """
+    Return the cached export path for a checkpoint and backend.
+
+    Args:
+        weights_path: Path to the .pt checkpoint
+        backend: Backend name (a key of BACKENDS)
+        int8: Whether the artifact is INT8-quantized
+        model_dir: Directory for the export (default: next to the weights)
+
+    Returns:
+        str: Path of the exported file (or directory, for OpenVINO)
+    """
+    _, suffix = BACKENDS[backend]
+    return _model_file_path(weights_path, f"{'.int8' if int8 else ''}{suffix}", model_dir)
+
+
+def export_model(weights_path, backend, int8=False, imgsz=640, model_dir=None):
+    """
+    Export a checkpoint to the given backend, reusing a cached export.
+
+    Concurrent callers (e.g. several uvicorn workers starting together) are
+    serialized by a file lock, so the export runs only once.
+
+    Args:
+        weights_path: Path to the .pt checkpoint
+        backend: "onnx", "openvino" or "torchscript"
+        int8: Quantize the exported model to INT8
+        imgsz: Input size for the export
+        model_dir: Directory for the export (default: next to the weights)
+
+    Returns:
+        str: Path of the exported model
+
+    Raises:
+        ValueError: If the backend is unknown or INT8 is not supported for it
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if int8 and backend == "torchscript":
+        raise ValueError("INT8 quantization is not supported for TorchScript exports.")
+
+    target = artifact_path_for(weights_path, backend, int8, model_dir)
+    with _file_lock(f"{target}.lock"):
+        if os.path.exists(target):
+            logger.info(f"Using cached {backend} export: {target}")
+            return target
+        return _export(weights_path, backend, target, int8, imgsz)
+
+
+def _export(weights_path, backend, target, int8, imgsz):
+    """
+    Export a checkpoint and move the result to target.
+    """
+    export_format, _ = BACKENDS[backend]
+    export_args = {"format": export_format, "imgsz": imgsz, "dynamic": True}
+    if int8 and backend == "openvino":
+        # OpenVINO INT8 needs calibration images from a dataset YAML
+        export_args.update(int8=True, data=os.getenv("INFERENCE_INT8_DATA", "coco8.yaml"))
+
+    logger.info(f"Exporting {weights_path} to {backend} (imgsz {imgsz}, int8 {int8})...")
+    exported = YOLO(weights_path).export(**export_args)
+
+    if int8 and backend == "onnx":
+        # Dynamic quantization needs no calibration data
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(exported, f"{target}.tmp", weight_type=QuantType.QUInt8)
+        os.remove(exported)
+        exported = f"{target}.tmp"
+
+    # Move into place last so an interrupted export is never picked up as
+    # cached (the target may be on another filesystem, e.g. /dev/shm)
+    if os.path.isdir(exported):
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        shutil.move(exported, target)
+    else:
+        if exported != f"{target}.tmp":
+            shutil.move(exported, f"{target}.tmp")
+        os.replace(f"{target}.tmp", target)
+    logger.info(f"Exported model cached at {target}")
+    return target
+
+
+# ============================================================================
+# PARITY CHECK
+# ============================================================================
+
+def _parity_images(imgsz):
+    """
+    Return the images used for the parity check.
+
+    INFERENCE_PARITY_IMAGE may name an image file or a directory of images;
+    without it a synthetic road scene is used.
+    """
+    path = os.getenv("INFERENCE_PARITY_IMAGE")
+    if path:
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+        images = [image for image in map(cv2.imread, files) if image is not None]
+        if images:
+            return images
+        logger.warning(f"Could not read a parity image from {path}, using a synthetic road scene.")
+    else:
+        logger.info("No INFERENCE_PARITY_IMAGE set, checking parity on a synthetic road scene "
+                    "(a real road photo is recommended).")
+    return [synthetic_road_image(imgsz, imgsz, np.random.default_rng(0))]
+
+
+def _box_iou(a, b):
+    """
+    IoU of two xyxy boxes.
+    """
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _unmatched(boxes, others, min_conf, min_iou, conf_tolerance):
+    """
+    Return the first box above min_conf without a counterpart in others.
+
+    A counterpart has the same class, an IoU of at least min_iou and a
+    confidence within conf_tolerance; others holds every low-confidence
+    output, so a box sitting near a threshold still finds its match.
+    """
+    for box in boxes:
+        if box[4] < min_conf:
+            continue
+        if not any(
+            int(other[5]) == int(box[5])
+            and abs(other[4] - box[4]) <= conf_tolerance
+            and _box_iou(box[:4], other[:4]) >= min_iou
+            for other in others
+        ):
+            return box
+    return None
+
+
+def check_parity(reference, candidate, imgsz=640, min_iou=0.9, conf_tolerance=0.05, min_conf=0.05):
+    """
+    Compare the raw outputs of an exported model against the torch model.
+
+    Both models run with a very low confidence threshold, so the comparison
+    covers the raw candidates rather than the few boxes that survive the
+    serving threshold. Every box scoring at least min_conf in either model
+    must be matched by a box of the other model of the same class, with a
+    high IoU and a close confidence. Box counts are not compared: a box
+    dropping just below a threshold in one model is not a disagreement.
+
+    Args:
+        reference: Torch YOLO model
+        candidate: Exported YOLO model
+        imgsz: Inference size
+        min_iou: Minimum IoU between matched boxes
+        conf_tolerance: Maximum absolute confidence difference
+        min_conf: Confidence from which a box must have a counterpart
+
+    Returns:
+        tuple: (ok, message) where ok is None if the check is inconclusive
+            (the torch model finds nothing above min_conf to compare)
+    """
+    compared = 0
+    for image in _parity_images(imgsz):
+        expected = reference(image, imgsz=imgsz, conf=0.001, verbose=False)[0].boxes.data.tolist()
+        actual = candidate(image, imgsz=imgsz, conf=0.001, verbose=False)[0].boxes.data.tolist()
+
+        for boxes, others, side in ((expected, actual, "torch"), (actual, expected, "exported")):
+            box = _unmatched(boxes, others, min_conf, min_iou, conf_tolerance)
+            if box is not None:
+                x1, y1, x2, y2, conf, cls = box
+                return False, f"no match for {side} class {int(cls)} box at ({x1:.0f}, {y1:.0f}) conf {conf:.2f}"
+        compared += sum(box[4] >= min_conf for box in expected)
+
+    if not compared:
+        return None, f"torch model found nothing above conf {min_conf} to compare"
+    return True, f"{compared} detection(s) above conf {min_conf} match"
+
+
+# ============================================================================
+# LOADING
+# ============================================================================
+
+def load_model(weights_path, backend=None, int8=None, imgsz=None, parity_check=None, model_dir=None):
+    """
+    Load the YOLO detector through the configured runtime backend.
+
+    Arguments left as None are read from the INFERENCE_* environment
+    variables. If export, loading or the parity check fails, the torch model
+    is returned instead so the service still starts.
+
+    Args:
+        weights_path: Path to the .pt checkpoint
+        backend: "torch", "onnx", "openvino" or "torchscript"
+        int8: Quantize the exported model to INT8
+        imgsz: Input size used for the export and the parity check
+        parity_check: Compare exported detections against torch before serving
+        model_dir: Shared directory for the weights and exports
+
+    Returns:
+        tuple: (model, model_path, backend) where model_path is the file each
+            executor worker should load and backend the runtime actually used
+    """
+    backend = (backend or os.getenv("INFERENCE_BACKEND", "torch")).lower()
+    if int8 is None:
+        int8 = os.getenv("INFERENCE_INT8", "false").lower() == "true"
+    imgsz = imgsz or int(os.getenv("INFERENCE_IMGSZ", "640"))
+    if parity_check is None:
+        parity_check = os.getenv("INFERENCE_PARITY_CHECK", "true").lower() == "true"
+
+    model_dir = model_dir or os.getenv("INFERENCE_MODEL_DIR")
+    serve_path = stage_weights(weights_path, model_dir) if model_dir else weights_path
+
+    reference = YOLO(serve_path)
+    if backend == "torch":
+        return reference, serve_path, "torch"
+
+    try:
+        artifact = export_model(weights_path, backend, int8=int8, imgsz=imgsz, model_dir=model_dir)
+        exported = YOLO(artifact, task="detect")
+        if parity_check:
+            tolerance = {"min_iou": 0.8, "conf_tolerance": 0.1} if int8 else {}
+            ok, message = check_parity(reference, exported, imgsz=imgsz, **tolerance)
+            if ok is None:
+                raise RuntimeError(f"parity check inconclusive: {message}; set INFERENCE_PARITY_IMAGE "
+                                   "to a road photo with visible damage")
+            if not ok:
+                raise RuntimeError(f"parity check failed: {message}")
+            logger.info(f"Parity check passed for {backend}: {message}")
+    except Exception as e:
+        logger.warning(f"{backend} backend unavailable ({e}), falling back to torch.")
+        return reference, serve_path, "torch"
+
+    logger.info(f"Serving YOLO through {backend}{' (int8)' if int8 else ''}: {artifact}")
+    return exported, artifact, f"{backend}-int8" if int8 else backend
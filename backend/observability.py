@@ -0,0 +1,422 @@
+"""
+Observability - Metrics, Structured Logging and Request Tracing
+
+This module provides the instrumentation shared by the API, the Predictor
+and the bulk CLI: Prometheus metrics served on GET /metrics, logging with an
+optional JSON format and a request ID on every line, and optional
+OpenTelemetry spans around requests and pipeline stages.
+
+Key Features:
+    - Counter, Gauge and Histogram metrics rendered in the Prometheus text
+      exposition format, without extra dependencies; updating a metric is a
+      lock and a few additions, so the hot path stays cheap
+    - Collectors: functions called at scrape time to export existing stats()
+      (executor queue depth, batching, Gemini counters, ...) as gauges
+    - configure_logging(): plain text (default) or one JSON object per line,
+      each carrying the current request ID (and trace ID when tracing)
+    - RequestObserver: ASGI middleware that assigns or propagates an
+      X-Request-ID, tracks in-flight requests and records request latency by
+      route template and status code
+    - span(): OpenTelemetry span when OTEL_TRACING is enabled and the
+      opentelemetry package is installed, a no-op otherwise
+
+Configuration (environment variables):
+    LOG_FORMAT: "text" (default) or "json"
+    LOG_LEVEL: Logging level (default: INFO)
+    OTEL_TRACING: Create OpenTelemetry spans (default: false; needs
+        opentelemetry-api and an SDK/exporter configured by the deployment)
+
+Usage:
+    REQUESTS = counter("safestreet_example_total", "Example requests.", ("status",))
+    REQUESTS.inc(("ok",))
+    with span("example", image_id=image_id):
+        ...
+    text = render_metrics()
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+# Optional OpenTelemetry support
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+OTEL_TRACING = os.getenv("OTEL_TRACING", "false").lower() == "true" and otel_trace is not None
+
+# Content type of GET /metrics
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default histogram buckets in seconds (5 ms to 60 s)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ID of the request being handled, added to every log line
+request_id = ContextVar("request_id", default=None)
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    """Escape a label value for the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    """Render a label set, e.g. {stage="detect",le="0.5"}."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    """Render a sample value (integers without a decimal point)."""
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    """
+    Base class of registered metrics.
+
+    Attributes:
+        name: Metric name
+        help: One-line description
+        labelnames: Names of the labels, in the order values are passed
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        """
+        Initialize and register the metric.
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        """Return the metric's exposition lines."""
+        with self._lock:
+            values = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values
+        ]
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, e.g. calls or errors.
+    """
+
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        """Add `amount` to the counter for the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. requests in flight.
+    """
+
+    kind = "gauge"
+
+    def set(self, value, labels=()):
+        """Set the gauge for the given label values."""
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        """Increase the gauge for the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        """Decrease the gauge for the given label values."""
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over fixed buckets, e.g. latencies.
+
+    Attributes:
+        buckets: Sorted upper bounds (+Inf is implicit)
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Initialize and register the histogram.
+        """
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        """Record one value for the given label values."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, labels=()):
+        """Context manager observing the duration of its block in seconds."""
+        return _Timer(self, labels)
+
+    def render(self):
+        """Return the histogram's cumulative bucket, sum and count lines."""
+        with self._lock:
+            values = sorted((labels, ([*state[0]], state[1], state[2])) for labels, state in self._values.items())
+        lines = self._header()
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    """
+    Observe the duration of a with-block into a Histogram.
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+        return False
+
+
+def counter(name, help, labelnames=()):
+    """Create and register a Counter."""
+    return Counter(name, help, labelnames)
+
+
+def gauge(name, help, labelnames=()):
+    """Create and register a Gauge."""
+    return Gauge(name, help, labelnames)
+
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    """Create and register a Histogram."""
+    return Histogram(name, help, labelnames, buckets)
+
+
+def register_collector(collect):
+    """
+    Register a function called on every scrape.
+
+    Args:
+        collect: Callable returning an iterable of (name, help, value) or
+            (name, help, value, labels_dict) tuples, exported as gauges
+    """
+    _collectors.append(collect)
+
+
+def render_metrics():
+    """
+    Render all registered metrics and collector values.
+
+    Returns:
+        str: Prometheus text exposition (format 0.0.4)
+    """
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+
+    samples = {}
+    for collect in _collectors:
+        try:
+            for sample in collect():
+                name, help, value, labels = (*sample, {}) if len(sample) == 3 else sample
+                if value is not None:
+                    samples.setdefault((name, help), []).append((labels, value))
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Metrics collector failed: {e}")
+    for (name, help), values in samples.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+        lines += [f"{name}{_labels(labels, labels.values())} {_number(value)}" for labels, value in values]
+    return "\n".join(lines) + "\n"
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+class _ContextFilter(logging.Filter):
+    """
+    Add the current request ID and trace ID to every log record.
+    """
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        record.trace_id = None
+        if OTEL_TRACING:
+            context = otel_trace.get_current_span().get_span_context()
+            if context.is_valid:
+                record.trace_id = format(context.trace_id, "032x")
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format log records as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key in ("request_id", "trace_id"):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _TextFormatter(logging.Formatter):
+    """
+    Plain message, prefixed with the request ID when there is one.
+    """
+
+    def format(self, record):
+        message = super().format(record)
+        rid = getattr(record, "request_id", None)
+        return f"[{rid}] {message}" if rid else message
+
+
+_logging_configured = False
+
+
+def configure_logging():
+    """
+    Send log records to stdout in the LOG_FORMAT format (once per process).
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(_ContextFilter())
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(_TextFormatter("%(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # httpx logs every request at INFO; Appwrite calls are covered by metrics
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# ============================================================================
+# TRACING
+# ============================================================================
+
+def span(name, **attributes):
+    """
+    Open a tracing span (a no-op context manager when tracing is disabled).
+
+    Args:
+        name: Span name
+        **attributes: Span attributes (None values are skipped)
+    """
+    if not OTEL_TRACING:
+        return nullcontext()
+    return otel_trace.get_tracer("safestreet").start_as_current_span(
+        name, attributes={key: value for key, value in attributes.items() if value is not None}
+    )
+
+# ============================================================================
+# REQUEST MIDDLEWARE
+# ============================================================================
+
+HTTP_REQUEST_SECONDS = histogram(
+    "safestreet_http_request_seconds", "HTTP request latency.", ("method", "route", "status")
+)
+HTTP_IN_FLIGHT = gauge("safestreet_http_requests_in_flight", "HTTP requests being handled.")
+
+
+class RequestObserver:
+    """
+    ASGI middleware: request ID, in-flight gauge, latency histogram and span.
+
+    The request ID is taken from the X-Request-ID header (or generated),
+    set for the duration of the request and returned in the response
+    header. Latency is labelled with the route template (e.g.
+    /jobs/{job_id}), so IDs in paths do not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:128] or uuid.uuid4().hex
+        token = request_id.set(rid)
+        status = [500]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            with span(f"{scope['method']} {scope['path']}", request_id=rid):
+                await self.app(scope, receive, send_with_id)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, (scope["method"], route, str(status[0])))
+            request_id.reset(token)
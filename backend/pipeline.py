@@ -0,0 +1,341 @@
+"""
+Detection Pipeline Core - Shared Model, Class Map and Staged Execution
+
+This module holds what the API (main.py) and the Predictor (inference.py)
+share: one loaded YOLO model per weights file and runtime backend, one class
+map, one detection step and a small engine that runs an image through named
+stages (decode -> detect -> postprocess -> enrich -> annotate -> persist).
+
+Key Features:
+    - DAMAGE_TYPE_MAPPING: the single YOLO class code -> damage type map
+    - shared_model(): process-wide cache of loaded models, so every caller
+      in a process uses the same model instance
+    - Detector: full-frame or tiled detection through a BatchScheduler, so
+      concurrent callers share YOLO batches
+    - Stage / Pipeline: stages are async functions over a context dict; each
+      stage can be bounded by a semaphore from the context, report progress,
+      be cached (outputs stored under a key computed from the context) and
+      jump to a later stage. Pipelines nest, and every stage is timed
+      (GET /stats) and exported as Prometheus metrics and tracing spans
+      (see observability.py)
+
+Usage:
+    pipeline = Pipeline("image", [
+        Stage("decode", decode),
+        Stage("detect", detect, limit="detect_slots", progress="detecting"),
+        Stage("persist", persist)
+    ])
+    ctx = await pipeline.run({"image_bytes": data, "detect_slots": semaphore})
+    print(pipeline.stats())
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Third-party imports
+from ultralytics.engine.results import Results
+
+# Local imports
+from model_runtime import load_model
+from observability import counter, gauge, histogram, span
+from tiling import cut_tiles, merge_tile_results, tile_windows
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# CLASS MAP AND SHARED MODEL
+# ============================================================================
+
+# Mapping from YOLO class codes to human-readable damage types
+DAMAGE_TYPE_MAPPING = {
+    'D00': 'Pothole',
+    'D10': 'Longitudinal Crack',
+    'D20': 'Alligator Crack',
+    'D40': 'Transverse Crack',
+    'D50': 'Manhole'
+}
+
+# (realpath, backend) -> load_model() result
+_models = {}
+_models_lock = threading.Lock()
+
+
+def shared_model(weights_path, backend=None):
+    """
+    Load a YOLO model once per process and return the same instance afterwards.
+
+    Args:
+        weights_path: Path to the .pt checkpoint
+        backend: Runtime backend (default: INFERENCE_BACKEND, see model_runtime.py)
+
+    Returns:
+        tuple: (model, model_path, backend) as returned by load_model()
+    """
+    key = (os.path.realpath(weights_path), (backend or os.getenv("INFERENCE_BACKEND", "torch")).lower())
+    with _models_lock:
+        if key not in _models:
+            _models[key] = load_model(weights_path, backend=backend)
+        return _models[key]
+
+# ============================================================================
+# DETECTION
+# ============================================================================
+
+class Detector:
+    """
+    Run YOLO on one image through a BatchScheduler, optionally tiled.
+
+    In tiled mode the tiles of the detail view and the full frame are
+    submitted together, so the scheduler runs them as one batch; the merged
+    boxes are returned as a Results object on the model image, exactly like
+    a plain pass.
+
+    Attributes:
+        scheduler: BatchScheduler running the model
+        tile_size: Tile side in pixels (0 disables tiling)
+        tile_overlap: Fraction of a tile shared with its neighbour
+        tile_max: Maximum number of tiles per image
+        merge: Cross-tile merge method, "nms" or "wbf"
+        merge_iou: Minimum IoU for merging boxes across tiles
+    """
+
+    def __init__(self, scheduler, tile_size=0, tile_overlap=0.2, tile_max=16, merge="nms", merge_iou=0.5):
+        """
+        Initialize the detector.
+        """
+        self.scheduler = scheduler
+        self.tile_size = max(0, int(tile_size))
+        self.tile_overlap = tile_overlap
+        self.tile_max = tile_max
+        self.merge = merge
+        self.merge_iou = merge_iou
+
+    async def detect(self, image, detail=None):
+        """
+        Detect damage in an image.
+
+        Args:
+            image: Model-sized BGR image
+            detail: Optional higher-resolution view of the same image that is
+                cut into tiles (ignored when tiling is disabled)
+
+        Returns:
+            ultralytics.engine.results.Results: Detections in `image` coordinates
+        """
+        windows = []
+        if detail is not None and self.tile_size:
+            windows = tile_windows(detail.shape[1], detail.shape[0], self.tile_size, self.tile_overlap, self.tile_max)
+        if not windows:
+            return await self.scheduler.submit(image)
+
+        full, *tiles = await asyncio.gather(
+            self.scheduler.submit(image),
+            *(self.scheduler.submit(tile) for tile in cut_tiles(detail, windows))
+        )
+        detail_per_model = max(detail.shape[:2]) / max(image.shape[:2])
+        merged = merge_tile_results(
+            [tile.boxes.data for tile in tiles], windows, full.boxes.data, detail_per_model, self.merge_iou, self.merge
+        )
+        merged[:, :4] /= detail_per_model
+        logger.info(f"Tiled inference: {len(windows)} tile(s) + full frame -> {len(merged)} detection(s)")
+        return Results(image, path=full.path, names=full.names, boxes=merged)
+
+# ============================================================================
+# STAGES
+# ============================================================================
+
+# Returned by a stage to end the whole pipeline, including enclosing ones
+STOP = "__stop__"
+
+STAGE_SECONDS = histogram("safestreet_stage_seconds", "Pipeline stage run time.", ("pipeline", "stage"))
+STAGE_WAIT_SECONDS = histogram(
+    "safestreet_stage_wait_seconds", "Time a stage waited for its concurrency slot.", ("pipeline", "stage")
+)
+STAGE_ERRORS = counter("safestreet_stage_errors_total", "Pipeline stages that raised.", ("pipeline", "stage"))
+STAGE_CACHE_HITS = counter("safestreet_stage_cache_hits_total", "Pipeline stages served from cache.", ("pipeline", "stage"))
+STAGE_IN_FLIGHT = gauge("safestreet_stage_in_flight", "Pipeline stages currently running.", ("pipeline", "stage"))
+
+
+class Stage:
+    """
+    One named step of a Pipeline.
+
+    `run` is a coroutine function taking the context dict (or a nested
+    Pipeline). It returns None to continue with the next stage, the name of
+    a later stage to jump to (a name unknown to this pipeline is passed on
+    to the enclosing one), or STOP.
+
+    With a cache, `cache_key(ctx)` (a coroutine function) computes the key;
+    on a hit the stored outputs are copied into the context and `run` is
+    skipped, otherwise the `outputs` context entries are stored after `run`
+    when `store_if(ctx)` allows it. Keys are kept in ctx["cache_keys"] and
+    hits are listed in ctx["cache_hits"], both by stage name.
+
+    Attributes:
+        name: Stage name, unique within its pipeline
+        run: Coroutine function or Pipeline
+        limit: Optional context key of a semaphore held while the stage runs
+        progress: Optional label passed to ctx["progress"] before the stage
+        cache: Optional cache with async get(key) and set(key, value)
+        cache_key: Coroutine function returning the key (None skips the cache)
+        outputs: Context keys stored in and restored from the cache
+        store_if: Optional predicate deciding whether a result is cached
+    """
+
+    def __init__(self, name, run, limit=None, progress=None, cache=None, cache_key=None, outputs=(), store_if=None):
+        """
+        Initialize the stage.
+        """
+        self.name = name
+        self.run = run
+        self.limit = limit
+        self.progress = progress
+        self.cache = cache
+        self.cache_key = cache_key
+        self.outputs = tuple(outputs)
+        self.store_if = store_if
+
+
+class Pipeline:
+    """
+    Run a context dict through a sequence of stages and time each of them.
+
+    Attributes:
+        name: Pipeline name
+        stages: List of Stage objects, in order
+    """
+
+    def __init__(self, name, stages):
+        """
+        Initialize the pipeline.
+
+        Raises:
+            ValueError: If two stages share a name
+        """
+        self.name = name
+        self.stages = list(stages)
+        self._index = {stage.name: i for i, stage in enumerate(self.stages)}
+        if len(self._index) != len(self.stages):
+            raise ValueError(f"Pipeline {name} has duplicate stage names.")
+        self._stats = {
+            stage.name: {"calls": 0, "errors": 0, "cache_hits": 0, "total_ms": 0.0, "max_ms": 0.0, "wait_ms": 0.0}
+            for stage in self.stages
+        }
+
+    async def __call__(self, ctx):
+        """
+        Run as a nested stage; returns the jump target for the enclosing pipeline.
+        """
+        return await self._run(ctx)
+
+    async def run(self, ctx):
+        """
+        Run all stages on a context.
+
+        Args:
+            ctx: Context dict shared by the stages
+
+        Returns:
+            dict: The context
+
+        Raises:
+            ValueError: If a stage jumps to an unknown stage
+            Exception: Any error raised by a stage
+        """
+        target = await self._run(ctx)
+        if target not in (None, STOP):
+            raise ValueError(f"Pipeline {self.name} has no stage {target!r}.")
+        return ctx
+
+    async def _run(self, ctx):
+        """
+        Run the stages; returns None, STOP or a jump target outside this pipeline.
+        """
+        index = 0
+        while index < len(self.stages):
+            stage = self.stages[index]
+            target = await self._run_stage(stage, ctx)
+            if target is None:
+                index += 1
+            elif target == STOP:
+                return STOP
+            elif target in self._index and self._index[target] > index:
+                index = self._index[target]
+            else:
+                return target
+        return None
+
+    async def _run_stage(self, stage, ctx):
+        """
+        Run one stage with its progress report, semaphore, cache and timing.
+        """
+        stats = self._stats[stage.name]
+        labels = (self.name, stage.name)
+        progress = ctx.get("progress")
+        if stage.progress and progress:
+            await progress(stage.progress)
+
+        waited = time.perf_counter()
+        async with (ctx.get(stage.limit) if stage.limit else None) or nullcontext():
+            started = time.perf_counter()
+            stats["calls"] += 1
+            stats["wait_ms"] += (started - waited) * 1000
+            STAGE_WAIT_SECONDS.observe(started - waited, labels)
+            STAGE_IN_FLIGHT.inc(labels)
+            try:
+                with span(f"{self.name}.{stage.name}", image_id=ctx.get("original_image_id")):
+                    key = await stage.cache_key(ctx) if stage.cache is not None and stage.cache_key else None
+                    if key:
+                        ctx.setdefault("cache_keys", {})[stage.name] = key
+                        entry = await stage.cache.get(key)
+                        if entry:
+                            ctx.update(entry)
+                            ctx.setdefault("cache_hits", []).append(stage.name)
+                            stats["cache_hits"] += 1
+                            STAGE_CACHE_HITS.inc(labels)
+                            return None
+                    target = await stage.run(ctx)
+                    if key and (stage.store_if is None or stage.store_if(ctx)):
+                        await stage.cache.set(key, {output: ctx.get(output) for output in stage.outputs})
+                    return target
+            except Exception:
+                stats["errors"] += 1
+                STAGE_ERRORS.inc(labels)
+                raise
+            finally:
+                STAGE_IN_FLIGHT.dec(labels)
+                elapsed = time.perf_counter() - started
+                STAGE_SECONDS.observe(elapsed, labels)
+                stats["total_ms"] += elapsed * 1000
+                stats["max_ms"] = max(stats["max_ms"], elapsed * 1000)
+
+    def stats(self):
+        """
+        Return per-stage call counts and timings (nested pipelines included).
+
+        Returns:
+            dict: Stage name -> calls, errors, cache hits, average and maximum
+            run time and average semaphore wait in milliseconds
+        """
+        result = {}
+        for stage in self.stages:
+            stats = self._stats[stage.name]
+            calls = stats["calls"] or 1
+            result[stage.name] = {
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "cache_hits": stats["cache_hits"],
+                "avg_ms": round(stats["total_ms"] / calls, 2),
+                "max_ms": round(stats["max_ms"], 2),
+                "avg_wait_ms": round(stats["wait_ms"] / calls, 2)
+            }
+            if isinstance(stage.run, Pipeline):
+                result[stage.name]["stages"] = stage.run.stats()
+        return result
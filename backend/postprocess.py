@@ -0,0 +1,203 @@
+"""
+Detection Post-Processing - Array-Based Box Handling and Annotation
+
+This module turns the boxes YOLO returns for one image into detection records
+and annotations without per-box Python work on tensors. The boxes tensor is
+copied to the host once; class mapping, filtering, scaling and clipping are
+NumPy operations over all boxes, and all boxes are drawn in one pass.
+
+Key Features:
+    - One device-to-host transfer per image instead of one sync per value
+    - Class name and damage type lookup by array indexing
+    - Validity filtering (minimum confidence and size), scaling and clipping
+      to the image bounds as array operations
+    - JSON-ready detection records built from whole columns
+    - Single-pass rendering: the outlines of all boxes of a class are drawn
+      with one cv2.polylines call; labels are capped for dense images
+
+Author: SafeStreet Team
+"""
+
+# Third-party imports
+import cv2
+import numpy as np
+from ultralytics.utils.plotting import colors
+
+# ============================================================================
+# DETECTIONS
+# ============================================================================
+
+def to_numpy(data):
+    """
+    Copy a boxes tensor (or array) to a float32 NumPy array in one transfer.
+
+    Args:
+        data: (N, 6) [x1, y1, x2, y2, conf, cls] tensor or array, e.g.
+            Results.boxes.data
+
+    Returns:
+        numpy.ndarray: (N, 6) float32 array
+    """
+    if hasattr(data, "cpu"):
+        data = data.cpu().numpy()
+    array = np.asarray(data, dtype=np.float32)
+    return array.reshape(-1, array.shape[-1] if array.ndim == 2 else 6)
+
+
+def _lookup_table(names, mapping=None):
+    """
+    Build an object array indexed by class ID holding (mapped) class names.
+    """
+    names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+    table = np.empty(max(names, default=-1) + 1, dtype=object)
+    for class_id, name in names.items():
+        table[class_id] = mapping.get(name, name) if mapping is not None else name
+    return table
+
+
+class Detections:
+    """
+    Detections of one image as column arrays.
+
+    Attributes:
+        boxes: (N, 4) float32 xyxy boxes
+        confidences: (N,) float32 detection confidences
+        class_ids: (N,) int64 YOLO class IDs
+        names: (N,) YOLO class names
+        types: (N,) damage types (class names after mapping)
+    """
+
+    def __init__(self, boxes, confidences, class_ids, names, types):
+        """
+        Initialize from column arrays of equal length.
+        """
+        self.boxes = boxes
+        self.confidences = confidences
+        self.class_ids = class_ids
+        self.names = names
+        self.types = types
+
+    def __len__(self):
+        return len(self.confidences)
+
+    def scaled(self, factor):
+        """
+        Return a copy with the boxes multiplied by factor.
+        """
+        return Detections(self.boxes * np.float32(factor), self.confidences, self.class_ids, self.names, self.types)
+
+    def records(self, integer_boxes=False):
+        """
+        Return the detections as JSON-ready dicts.
+
+        Args:
+            integer_boxes: Truncate box coordinates to integers
+
+        Returns:
+            list: {"type", "confidence", "box"} dicts in detection order
+        """
+        boxes = self.boxes.astype(np.int64) if integer_boxes else self.boxes
+        return [
+            {"type": damage_type, "confidence": confidence, "box": box}
+            for damage_type, confidence, box in zip(self.types.tolist(), self.confidences.tolist(), boxes.tolist())
+        ]
+
+    def counts(self):
+        """
+        Return the number of detections per damage type.
+        """
+        types, counts = np.unique(self.types.astype(str), return_counts=True)
+        return dict(zip(types.tolist(), counts.tolist()))
+
+
+def postprocess(data, names, mapping=None, scale=1.0, image_size=None, min_confidence=0.0, min_size=1.0):
+    """
+    Convert YOLO boxes to Detections with array operations.
+
+    Args:
+        data: (N, 6) [x1, y1, x2, y2, conf, cls] tensor or array
+        names: YOLO class names (dict of class ID -> name, or a list)
+        mapping: Optional class name -> damage type mapping
+        scale: Factor from the detection image to the output coordinates
+        image_size: Optional (width, height) of the output image; boxes are
+            clipped to it
+        min_confidence: Drop detections below this confidence
+        min_size: Drop boxes narrower or lower than this (output pixels)
+
+    Returns:
+        Detections: Valid detections in output coordinates, in input order
+    """
+    array = to_numpy(data)
+    boxes = array[:, :4] * np.float32(scale)
+    if image_size:
+        boxes[:, 0::2] = np.clip(boxes[:, 0::2], 0, image_size[0])
+        boxes[:, 1::2] = np.clip(boxes[:, 1::2], 0, image_size[1])
+    keep = (
+        (array[:, 4] >= min_confidence)
+        & (boxes[:, 2] - boxes[:, 0] >= min_size)
+        & (boxes[:, 3] - boxes[:, 1] >= min_size)
+    )
+    class_ids = array[keep, 5].astype(np.int64)
+    return Detections(
+        boxes[keep], array[keep, 4], class_ids,
+        _lookup_table(names)[class_ids], _lookup_table(names, mapping)[class_ids]
+    )
+
+
+# ============================================================================
+# RENDERING
+# ============================================================================
+
+def draw_detections(image, boxes, class_ids=None, labels=None, color=None, line_width=None, max_labels=100):
+    """
+    Draw boxes and labels onto an image in place.
+
+    The outlines of all boxes sharing a color are drawn with one
+    cv2.polylines call. Labels are drawn for at most `max_labels` boxes, in
+    the given order (pass boxes sorted by confidence to label the best ones).
+
+    Args:
+        image: BGR array to draw on
+        boxes: (N, 4) xyxy boxes in image coordinates
+        class_ids: (N,) class IDs choosing the palette color of each box
+        labels: Optional list of N label strings
+        color: Optional BGR color for all boxes (overrides the palette)
+        line_width: Outline width (default: scaled to the image size)
+        max_labels: Maximum number of labels drawn
+
+    Returns:
+        numpy.ndarray: The image
+    """
+    if not len(boxes):
+        return image
+    line_width = line_width or max(round(sum(image.shape[:2]) / 2 * 0.003), 2)
+    corners = np.round(np.asarray(boxes)).astype(np.int32)
+    polygons = np.stack([
+        corners[:, [0, 1]], corners[:, [2, 1]], corners[:, [2, 3]], corners[:, [0, 3]]
+    ], axis=1)
+
+    if color is not None or class_ids is None:
+        box_colors = [color or colors(0, True)] * len(corners)
+        groups = [(box_colors[0], np.arange(len(corners)))]
+    else:
+        class_ids = np.asarray(class_ids)
+        palette = {int(class_id): colors(int(class_id), True) for class_id in np.unique(class_ids)}
+        box_colors = [palette[class_id] for class_id in class_ids.tolist()]
+        groups = [(palette[class_id], np.flatnonzero(class_ids == class_id)) for class_id in palette]
+    for group_color, indices in groups:
+        cv2.polylines(image, list(polygons[indices]), True, group_color, line_width, cv2.LINE_AA)
+
+    if labels is not None:
+        thickness = max(line_width - 1, 1)
+        font_scale = thickness / 3
+        for i in range(min(len(labels), max_labels)):
+            (text_width, text_height), _ = cv2.getTextSize(labels[i], 0, font_scale, thickness)
+            x1, y1 = int(corners[i, 0]), int(corners[i, 1])
+            outside = y1 >= text_height + 3
+            top = y1 - text_height - 3 if outside else y1 + text_height + 3
+            cv2.rectangle(image, (x1, y1), (x1 + text_width, top), box_colors[i], -1, cv2.LINE_AA)
+            cv2.putText(
+                image, labels[i], (x1, y1 - 2 if outside else y1 + text_height + 2), 0, font_scale,
+                (255, 255, 255), thickness, cv2.LINE_AA
+            )
+    return image
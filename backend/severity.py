@@ -0,0 +1,415 @@
+"""
+Severity Model - Local Damage Severity Scoring
+
+This module estimates the overall severity (1-3) of the road damage in an
+image from its YOLO detections alone, so that Gemini is only asked when the
+estimate is uncertain. All boxes of an image are scored at once with NumPy.
+
+Key Features:
+    - Per-box score from the damage type weight, the detection confidence and
+      the box area relative to the image
+    - Image score from the strongest box, the number of boxes and the damage
+      density (confidence-weighted share of the image covered by boxes)
+    - Severity from two score thresholds, with a confidence that grows with
+      the distance of the score to the nearest threshold
+    - Damage score (0-100) for reports
+    - Images without detections have no estimate to trust; a separate policy
+      decides whether they are sent to Gemini
+    - Calibration of the thresholds and the confidence band against stored
+      Gemini severities (result cache database or JSON lines), saved as JSON
+
+Configuration (environment variables):
+    SEVERITY_MODEL: "local" (default) answers from the local estimate when it
+        is confident enough; "gemini" always asks Gemini
+    SEVERITY_MIN_CONFIDENCE: Confidence needed to skip Gemini (default: 0.6)
+    SEVERITY_EMPTY_POLICY: "gemini" (default) sends images without detections
+        to Gemini; "local" reports them as undamaged without asking Gemini
+    SEVERITY_CALIBRATION_PATH: JSON file written by the calibrate command,
+        loaded if it exists (default: severity_calibration.json)
+
+Usage (fit the thresholds to the Gemini severities in the result cache):
+    python severity.py calibrate result_cache.sqlite3
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+# Third-party imports
+import numpy as np
+
+# Relative weight of each damage type in the box score
+DEFAULT_TYPE_WEIGHTS = {
+    "Pothole": 1.0,
+    "Alligator Crack": 0.8,
+    "Transverse Crack": 0.5,
+    "Longitudinal Crack": 0.5,
+    "Manhole": 0.2
+}
+
+SEVERITY_LABELS = {1: "low", 2: "medium", 3: "high"}
+
+# ============================================================================
+# MODEL
+# ============================================================================
+
+class SeverityModel:
+    """
+    Deterministic severity estimate from detections.
+
+    A box scores weight x confidence x (0.5 + 0.5 x extent), where extent is
+    the box's share of the image relative to `area_reference` (capped at 1).
+    The image scores its best box, plus `count_weight` per further box, plus
+    `density_weight` x the confidence-weighted share of the image covered by
+    boxes. Scores below thresholds[0] are severity 1, below thresholds[1]
+    severity 2, others severity 3. The confidence is the distance to the
+    nearest threshold divided by `band` (capped at 1).
+
+    Attributes:
+        type_weights: Weight of each damage type (unknown types: 0.5)
+        area_reference: Share of the image at which a box counts as large
+        count_weight: Score added per box beyond the first
+        density_weight: Score added per unit of damage density
+        thresholds: (low/medium, medium/high) score thresholds
+        band: Distance to a threshold at which the estimate is fully confident
+        min_confidence: Confidence needed to skip Gemini
+        enabled: False to always ask Gemini (SEVERITY_MODEL=gemini)
+        empty_policy: "gemini" to ask Gemini about images without detections,
+            "local" to report them as undamaged (SEVERITY_EMPTY_POLICY)
+    """
+
+    def __init__(self, type_weights=None, area_reference=0.1, count_weight=0.1, density_weight=0.5,
+                 thresholds=(0.3, 0.6), band=0.15, min_confidence=0.6, enabled=True, empty_policy="gemini"):
+        """
+        Initialize the model.
+
+        Args:
+            type_weights: Weight of each damage type (default: DEFAULT_TYPE_WEIGHTS)
+            area_reference: Share of the image at which a box counts as large
+            count_weight: Score added per box beyond the first
+            density_weight: Score added per unit of damage density
+            thresholds: (low/medium, medium/high) score thresholds
+            band: Distance to a threshold at which the estimate is fully confident
+            min_confidence: Confidence needed to skip Gemini
+            enabled: False to always ask Gemini
+            empty_policy: "gemini" or "local", for images without detections
+        """
+        self.type_weights = dict(type_weights or DEFAULT_TYPE_WEIGHTS)
+        self.area_reference = float(area_reference)
+        self.count_weight = float(count_weight)
+        self.density_weight = float(density_weight)
+        self.thresholds = tuple(sorted(float(t) for t in thresholds))
+        self.band = max(float(band), 1e-6)
+        self.min_confidence = float(min_confidence)
+        self.enabled = enabled
+        self.empty_policy = empty_policy
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a model from the calibration file and environment variables.
+
+        Returns:
+            SeverityModel: Calibrated model if SEVERITY_CALIBRATION_PATH
+                exists, otherwise the default parameters
+        """
+        path = os.getenv("SEVERITY_CALIBRATION_PATH", "severity_calibration.json")
+        model = cls.load(path) if os.path.exists(path) else cls()
+        model.min_confidence = float(os.getenv("SEVERITY_MIN_CONFIDENCE", str(model.min_confidence)))
+        model.enabled = os.getenv("SEVERITY_MODEL", "local").lower() == "local"
+        model.empty_policy = os.getenv("SEVERITY_EMPTY_POLICY", "gemini").lower()
+        return model
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a model saved with save().
+        """
+        with open(path) as f:
+            return cls(**json.load(f))
+
+    def save(self, path):
+        """
+        Save the model parameters as JSON.
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def fingerprint(self):
+        """
+        Return a short hash of everything that decides a report's severity.
+
+        Covers the (calibrated) parameters, the minimum confidence, the mode
+        and the empty-image policy; the result cache namespaces its entries
+        with it, so reports are not reused across severity configurations.
+        """
+        config = {**self.to_dict(), "enabled": self.enabled, "empty_policy": self.empty_policy}
+        return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+    def to_dict(self):
+        """
+        Return the model parameters as a dict (the arguments of __init__).
+        """
+        return {
+            "type_weights": self.type_weights,
+            "area_reference": self.area_reference,
+            "count_weight": self.count_weight,
+            "density_weight": self.density_weight,
+            "thresholds": list(self.thresholds),
+            "band": self.band,
+            "min_confidence": self.min_confidence
+        }
+
+    def box_scores(self, detections, image_size=None):
+        """
+        Score every box of an image at once.
+
+        Args:
+            detections: Dicts with "type", "confidence" and an xyxy "box"
+            image_size: Optional (width, height) the boxes refer to; without
+                it box area is ignored
+
+        Returns:
+            tuple: (scores, relative_areas, confidences) as (N,) arrays
+        """
+        if not detections:
+            empty = np.zeros(0)
+            return empty, empty, empty
+        weights = np.array([self.type_weights.get(det["type"], 0.5) for det in detections])
+        confidences = np.array([det["confidence"] for det in detections], dtype=np.float64)
+        boxes = np.array([det["box"] for det in detections], dtype=np.float64).reshape(-1, 4)
+        image_area = float(image_size[0] * image_size[1]) if image_size else 0.0
+        if image_area > 0:
+            box_areas = np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+            relative_areas = np.clip(box_areas / image_area, 0.0, 1.0)
+        else:
+            relative_areas = np.zeros(len(detections))
+        extent = np.minimum(1.0, relative_areas / self.area_reference)
+        return weights * confidences * (0.5 + 0.5 * extent), relative_areas, confidences
+
+    def score(self, detections, image_size=None):
+        """
+        Return the image score (0 without detections).
+        """
+        scores, relative_areas, confidences = self.box_scores(detections, image_size)
+        if not len(scores):
+            return 0.0
+        density = min(1.0, float(np.sum(relative_areas * confidences)))
+        return float(scores.max() + self.count_weight * (len(scores) - 1) + self.density_weight * density)
+
+    def classify(self, scores):
+        """
+        Map scores to severities and confidences.
+
+        Args:
+            scores: Array of image (or box) scores
+
+        Returns:
+            tuple: (severities, confidences) as arrays shaped like scores
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        thresholds = np.array(self.thresholds)
+        severities = 1 + np.searchsorted(thresholds, scores, side="right")
+        margins = np.abs(scores[..., None] - thresholds).min(axis=-1)
+        return severities, np.minimum(1.0, margins / self.band)
+
+    def estimate(self, detections, image_size=None):
+        """
+        Estimate the overall severity of an image.
+
+        Args:
+            detections: Dicts with "type", "confidence" and an xyxy "box"
+            image_size: Optional (width, height) the boxes refer to
+
+        Returns:
+            dict: severity (1-3), confidence (0-1), score and damage_score
+                (0-100); without detections the score says nothing, so the
+                estimate is severity 1 with confidence 0 and "empty": True
+                (see is_confident())
+        """
+        if not detections:
+            return {"severity": 1, "confidence": 0.0, "score": 0.0, "damage_score": 0.0, "empty": True}
+        score = self.score(detections, image_size)
+        severities, confidences = self.classify([score])
+        return {
+            "severity": int(severities[0]),
+            "confidence": round(float(confidences[0]), 3),
+            "score": round(score, 4),
+            "damage_score": round(min(100.0, 100.0 * score), 2)
+        }
+
+    def estimate_boxes(self, detections, image_size=None):
+        """
+        Estimate the severity of each box on its own.
+
+        Returns:
+            list: One estimate dict (as returned by estimate()) per detection
+        """
+        scores, _, _ = self.box_scores(detections, image_size)
+        severities, confidences = self.classify(scores)
+        return [
+            {
+                "severity": int(severity),
+                "confidence": round(float(confidence), 3),
+                "score": round(float(score), 4),
+                "damage_score": round(min(100.0, 100.0 * float(score)), 2)
+            }
+            for score, severity, confidence in zip(scores, severities, confidences)
+        ]
+
+    def is_confident(self, estimate):
+        """
+        Return True if the estimate can be used without asking Gemini.
+
+        Images without detections are decided by `empty_policy` rather than
+        by the confidence.
+        """
+        if estimate.get("empty"):
+            return self.enabled and self.empty_policy == "local"
+        return self.enabled and estimate["confidence"] >= self.min_confidence
+
+    # ------------------------------------------------------------------------
+    # Calibration
+    # ------------------------------------------------------------------------
+
+    def calibrate(self, scores, severities, target_accuracy=0.9):
+        """
+        Fit the thresholds and the confidence band to reference severities.
+
+        The thresholds maximize agreement with the reference severities over
+        all candidate pairs at once. The band is then the smallest one for
+        which the estimates confident enough to skip Gemini agree with the
+        reference at least `target_accuracy` of the time.
+
+        Args:
+            scores: Image scores (see score())
+            severities: Reference severities (1-3), e.g. from Gemini
+            target_accuracy: Required agreement of confident estimates
+
+        Returns:
+            dict: Sample count, agreement before and after fitting, and the
+                share and agreement of confident estimates
+
+        Raises:
+            ValueError: If there are too few samples
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        severities = np.asarray(severities, dtype=np.int64)
+        if len(scores) < 20:
+            raise ValueError(f"Need at least 20 samples to calibrate, got {len(scores)}.")
+        accuracy_before = float(np.mean(self.classify(scores)[0] == severities))
+
+        # Candidate thresholds between consecutive distinct scores; with
+        # below[k] = scores < candidate k, a pair (i < j) predicts severity 1
+        # for below[i], 2 for below[j] & ~below[i] and 3 otherwise
+        distinct = np.unique(scores)
+        candidates = np.concatenate([[distinct[0] - 1e-6], (distinct[:-1] + distinct[1:]) / 2, [distinct[-1] + 1e-6]])
+        if len(candidates) > 512:
+            candidates = np.unique(np.quantile(candidates, np.linspace(0, 1, 512)))
+        below = scores[None, :] < candidates[:, None]
+        low = (below & (severities == 1)).sum(axis=1)
+        medium = (below & (severities == 2)).sum(axis=1)
+        high = (below & (severities == 3)).sum(axis=1)
+        correct = low[:, None] + medium[None, :] - medium[:, None] + (severities == 3).sum() - high[None, :]
+        correct = np.where(np.triu(np.ones_like(correct, dtype=bool), k=1), correct, -1)
+        i, j = np.unravel_index(np.argmax(correct), correct.shape)
+        self.thresholds = (float(candidates[i]), float(candidates[j]))
+
+        # Largest share of samples, by distance to the nearest threshold,
+        # whose agreement still meets the target
+        predicted, _ = self.classify(scores)
+        margins = np.abs(scores[:, None] - np.array(self.thresholds)).min(axis=1)
+        order = np.argsort(-margins)
+        running = np.cumsum(predicted[order] == severities[order]) / np.arange(1, len(order) + 1)
+        meets = np.flatnonzero(running >= target_accuracy)
+        if len(meets):
+            self.band = max(float(margins[order][meets[-1]]) / max(self.min_confidence, 1e-6), 1e-6)
+        else:
+            self.band = float(margins.max()) / max(self.min_confidence, 1e-6) * 2 + 1e-6
+
+        confident = self.classify(scores)[1] >= self.min_confidence
+        return {
+            "samples": int(len(scores)),
+            "accuracy_before": round(accuracy_before, 3),
+            "accuracy": round(float(np.mean(predicted == severities)), 3),
+            "confident_share": round(float(np.mean(confident)), 3),
+            "confident_accuracy": round(float(np.mean(predicted[confident] == severities[confident])), 3)
+            if confident.any() else None
+        }
+
+
+# ============================================================================
+# CALIBRATION SAMPLES
+# ============================================================================
+
+def load_samples(path, model):
+    """
+    Read (score, Gemini severity) pairs from stored results.
+
+    Args:
+        path: Result cache SQLite database, or a JSON lines file whose lines
+            hold either a cached result ({"report": ...}) or {"detections",
+            "image_size", "severity"}
+        model: SeverityModel used to score samples given as detections
+
+    Returns:
+        tuple: (scores, severities) lists; results whose severity did not
+            come from Gemini are skipped
+    """
+    if path.endswith((".sqlite3", ".sqlite", ".db")):
+        conn = sqlite3.connect(path)
+        try:
+            records = [json.loads(row[0]) for row in conn.execute("SELECT value FROM results")]
+        finally:
+            conn.close()
+    else:
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+
+    scores, severities = [], []
+    for record in records:
+        report = record.get("report")
+        if report is not None:
+            if report.get("severity_source", "gemini") != "gemini" or report.get("pending_enrichment"):
+                continue
+            severity = report.get("overall_severity")
+            local = report.get("local_severity")
+            score = local["score"] if local else None
+        else:
+            severity = record.get("severity")
+            score = None
+        if score is None and "detections" in record:
+            score = model.score(record["detections"], record.get("image_size") or record.get("imageSize"))
+        if score is None or severity not in (1, 2, 3):
+            continue
+        scores.append(score)
+        severities.append(severity)
+    return scores, severities
+
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the local severity model against Gemini severities.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subparsers.add_parser("calibrate", help="Fit thresholds to stored Gemini severities")
+    calibrate_parser.add_argument("source", help="Result cache database (.sqlite3) or JSON lines file")
+    calibrate_parser.add_argument("--output", default=os.getenv("SEVERITY_CALIBRATION_PATH", "severity_calibration.json"),
+                                  help="Where to write the calibrated parameters")
+    calibrate_parser.add_argument("--target-accuracy", type=float, default=0.9,
+                                  help="Required agreement of estimates confident enough to skip Gemini")
+    arguments = parser.parse_args()
+
+    severity_model = SeverityModel.from_env()
+    sample_scores, sample_severities = load_samples(arguments.source, severity_model)
+    summary = severity_model.calibrate(sample_scores, sample_severities, arguments.target_accuracy)
+    severity_model.save(arguments.output)
+    print(json.dumps({**summary, "thresholds": severity_model.thresholds, "band": round(severity_model.band, 4)}))
+    print(f"✅ Calibration saved to {arguments.output}")
@@ -0,0 +1,180 @@
+"""
+Tiled (Sliced) Inference Helpers
+
+This module cuts a high-resolution image into overlapping tiles and merges
+the detections made on each tile back into whole-image coordinates. Small
+defects such as hairline cracks cover only a few pixels once a large frame
+is squeezed to the YOLO input size; on a tile they keep enough pixels to be
+detected. The tiles are meant to be run through the detector together with
+a downscaled full-frame pass, which still catches large damage that does
+not fit in one tile.
+
+Key Features:
+    - Evenly spaced, overlapping tile grid covering the whole image
+    - Tile budget: tiles grow (and are downscaled by YOLO) instead of
+      exceeding the maximum tile count
+    - Cross-tile merging by class-wise NMS or weighted box fusion (WBF)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import math
+
+# Third-party imports
+import numpy as np
+
+# Local imports
+from postprocess import to_numpy
+
+# ============================================================================
+# TILING
+# ============================================================================
+
+def tile_windows(width, height, tile_size=640, overlap=0.2, max_tiles=16):
+    """
+    Compute an overlapping tile grid for an image.
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        tile_size: Side of a square tile in pixels
+        overlap: Fraction of a tile shared with its neighbour (0 to <1)
+        max_tiles: Maximum number of tiles; larger tiles are used if needed
+
+    Returns:
+        list: (x0, y0, x1, y1) windows, or an empty list if the image fits
+            in a single tile
+    """
+    if max(width, height) <= tile_size:
+        return []
+
+    overlap = min(max(float(overlap), 0.0), 0.9)
+    while True:
+        stride = tile_size * (1.0 - overlap)
+        columns = max(1, math.ceil((width - tile_size) / stride) + 1) if width > tile_size else 1
+        rows = max(1, math.ceil((height - tile_size) / stride) + 1) if height > tile_size else 1
+        if columns * rows <= max(1, int(max_tiles)):
+            break
+        tile_size = math.ceil(tile_size * 1.25)
+
+    def starts(length, count):
+        if count == 1:
+            return [0]
+        return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+    tile_width, tile_height = min(tile_size, width), min(tile_size, height)
+    return [
+        (x0, y0, x0 + tile_width, y0 + tile_height)
+        for y0 in starts(height, rows)
+        for x0 in starts(width, columns)
+    ]
+
+
+def cut_tiles(image, windows):
+    """
+    Cut tiles out of an image (views, no pixel copies).
+
+    Args:
+        image: BGR NumPy array
+        windows: (x0, y0, x1, y1) windows from tile_windows()
+
+    Returns:
+        list: One array per window
+    """
+    return [image[y0:y1, x0:x1] for x0, y0, x1, y1 in windows]
+
+
+# ============================================================================
+# MERGING
+# ============================================================================
+
+def _iou(box, boxes):
+    """
+    IoU of one xyxy box against an (N, 4) array of boxes.
+    """
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def merge_detections(detections, iou_threshold=0.5, method="nms"):
+    """
+    Merge overlapping detections of the same class.
+
+    With "nms" the most confident box of each overlapping group is kept.
+    With "wbf" the group is fused into one box whose coordinates are the
+    confidence-weighted average of the group; its confidence is the highest
+    in the group, so a damage seen in only one tile is not penalized.
+
+    Args:
+        detections: (N, 6) array of [x1, y1, x2, y2, conf, cls] rows
+        iou_threshold: Minimum IoU for two boxes to be merged
+        method: "nms" or "wbf"
+
+    Returns:
+        numpy.ndarray: Merged (M, 6) array, sorted by confidence
+
+    Raises:
+        ValueError: If method is unknown
+    """
+    if method not in ("nms", "wbf"):
+        raise ValueError(f"Unknown tile merge method: {method}")
+
+    detections = to_numpy(detections)
+    merged = []
+    for cls in np.unique(detections[:, 5]):
+        remaining = detections[detections[:, 5] == cls]
+        remaining = remaining[np.argsort(-remaining[:, 4])]
+        while len(remaining):
+            matches = _iou(remaining[0, :4], remaining[:, :4]) >= iou_threshold
+            group = remaining[matches]
+            if method == "wbf":
+                weights = group[:, 4:5]
+                fused = (group[:, :4] * weights).sum(axis=0) / weights.sum()
+                merged.append([*fused, group[0, 4], cls])
+            else:
+                merged.append(group[0])
+            remaining = remaining[~matches]
+
+    if not merged:
+        return np.zeros((0, 6), dtype=np.float32)
+    merged = np.asarray(merged, dtype=np.float32)
+    return merged[np.argsort(-merged[:, 4])]
+
+
+def merge_tile_results(tile_boxes, windows, full_boxes=None, full_scale=1.0, iou_threshold=0.5, method="nms"):
+    """
+    Map per-tile detections to image coordinates and merge them.
+
+    Args:
+        tile_boxes: Detection data per tile (e.g. Results.boxes.data), in
+            the same order as windows
+        windows: (x0, y0, x1, y1) window of each tile
+        full_boxes: Optional detections of a full-frame pass
+        full_scale: Factor mapping full-frame coordinates to image coordinates
+        iou_threshold: Minimum IoU for two boxes to be merged
+        method: "nms" or "wbf"
+
+    Returns:
+        numpy.ndarray: Merged (M, 6) [x1, y1, x2, y2, conf, cls] array in
+            image coordinates
+    """
+    parts = []
+    for boxes, (x0, y0, _, _) in zip(tile_boxes, windows):
+        boxes = to_numpy(boxes).copy()
+        boxes[:, [0, 2]] += x0
+        boxes[:, [1, 3]] += y0
+        parts.append(boxes)
+    if full_boxes is not None:
+        boxes = to_numpy(full_boxes).copy()
+        boxes[:, :4] *= full_scale
+        parts.append(boxes)
+    if not parts:
+        return np.zeros((0, 6), dtype=np.float32)
+    return merge_detections(np.concatenate(parts), iou_threshold, method)
@@ -0,0 +1,291 @@
+"""
+Streaming Upload Parsing - Size-Limited Multipart Requests
+
+This module parses multipart/form-data request bodies as they arrive instead
+of letting the framework spool every upload to a temporary file first. Each
+file part is written into one buffer, checked against a size limit while it
+is still streaming, and handed to an optional callback as soon as it is
+complete, so decoding can start before the rest of the form has arrived.
+
+Key Features:
+    - Requests over the limit are rejected from Content-Length before any
+      body is read, or as soon as the streamed body crosses the limit
+    - Per-file and per-request size limits bound memory per request
+    - Images never touch the disk; each file is written into a single
+      bytearray, pre-sized from Content-Length when it is known, and handed
+      out as a read-only memoryview of it (no joined copy)
+    - BufferReader: seekable file object over such a view, for readers
+      that want a file (Pillow, zipfile) without copying the data
+    - Optional spooling of file parts to temporary files, for uploads too
+      large to hold in memory (videos)
+    - on_file callback fired per completed file part (early decode)
+
+Author: SafeStreet Team
+"""
+
+# Standard library imports
+import io
+import os
+import tempfile
+
+# Third-party imports
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+# Text form fields are small (IDs, flags); cap them independently of files
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """
+    Raised when an upload exceeds its size limit.
+    """
+
+
+class UploadPart:
+    """
+    One file from a multipart upload, held in memory or spooled to disk.
+
+    Attributes:
+        field_name: Form field the file was sent in
+        filename: Client-side file name
+        content_type: MIME type sent by the client
+        data: File content as a read-only memoryview, set once the part is
+            complete (empty bytes when the part was spooled)
+        path: Temporary file holding the content when spooled, else None
+    """
+
+    def __init__(self, field_name, filename, content_type):
+        """
+        Initialize an empty part.
+
+        Args:
+            field_name: Form field name
+            filename: Client-side file name
+            content_type: MIME type sent by the client
+        """
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.data = b""
+        self.path = None
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a bytes-like object.
+
+    io.BytesIO copies anything that is not bytes; this reads straight from
+    the buffer instead.
+    """
+
+    def __init__(self, data):
+        """
+        Initialize the reader.
+
+        Args:
+            data: Bytes-like object (bytes, bytearray, memoryview)
+        """
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = max(0, min(len(buffer), len(self._view) - self._position))
+        buffer[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+class _MultipartReader:
+    """
+    Incremental multipart/form-data parser with size limits.
+
+    File parts are written into one bytearray, allocated up front with room
+    for the rest of the body (capped at max_file_bytes) when its length is
+    known, and trimmed to size when the part ends.
+    """
+
+    def __init__(self, boundary, max_file_bytes, on_file=None, spool_files=False, body_bytes=None):
+        self.max_file_bytes = max_file_bytes
+        self.on_file = on_file
+        self.spool_files = spool_files
+        self.body_bytes = body_bytes
+        self._fed = 0
+        self._spool = None
+        self.fields = {}
+        self.files = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+        self._buffer = bytearray()
+        self._size = 0
+        self._part = None
+        self._field_name = None
+        self._parser = multipart.MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished
+        })
+
+    def feed(self, chunk):
+        self._parser.write(chunk)
+        self._fed += len(chunk)
+
+    def finish(self):
+        self._parser.finalize()
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._buffer = bytearray()
+        self._size = 0
+        self._part = None
+        self._field_name = None
+
+    def _on_header_field(self, data, start, end):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if b"name" not in options:
+            raise ValueError("Multipart part without a field name.")
+        self._field_name = options[b"name"].decode("utf-8")
+        if b"filename" in options:
+            content_type = self._headers.get(b"content-type", b"").decode("latin-1") or None
+            self._part = UploadPart(self._field_name, options[b"filename"].decode("utf-8"), content_type)
+            if self.spool_files:
+                suffix = os.path.splitext(self._part.filename)[1]
+                self._spool = tempfile.NamedTemporaryFile(prefix="upload_", suffix=suffix, delete=False)
+                self._part.path = self._spool.name
+                self.files.append(self._part)
+            elif self.body_bytes:
+                # Everything after the current chunk is an upper bound on the file
+                self._buffer = bytearray(max(0, min(self.body_bytes - self._fed, self.max_file_bytes)))
+
+    def _on_part_data(self, data, start, end):
+        self._size += end - start
+        if self._part is not None and self._size > self.max_file_bytes:
+            raise UploadTooLarge(f"File '{self._part.filename}' exceeds the {self.max_file_bytes} byte limit.")
+        if self._part is None and self._size > MAX_FIELD_BYTES:
+            raise UploadTooLarge(f"Form field '{self._field_name}' exceeds the {MAX_FIELD_BYTES} byte limit.")
+        if self._spool is not None:
+            self._spool.write(data[start:end])
+        else:
+            # In place while the pre-sized buffer has room, growing it otherwise
+            offset = self._size - (end - start)
+            self._buffer[offset:self._size] = memoryview(data)[start:end]
+
+    def _on_part_end(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+            if self.on_file:
+                self.on_file(self._part)
+            return
+        value = self._buffer
+        self._buffer = bytearray()
+        del value[self._size:]
+        if self._part is None:
+            self.fields.setdefault(self._field_name, []).append(value.decode("utf-8"))
+            return
+        self._part.data = memoryview(value).toreadonly()
+        self.files.append(self._part)
+        if self.on_file:
+            self.on_file(self._part)
+
+    def discard(self):
+        """Close and delete any spooled files."""
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        remove_spooled(self.files)
+
+
+def remove_spooled(files):
+    """
+    Delete the temporary files of spooled upload parts.
+
+    Args:
+        files: UploadPart objects returned by read_multipart()
+    """
+    for part in files:
+        if part.path:
+            try:
+                os.remove(part.path)
+            except FileNotFoundError:
+                pass
+            part.path = None
+
+
+async def read_multipart(request, max_file_bytes, max_total_bytes, on_file=None, spool_files=False):
+    """
+    Parse a multipart/form-data request body while it streams in.
+
+    Args:
+        request: Starlette/FastAPI Request
+        max_file_bytes: Maximum size of a single file
+        max_total_bytes: Maximum size of the whole request body
+        on_file: Optional callable invoked with each UploadPart as soon as
+            it is complete (before the rest of the body has been read)
+        spool_files: Write file parts to temporary files (UploadPart.path)
+            instead of memory; the caller deletes them with remove_spooled()
+
+    Returns:
+        tuple: (fields, files) where fields maps each text field name to a
+            list of values and files is a list of UploadPart in request order
+
+    Raises:
+        UploadTooLarge: If the body or a single file exceeds its limit
+        ValueError: If the body is not valid multipart/form-data
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise ValueError("Expected a multipart/form-data request.")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_total_bytes:
+        raise UploadTooLarge(f"Request body of {content_length} bytes exceeds the {max_total_bytes} byte limit.")
+
+    body_bytes = int(content_length) if content_length and content_length.isdigit() else None
+    reader = _MultipartReader(options[b"boundary"], max_file_bytes, on_file, spool_files, body_bytes)
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_total_bytes:
+                raise UploadTooLarge(f"Request body exceeds the {max_total_bytes} byte limit.")
+            reader.feed(chunk)
+        reader.finish()
+    except BaseException:
+        reader.discard()
+        raise
+    return reader.fields, reader.files